@@ -0,0 +1,537 @@
+"""
+Фабрика OpenAI-совместимых клиентов для AI-классификации и обогащения.
+
+Бэкенд задаётся переменными окружения (или configure() из кода):
+    AI_BACKEND=openai     — OpenAI SDK (по умолчанию); AI_BASE_URL — любой совместимый сервер,
+                            например локальный stub: python ai_client.py serve --port 8765
+    AI_BACKEND=fake       — in-process заглушка без сети
+    AI_CASSETTE=file.json — запись/воспроизведение ответов, AI_CASSETTE_MODE=record|replay
+
+Инъекция задержек и ошибок (fake и stub-сервер):
+    AI_LATENCY_MS, AI_LATENCY_JITTER_MS, AI_RATE_LIMIT_RATE (доля 429), AI_ERROR_RATE (доля 500),
+    AI_SEED — для воспроизводимости; AI_MAX_RETRIES — ретраи OpenAI SDK.
+
+Защита от зависшего или падающего эндпоинта (все бэкенды):
+    AI_TIMEOUT_S (30)            — таймаут запроса; клиент OpenAI один на процесс и ключ,
+                                   с пулом keep-alive соединений (AI_MAX_CONNECTIONS, 20)
+    AI_BREAKER_FAILURES (5)      — столько ошибок подряд (5xx, 429, таймаут, обрыв) открывают
+    AI_BREAKER_COOLDOWN_S (30)     предохранитель: запросы сразу падают с CircuitOpenError,
+                                   вызывающий код уходит в fallback; после паузы — пробный запрос
+    AI_TOKENS_PER_MIN (0 — без лимита) — общий token bucket классификации и обогащения;
+                                   если ждать токены дольше AI_BUCKET_MAX_WAIT_S (10) — AIBudgetError
+
+Заглушка отвечает детерминированно: категория — по совпадению слов названия
+с категориями из промпта (иначе по crc32), габариты — от CATEGORY_DEFAULTS_BUILTIN.
+"""
+import functools
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+import metrics
+
+_openai_cls = None
+
+
+@functools.lru_cache(maxsize=None)
+def _openai_installed() -> bool:
+    import importlib.util
+
+    return importlib.util.find_spec("openai") is not None
+
+
+def _openai():
+    """
+    Класс OpenAI SDK, импортируется при первом реальном запросе (импорт пакета ~0.5 с).
+    None — пакет не установлен; ошибка импорта установленного пакета не скрывается.
+    """
+    global _openai_cls
+    if _openai_cls is None:
+        if not _openai_installed():
+            return None
+        from openai import OpenAI
+
+        _openai_cls = OpenAI
+    return _openai_cls
+
+
+_overrides: Dict = {}
+_shared: Dict = {}
+
+
+def configure(**kwargs):
+    """Переопределяет настройки окружения из кода (бенчмарки, нагрузочные тесты)."""
+    _overrides.update(kwargs)
+
+
+@functools.lru_cache(maxsize=1)
+def _env_config() -> Dict:
+    """Переменные окружения читаются один раз на процесс (config() вызывается на каждый запрос)."""
+    env = os.environ
+    return {
+        "backend": env.get("AI_BACKEND", "openai"),
+        "base_url": env.get("AI_BASE_URL", ""),
+        "cassette": env.get("AI_CASSETTE", ""),
+        "cassette_mode": env.get("AI_CASSETTE_MODE", "replay"),
+        "latency_ms": float(env.get("AI_LATENCY_MS", 0)),
+        "latency_jitter_ms": float(env.get("AI_LATENCY_JITTER_MS", 0)),
+        "rate_limit_rate": float(env.get("AI_RATE_LIMIT_RATE", 0)),
+        "error_rate": float(env.get("AI_ERROR_RATE", 0)),
+        "seed": int(env.get("AI_SEED", 0)),
+        "max_retries": int(env.get("AI_MAX_RETRIES", 2)),
+        "timeout_s": float(env.get("AI_TIMEOUT_S", 30)),
+        "max_connections": int(env.get("AI_MAX_CONNECTIONS", 20)),
+        "breaker_failures": int(env.get("AI_BREAKER_FAILURES", 5)),
+        "breaker_cooldown_s": float(env.get("AI_BREAKER_COOLDOWN_S", 30)),
+        "tokens_per_min": float(env.get("AI_TOKENS_PER_MIN", 0)),
+        "bucket_max_wait_s": float(env.get("AI_BUCKET_MAX_WAIT_S", 10)),
+    }
+
+
+def config() -> Dict:
+    return {**_env_config(), **_overrides}
+
+
+def is_enabled(api_key: str) -> bool:
+    """Можно ли обращаться к модели: есть ключ или настроен локальный бэкенд."""
+    cfg = config()
+    if cfg["backend"] == "fake" or cfg["base_url"]:
+        return True
+    if cfg["cassette"] and cfg["cassette_mode"] == "replay":
+        return True
+    return bool(api_key) and _openai_installed()
+
+
+class AIRateLimitError(Exception):
+    status_code = 429
+
+
+class AIServerError(Exception):
+    status_code = 500
+
+
+class CassetteMissError(Exception):
+    """В режиме replay нет записанного ответа на запрос."""
+
+
+class CircuitOpenError(Exception):
+    """Эндпоинт недавно падал подряд — запрос не отправляется до конца паузы."""
+
+
+class AIBudgetError(Exception):
+    """Общий лимит токенов исчерпан дольше, чем можно ждать."""
+
+
+# ── Детерминированные ответы ───────────────────────────────────────
+def _approx_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def fake_reply(model: str, messages: list) -> str:
+    """Ответ заглушки на промпты get_ai_category / enrich_product_via_ai."""
+    user = messages[-1]["content"]
+    header = next((h for h in ("Категории:", "Группы:") if h in user), None)
+    if header:
+        head, _, tail = user.partition(header)
+        cats = [line[2:].strip() for line in tail.split("\n") if line.startswith("- ")]
+        if not cats:
+            return "Неизвестно"
+        words = {w[:5] for w in head.lower().replace(":", " ").split() if len(w) >= 4}
+        best, best_score = None, (0, 0)
+        for cat in cats:
+            cat_words = cat.lower().replace(",", " ").split()
+            score = (sum(1 for cw in cat_words if len(cw) >= 4 and cw[:5] in words), -len(cat_words))
+            if score[0] and score > best_score:
+                best, best_score = cat, score
+        return best or cats[zlib.crc32(head.encode()) % len(cats)]
+
+    from pim_enrich import CATEGORY_DEFAULTS_BUILTIN, guess_category_by_name
+
+    defaults = CATEGORY_DEFAULTS_BUILTIN[guess_category_by_name(user)]
+    h = zlib.crc32(user.encode())
+    k = 0.8 + (h % 41) / 100.0  # ±20% вокруг средних категории, стабильно для названия
+    return json.dumps({
+        "length_cm": round(defaults["length_cm"] * k, 1),
+        "width_cm": round(defaults["width_cm"] * k, 1),
+        "height_cm": round(defaults["height_cm"] * k, 1),
+        "weight_kg": round(defaults["weight_kg"] * k, 2),
+    })
+
+
+def _response(model: str, content: str, messages: list) -> SimpleNamespace:
+    prompt_tokens = sum(_approx_tokens(m["content"]) for m in messages)
+    completion_tokens = _approx_tokens(content)
+    return SimpleNamespace(
+        model=model,
+        choices=[SimpleNamespace(index=0, finish_reason="stop",
+                                 message=SimpleNamespace(role="assistant", content=content))],
+        usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                              total_tokens=prompt_tokens + completion_tokens),
+    )
+
+
+class _Injector:
+    """Задержка и случайные 429/500 по настройкам (общий для fake и stub-сервера)."""
+
+    def __init__(self, cfg: Dict):
+        self.cfg = cfg
+        self.rng = random.Random(cfg["seed"])
+        self.lock = threading.Lock()
+
+    def apply(self):
+        with self.lock:
+            jitter = self.rng.uniform(-1, 1) * self.cfg["latency_jitter_ms"]
+            roll = self.rng.random()
+        delay = max(0.0, self.cfg["latency_ms"] + jitter) / 1000.0
+        if delay:
+            time.sleep(delay)
+        if roll < self.cfg["rate_limit_rate"]:
+            raise AIRateLimitError("429 Too Many Requests (injected)")
+        if roll < self.cfg["rate_limit_rate"] + self.cfg["error_rate"]:
+            raise AIServerError("500 Internal Server Error (injected)")
+
+
+class FakeOpenAI:
+    """In-process клиент с интерфейсом client.chat.completions.create(...)."""
+
+    def __init__(self, cfg: Optional[Dict] = None):
+        injector = _Injector(cfg or config())
+
+        def create(model, messages, **kwargs):
+            injector.apply()
+            return _response(model, fake_reply(model, messages), messages)
+
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=create))
+
+
+# ── Кассеты record/replay ──────────────────────────────────────────
+class CassetteClient:
+    """Оборачивает клиента: replay — ответы из файла, record — дописывает новые ответы."""
+
+    def __init__(self, path: str, mode: str, make_inner):
+        self.path = path
+        self.mode = mode
+        self.make_inner = make_inner
+        self.inner = None
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    @staticmethod
+    def key(model: str, messages: list, kwargs: Dict) -> str:
+        payload = {"model": model, "messages": messages,
+                   "params": {k: kwargs[k] for k in sorted(kwargs) if k in ("temperature", "max_tokens")}}
+        return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+
+    def _create(self, model, messages, **kwargs):
+        k = self.key(model, messages, kwargs)
+        entry = self.entries.get(k)
+        if entry is not None:
+            return _response(model, entry["content"], messages)
+        if self.mode != "record":
+            raise CassetteMissError(f"no cassette entry for request {k[:12]}")
+        if self.inner is None:
+            self.inner = self.make_inner()
+        resp = self.inner.chat.completions.create(model=model, messages=messages, **kwargs)
+        with self.lock:
+            self.entries[k] = {"model": model, "content": resp.choices[0].message.content}
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, self.path)
+        return resp
+
+
+def _http_client(cfg: Dict):
+    """httpx-клиент с пулом keep-alive соединений (httpx ставится вместе с openai)."""
+    try:
+        import httpx
+    except ImportError:
+        return None
+    limits = httpx.Limits(max_connections=cfg["max_connections"], max_keepalive_connections=cfg["max_connections"])
+    return httpx.Client(limits=limits, timeout=cfg["timeout_s"])
+
+
+def get_client(api_key: str):
+    """
+    Клиент с интерфейсом OpenAI SDK согласно config(). Клиенты живут на процесс:
+    fake — общий генератор инъекций, кассета — один раз прочитанный файл, OpenAI —
+    переиспользуемые соединения и TLS-сессии (по одному клиенту на ключ).
+    """
+    cfg = config()
+
+    def make_inner():
+        if cfg["backend"] == "fake":
+            return FakeOpenAI(cfg)
+        OpenAI = _openai()
+        if OpenAI is None:
+            raise RuntimeError("openai package not installed")
+        kwargs = {"api_key": api_key or "local-stub", "max_retries": cfg["max_retries"], "timeout": cfg["timeout_s"]}
+        if cfg["base_url"]:
+            kwargs["base_url"] = cfg["base_url"]
+        http_client = _http_client(cfg)
+        if http_client is not None:
+            kwargs["http_client"] = http_client
+        return OpenAI(**kwargs)
+
+    shared_key = json.dumps(cfg, sort_keys=True)
+    if cfg["cassette"]:
+        factory = lambda: CassetteClient(cfg["cassette"], cfg["cassette_mode"], make_inner)  # noqa: E731
+    elif cfg["backend"] == "fake":
+        factory = make_inner
+    else:
+        shared_key += "\0" + hashlib.sha256((api_key or "").encode()).hexdigest()
+        factory = make_inner
+    client = _shared.get(shared_key)
+    if client is None:
+        with _shared_lock:
+            client = _shared.get(shared_key)
+            if client is None:
+                client = _shared[shared_key] = factory()
+    return client
+
+
+# ── Предохранитель и общий лимит токенов ───────────────────────────
+class CircuitBreaker:
+    """closed → (N ошибок подряд) → open → (пауза) → half-open: один пробный запрос."""
+
+    def __init__(self, name: str, failures: int, cooldown_s: float):
+        self.name = name
+        self.failures = failures
+        self.cooldown_s = cooldown_s
+        self.lock = threading.Lock()
+        self.errors = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    def _gauge(self, state: float):
+        metrics.set_gauge("ai_circuit_open", state, {"endpoint": self.name},
+                          "Предохранитель AI: 0 — закрыт, 0.5 — пробный запрос, 1 — открыт")
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if self.probing or time.monotonic() - self.opened_at < self.cooldown_s:
+                metrics.inc("ai_circuit_rejections_total", 1, {"endpoint": self.name},
+                            "Запросы, отклонённые открытым предохранителем")
+                raise CircuitOpenError(f"AI endpoint {self.name} is failing, retry in {self.cooldown_s:.0f}s")
+            self.probing = True
+        self._gauge(0.5)
+
+    def release(self):
+        """Запрос не дошёл до эндпоинта (лимит токенов, нет кассеты) — состояние не меняется."""
+        with self.lock:
+            self.probing = False
+
+    def record(self, ok: bool):
+        with self.lock:
+            self.probing = False
+            if ok:
+                self.errors, self.opened_at = 0, None
+            else:
+                self.errors += 1
+                if self.opened_at is not None or self.errors >= self.failures:
+                    self.opened_at = time.monotonic()
+            state = 0.0 if self.opened_at is None else 1.0
+        self._gauge(state)
+
+
+class TokenBucket:
+    """Токены модели в минуту на процесс; запрос резервирует оценку и доплачивает по факту."""
+
+    def __init__(self, per_min: float):
+        self.rate = per_min / 60.0
+        self.capacity = per_min
+        self.tokens = per_min
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, n: int, max_wait_s: float):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = max(0.0, (n - self.tokens) / self.rate)
+            if wait > max_wait_s:
+                metrics.inc("ai_budget_rejections_total", 1, help_text="Запросы, не дождавшиеся лимита токенов")
+                raise AIBudgetError(f"token budget exhausted, need to wait {wait:.0f}s")
+            self.tokens -= n
+        if wait:
+            metrics.observe("ai_budget_wait_seconds", wait, help_text="Ожидание лимита токенов")
+            time.sleep(wait)
+
+    def settle(self, reserved: int, used: int):
+        with self.lock:
+            self.tokens += reserved - used
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_buckets: Dict[float, TokenBucket] = {}
+_shared_lock = threading.Lock()
+
+
+def _guards(cfg: Dict):
+    endpoint = cfg["base_url"] or cfg["backend"]
+    with _shared_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(endpoint, cfg["breaker_failures"],
+                                                           cfg["breaker_cooldown_s"])
+        bucket = None
+        if cfg["tokens_per_min"] > 0:
+            bucket = _buckets.get(cfg["tokens_per_min"])
+            if bucket is None:
+                bucket = _buckets[cfg["tokens_per_min"]] = TokenBucket(cfg["tokens_per_min"])
+    return breaker, bucket
+
+
+def _is_outage(e: BaseException) -> bool:
+    """
+    Ошибки эндпоинта, а не запроса: 5xx, 429, таймауты и обрывы соединения. Прочие
+    исключения (TypeError от неверных аргументов, ошибки fake/кассет) предохранитель
+    не трогают — иначе ошибка в коде молча переводила бы всё на fallback.
+    """
+    code = getattr(e, "status_code", None)
+    if code is not None:
+        return code == 429 or code >= 500
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    # Классы SDK — только если пакет уже загружен реальным запросом: проверка его не импортирует
+    openai, httpx = sys.modules.get("openai"), sys.modules.get("httpx")
+    if openai is not None and isinstance(e, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return httpx is not None and isinstance(e, httpx.TransportError)
+
+
+def create_chat(client, client_key: str, **kwargs):
+    """
+    client.chat.completions.create(...) с таймаутом, предохранителем, общим лимитом
+    токенов и метриками (запросы, задержка, ошибки, токены).
+    """
+    cfg = config()
+    breaker, bucket = _guards(cfg)
+    kwargs.setdefault("timeout", cfg["timeout_s"])
+    breaker.before_call()
+    reserved = 0
+    if bucket is not None:
+        reserved = sum(_approx_tokens(str(m.get("content", ""))) for m in kwargs.get("messages", [])) \
+            + int(kwargs.get("max_tokens") or 300)
+        try:
+            bucket.acquire(reserved, cfg["bucket_max_wait_s"])
+        except AIBudgetError:
+            breaker.release()
+            raise
+    t0 = time.perf_counter()
+    try:
+        resp = client.chat.completions.create(**kwargs)
+    except Exception as e:
+        if _is_outage(e):
+            breaker.record(False)
+        else:
+            breaker.release()
+        if bucket is not None:
+            bucket.settle(reserved, 0)
+        metrics.observe_ai_call(client_key, kwargs.get("model", ""), time.perf_counter() - t0, error=e)
+        raise
+    breaker.record(True)
+    usage = getattr(resp, "usage", None)
+    if bucket is not None:
+        bucket.settle(reserved, int(getattr(usage, "total_tokens", 0) or reserved))
+    metrics.observe_ai_call(client_key, kwargs.get("model", ""), time.perf_counter() - t0, usage=usage)
+    return resp
+
+
+# ── Локальный OpenAI-совместимый stub-сервер ───────────────────────
+def serve(host: str = "127.0.0.1", port: int = 8765):
+    """HTTP-сервер с /v1/chat/completions и /v1/models, с инъекцией задержек и ошибок."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    injector = _Injector(config())
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, code: int, payload: Dict, headers: Optional[Dict] = None):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send(200, {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model"},
+                                                            {"id": "gpt-4o", "object": "model"}]})
+            else:
+                self._send(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send(404, {"error": {"message": "not found"}})
+                return
+            req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            try:
+                injector.apply()
+            except AIRateLimitError as e:
+                self._send(429, {"error": {"message": str(e), "type": "rate_limit_exceeded"}},
+                           {"Retry-After": "1"})
+                return
+            except AIServerError as e:
+                self._send(500, {"error": {"message": str(e), "type": "server_error"}})
+                return
+            model = req.get("model", "gpt-4o-mini")
+            messages = req.get("messages", [])
+            resp = _response(model, fake_reply(model, messages), messages)
+            self._send(200, {
+                "id": f"chatcmpl-stub-{zlib.crc32(json.dumps(messages).encode()):08x}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": resp.choices[0].message.content}}],
+                "usage": vars(resp.usage),
+            })
+
+        def log_message(self, fmt, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"AI stub listening on http://{host}:{port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Локальный OpenAI-совместимый stub")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_serve = sub.add_parser("serve")
+    p_serve.add_argument("--host", default="127.0.0.1")
+    p_serve.add_argument("--port", type=int, default=8765)
+    p_serve.add_argument("--latency-ms", type=float)
+    p_serve.add_argument("--rate-limit-rate", type=float)
+    p_serve.add_argument("--error-rate", type=float)
+    args = parser.parse_args()
+    configure(**{k: v for k, v in {
+        "latency_ms": args.latency_ms,
+        "rate_limit_rate": args.rate_limit_rate,
+        "error_rate": args.error_rate,
+    }.items() if v is not None})
+    serve(args.host, args.port)
@@ -0,0 +1,418 @@
+"""
+Бенчмарки сервиса: импорт каталога, AI-классификация (кэш / заглушка модели),
+расчёт по маркетплейсам, фильтрация и экспорт PIM, обогащение, kNN-заполнение габаритов.
+
+Usage:
+    python benchmark.py                                  # все сценарии на 10k/100k/1M SKU
+    python benchmark.py --sizes 10000 --only pricing_mvideo,import
+    python benchmark.py --threshold 15                   # регрессия = хуже медианы истории на 15%
+
+Каждый сценарий выполняется в отдельном процессе (чтобы пиковый RSS не
+смешивался между сценариями). Результаты — время, строк/сек и пиковый RSS —
+дописываются в benchmark_history.json; при регрессии код выхода 1.
+Данные генерируются generate_sample_catalog и кэшируются в .bench_data/.
+Модель в сценариях ai_category_model / enrich — in-process заглушка ai_client
+(задержки и ошибки задаются переменными AI_LATENCY_MS, AI_RATE_LIMIT_RATE и др.).
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+HISTORY_FILE = "benchmark_history.json"
+DATA_DIR = ".bench_data"
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+PARAMS = {
+    "tax_regime": "УСН Доходы (6%)",
+    "target_margin": 20.0,
+    "acquiring": 1.5,
+    "early_payout": 0.0,
+    "marketing": 0.0,
+    "extra_costs": 0.0,
+    "extra_logistics": 0.0,
+}
+
+# Сценарии, где каждая строка — вызов модели или тяжёлый Excel, ограничены по объёму
+MAX_ROWS = {"ai_category_model": 20_000, "enrich": 20_000, "pim_export": 100_000}
+
+
+# ── Подготовка данных ───────────────────────────────────────────────
+def catalog_db(size: int, seed: int = 42) -> str:
+    """Путь к SQLite-каталогу на size строк (генерируется один раз)."""
+    import generate_sample_catalog as gen
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, f"catalog_{size}_{seed}.db")
+    if not os.path.exists(path):
+        tmp = path + ".tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        gen.write_sqlite(gen.iter_products(size, seed=seed), tmp)
+        os.replace(tmp, path)
+    return path
+
+
+def _work_copy(size: int, case: str) -> str:
+    path = os.path.join(DATA_DIR, f"work_{case}_{size}.db")
+    shutil.copyfile(catalog_db(size), path)
+    return path
+
+
+def _warm_ai_cache(conn, client_key: str, categories: list):
+    """Заполняет ai_cache для всех названий — расчёт меряется на «тёплом» кэше."""
+    import names
+
+    product_names = [r[0] for r in conn.execute("SELECT DISTINCT name FROM products")]
+    conn.executemany(
+        "INSERT OR REPLACE INTO ai_cache (name, client, category, source, name_key) VALUES (?,?,?,?,?)",
+        [(n, client_key, categories[zlib.crc32(n.encode()) % len(categories)], "model", names.name_key(n))
+         for n in product_names],
+    )
+    conn.commit()
+
+
+def _products(conn):
+    import columnar
+
+    return columnar.read_catalog(conn)
+
+
+# ── Сценарии: каждый возвращает (rows, seconds) ─────────────────────
+def bench_import(size):
+    import pandas as pd
+    import core
+    import generate_sample_catalog as gen
+    import pim
+
+    df = pd.DataFrame(list(gen.iter_products(size)))
+    path = os.path.join(DATA_DIR, f"work_import_{size}.db")
+    if os.path.exists(path):
+        os.remove(path)
+    conn = core.init_db(path)
+    t0 = time.perf_counter()
+    rows = pim.import_catalog(conn, df, core.normalize_value, "см", "кг")
+    return rows, time.perf_counter() - t0
+
+
+def bench_ai_category_cached(size):
+    import core
+    import mvideo
+
+    conn = core.init_db(_work_copy(size, "ai_cached"))
+    cats = list(mvideo.COMMISSIONS.keys())
+    _warm_ai_cache(conn, "mvideo", cats)
+    names = [r[0] for r in conn.execute("SELECT name FROM products")]
+    t0 = time.perf_counter()
+    for name in names:
+        core.get_ai_category(name, cats, conn, "mvideo", api_key="bench")
+    return len(names), time.perf_counter() - t0
+
+
+def bench_ai_category_model(size):
+    import ai_client
+    import core
+    import sportmaster_fbs
+
+    ai_client.configure(backend="fake")
+    conn = core.init_db(_work_copy(size, "ai_model"))
+    conn.execute("DELETE FROM ai_cache")
+    cats = list(sportmaster_fbs.CATEGORY_COMMISSIONS.keys())
+    names = [r[0] for r in conn.execute("SELECT DISTINCT name FROM products LIMIT ?", (size,))]
+    t0 = time.perf_counter()
+    for name in names:
+        core.get_ai_category(name, cats, conn, "sportmaster", api_key="bench")
+    return len(names), time.perf_counter() - t0
+
+
+def _bench_pricing(size, module_name, client_key, extra_args=()):
+    import importlib
+    import core
+
+    module = importlib.import_module(module_name)
+    commissions = getattr(module, "CATEGORY_COMMISSIONS", None) or module.COMMISSIONS
+    conn = core.init_db(_work_copy(size, client_key))
+    _warm_ai_cache(conn, client_key, list(commissions.keys()))
+    products = _products(conn)
+    t0 = time.perf_counter()
+    results = module.calculate(conn, products, core.get_ai_category, core.calc_tax, PARAMS, *extra_args)
+    return len(results), time.perf_counter() - t0
+
+
+def bench_pricing_mvideo(size):
+    return _bench_pricing(size, "mvideo", "mvideo")
+
+
+def bench_pricing_lemanpro(size):
+    import lemanpro_fbs
+    return _bench_pricing(size, "lemanpro_fbs", "lemanpro", (lemanpro_fbs.CATEGORY_COMMISSIONS, "Регион"))
+
+
+def bench_pricing_dns(size):
+    import dns
+    return _bench_pricing(size, "dns", "dns", (dns.CATEGORY_COMMISSIONS,))
+
+
+def bench_pricing_citilink(size):
+    import citilink
+    return _bench_pricing(size, "citilink", "citilink", (citilink.CATEGORY_COMMISSIONS,))
+
+
+def bench_pricing_sportmaster(size):
+    return _bench_pricing(size, "sportmaster_fbs", "sportmaster")
+
+
+def bench_pricing_pool(size):
+    """М.Видео в PRICING_PROCESSES процессах — сравнивать с pricing_mvideo (плюс запись CSV)."""
+    import core
+    import mvideo
+    import pricing_pool
+
+    path = _work_copy(size, "pricing_pool")
+    conn = core.init_db(path)
+    _warm_ai_cache(conn, "mvideo", list(mvideo.COMMISSIONS.keys()))
+    conn.close()
+    out = os.path.join(DATA_DIR, f"work_pricing_pool_{size}.csv")
+    t0 = time.perf_counter()
+    rows = pricing_pool.run(path, "mvideo", (PARAMS,), out)
+    return rows, time.perf_counter() - t0
+
+
+def bench_history_diff(size):
+    """Сравнение двух прогонов М.Видео из истории (второй — с другой маржой); нужен pyarrow."""
+    import core
+    import mvideo
+    import run_history
+
+    run_history.HISTORY_DIR = os.path.join(DATA_DIR, f"history_{size}")
+    conn = core.init_db(_work_copy(size, "mvideo"))
+    _warm_ai_cache(conn, "mvideo", list(mvideo.COMMISSIONS.keys()))
+    products = _products(conn)
+    runs = []
+    for margin in (PARAMS["target_margin"], PARAMS["target_margin"] + 5):
+        params = {**PARAMS, "target_margin": margin}
+        out = os.path.join(DATA_DIR, f"work_history_{size}.csv")
+        mvideo.calculate(conn, products, core.get_ai_category, core.calc_tax, params).to_csv(out, index=False)
+        runs.append(run_history.save_csv(out, "mvideo", {"params": params}))
+    t0 = time.perf_counter()
+    run_history.diff_runs(*runs)
+    return len(products), time.perf_counter() - t0
+
+
+def bench_pricing_api(size):
+    """Запросы по одному SKU к pricing_api (без HTTP): первый проход считает, второй — из кэша строк."""
+    import pricing_api
+
+    path = _work_copy(size, "pricing_api")
+    pricer = pricing_api.Pricer(path)
+    pricer.warm()
+    with pricer.reader() as conn:
+        skus = [r[0] for r in conn.execute("SELECT sku FROM products WHERE sku IS NOT NULL LIMIT 5000")]
+    t0 = time.perf_counter()
+    for _ in range(2):
+        for sku in skus:
+            pricer.price("mvideo", [{"sku": sku}], {})
+    return 2 * len(skus), time.perf_counter() - t0
+
+
+def _pim_view(size):
+    import pandas as pd
+    import core
+
+    conn = core.init_db(catalog_db(size))
+    products = conn.execute("""
+        SELECT id, sku, name, brand, category, length_cm, width_cm, height_cm, weight_kg,
+               cost, ean, enrich_status, enrich_source
+        FROM products ORDER BY id DESC
+    """).fetchall()
+    return pd.DataFrame(products, columns=[
+        "ID", "SKU", "Название", "Бренд", "Категория",
+        "Длина (см)", "Ширина (см)", "Высота (см)", "Вес (кг)", "Себестоимость",
+        "EAN", "Статус обогащения", "Источник"
+    ])
+
+
+def bench_pim_filter(size):
+    import pim
+
+    df_view = _pim_view(size)
+    t0 = time.perf_counter()
+    pim.filter_catalog(df_view, ["Велосипеды", "Одежда", "Туризм"], [], False)
+    pim.filter_catalog(df_view, [], ["Shimano", "Columbia"], True)
+    pim.filter_catalog(df_view, [], [], True)
+    return len(df_view) * 3, time.perf_counter() - t0
+
+
+def bench_pim_export(size):
+    import pim
+
+    df_view = _pim_view(size).head(size)
+    t0 = time.perf_counter()
+    pim.export_excel(df_view)
+    return len(df_view), time.perf_counter() - t0
+
+
+def bench_enrich(size):
+    import ai_client
+    import core
+    import enrich_scheduler
+    import pim_enrich
+
+    ai_client.configure(backend="fake")
+    conn = core.init_db(_work_copy(size, "enrich"))
+    cols = ["id", "sku", "name", "brand", "category", "ean", "cost", "length_cm", "width_cm", "height_cm", "weight_kg"]
+    rows = conn.execute(f"""
+        SELECT {", ".join(cols)} FROM products
+        WHERE length_cm IS NULL OR weight_kg IS NULL LIMIT ?
+    """, (size,)).fetchall()
+    products = [dict(zip(cols, r)) for r in rows]
+    t0 = time.perf_counter()
+    for group in enrich_scheduler.schedule(conn, pim_enrich.plan_enrichment(products)):
+        # Как на странице PIM: результат представителя пишется всем вариантам группы
+        updated, method = pim_enrich.enrich_product(group[0], conn, "bench")
+        pim_enrich.save_enrichment(conn, updated, method, [p["id"] for p in group])
+    return len(products), time.perf_counter() - t0
+
+
+def bench_impute(size):
+    import core
+    import dim_impute
+
+    conn = core.init_db(_work_copy(size, "impute"))
+    t0 = time.perf_counter()
+    result = dim_impute.impute_missing(conn)
+    return result["missing"], time.perf_counter() - t0
+
+
+CASES = {
+    "import": bench_import,
+    "ai_category_cached": bench_ai_category_cached,
+    "ai_category_model": bench_ai_category_model,
+    "pricing_mvideo": bench_pricing_mvideo,
+    "pricing_lemanpro": bench_pricing_lemanpro,
+    "pricing_dns": bench_pricing_dns,
+    "pricing_citilink": bench_pricing_citilink,
+    "pricing_sportmaster": bench_pricing_sportmaster,
+    "pricing_pool": bench_pricing_pool,
+    "history_diff": bench_history_diff,
+    "pricing_api": bench_pricing_api,
+    "pim_filter": bench_pim_filter,
+    "pim_export": bench_pim_export,
+    "enrich": bench_enrich,
+    "impute": bench_impute,
+}
+
+
+def _run_case(case: str, size: int) -> dict:
+    """Выполняется в дочернем процессе."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    rows, seconds = CASES[case](size)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # Linux: КБ
+    return {
+        "case": case,
+        "size": size,
+        "rows": rows,
+        "seconds": round(seconds, 4),
+        "rows_per_sec": round(rows / seconds, 1) if seconds > 0 else 0.0,
+        "peak_rss_mb": round(peak_kb / 1024, 1),
+    }
+
+
+# ── История и регрессии ─────────────────────────────────────────────
+def load_history(path: str = HISTORY_FILE) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_history(history: list, path: str = HISTORY_FILE):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(history, f, ensure_ascii=False, indent=1)
+
+
+def check_regression(result: dict, history: list, threshold: float, window: int = 5):
+    """Сравнивает с медианой последних window запусков того же сценария и размера."""
+    prev = [h for h in history if h["case"] == result["case"] and h["size"] == result["size"]][-window:]
+    if not prev:
+        return []
+    problems = []
+    base_rps = statistics.median(h["rows_per_sec"] for h in prev)
+    if base_rps > 0 and result["rows_per_sec"] < base_rps * (1 - threshold / 100):
+        problems.append(f"rows/s {result['rows_per_sec']:.0f} < медианы {base_rps:.0f} на >{threshold}%")
+    base_rss = statistics.median(h["peak_rss_mb"] for h in prev)
+    if base_rss > 0 and result["peak_rss_mb"] > base_rss * (1 + threshold / 100):
+        problems.append(f"peak RSS {result['peak_rss_mb']:.0f} МБ > медианы {base_rss:.0f} МБ на >{threshold}%")
+    return problems
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарки unit-economics-service")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES))
+    parser.add_argument("--only", default="", help="Список сценариев через запятую")
+    parser.add_argument("--threshold", type=float, default=20.0, help="Допустимое ухудшение, %%")
+    parser.add_argument("--history", default=HISTORY_FILE)
+    parser.add_argument("--no-save", action="store_true", help="Не дописывать результаты в историю")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    cases = [c.strip() for c in args.only.split(",") if c.strip()] or list(CASES)
+    unknown = [c for c in cases if c not in CASES]
+    if unknown:
+        parser.error(f"Неизвестные сценарии: {unknown}. Доступны: {list(CASES)}")
+
+    history = load_history(args.history)
+    rev = _git_rev()
+    ts = time.strftime("%Y-%m-%dT%H:%M:%S")
+    ctx = multiprocessing.get_context("spawn")
+    failed = []
+    new_entries = []
+    done = set()
+
+    print(f"{'case':<22}{'size':>10}{'rows':>10}{'sec':>10}{'rows/s':>12}{'RSS, MB':>10}")
+    for size in sizes:
+        catalog_db(size)
+        for case in cases:
+            case_size = min(size, MAX_ROWS.get(case, size))
+            if (case, case_size) in done:
+                continue
+            done.add((case, case_size))
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as ex:
+                result = ex.submit(_run_case, case, case_size).result()
+            result.update({"ts": ts, "git_rev": rev})
+            problems = check_regression(result, history, args.threshold)
+            mark = "  REGRESSION: " + "; ".join(problems) if problems else ""
+            print(f"{case:<22}{case_size:>10}{result['rows']:>10}{result['seconds']:>10.3f}"
+                  f"{result['rows_per_sec']:>12.0f}{result['peak_rss_mb']:>10.1f}{mark}")
+            if problems:
+                failed.append((case, case_size, problems))
+            new_entries.append(result)
+
+    if not args.no_save:
+        save_history(history + new_entries, args.history)
+    if failed:
+        print(f"\n❌ Регрессии: {len(failed)}")
+        return 1
+    print("\n✅ Регрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""
+Сопоставление категорий PIM (products.category, опционально + бренд) с категориями маркетплейсов.
+
+Классифицируется не каждый SKU, а каждая категория PIM — один запрос к модели
+на категорию и маркетплейс, результат применяется ко всем её товарам:
+
+    get_category = category_mapping.bind(conn, core.get_ai_category)
+    mvideo.render(conn, get_category, ...)      # та же сигнатура, что у get_ai_category
+
+Ручные правки (в том числе для пары категория + бренд) имеют приоритет над
+ответом модели. Товары без категории PIM классифицируются по названию, как раньше.
+"""
+import sqlite3
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import ai_client
+import metrics
+import perf
+
+ANY_BRAND = ""
+
+
+def init_tables(c):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS category_mapping (
+            pim_category TEXT NOT NULL,
+            brand TEXT NOT NULL DEFAULT '',
+            client TEXT NOT NULL,
+            category TEXT NOT NULL,
+            source TEXT,
+            updated_at INTEGER,
+            PRIMARY KEY (pim_category, brand, client)
+        )
+    """)
+
+
+def set_mapping(conn: sqlite3.Connection, pim_category: str, client_key: str, category: str,
+                brand: str = ANY_BRAND, source: str = "manual"):
+    conn.execute("""
+        INSERT INTO category_mapping (pim_category, brand, client, category, source, updated_at)
+        VALUES (?,?,?,?,?,?)
+        ON CONFLICT(pim_category, brand, client) DO UPDATE SET
+            category=excluded.category, source=excluded.source, updated_at=excluded.updated_at
+    """, (pim_category, brand or ANY_BRAND, client_key, category, source, int(time.time())))
+    conn.commit()
+
+
+def load(conn: sqlite3.Connection, client_key: str) -> Dict[Tuple[str, str], Tuple[str, str]]:
+    """{(pim_category, brand): (category, source)} для маркетплейса."""
+    rows = conn.execute(
+        "SELECT pim_category, brand, category, source FROM category_mapping WHERE client=?", (client_key,)
+    ).fetchall()
+    return {(pc, brand): (cat, source) for pc, brand, cat, source in rows}
+
+
+def classify_pim_category(pim_category: str, categories: list, client_key: str, api_key: str) -> Optional[str]:
+    """Один запрос к модели на категорию PIM; None — модель недоступна или ответила вне списка."""
+    if not categories or not ai_client.is_enabled(api_key):
+        return None
+    cats_str = "\n".join(f"- {cat}" for cat in categories)
+    try:
+        client = ai_client.get_client(api_key)
+        with perf.span("classify_model", rows=1):
+            resp = ai_client.create_chat(
+                client, client_key,
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": (
+                        f"Ты сопоставляешь категории каталога с категориями маркетплейса {client_key}. "
+                        "Выбери ОДНУ категорию из списка. Ответь ТОЛЬКО её названием."
+                    )},
+                    {"role": "user", "content": f"Категория каталога: {pim_category}\nКатегории:\n{cats_str}"},
+                ],
+                max_tokens=60,
+                temperature=0,
+            )
+        category = resp.choices[0].message.content.strip()
+    except Exception:
+        return None
+    return category if category in categories else None
+
+
+def bind(conn: sqlite3.Connection, get_ai_category: Callable, api_key: Optional[str] = None) -> Callable:
+    """
+    Обёртка над get_ai_category: для товаров с категорией PIM — сопоставление категорий,
+    для остальных — исходная классификация по названию.
+
+    Индекс название → (категория PIM, бренд) и сопоставления читаются один раз на обёртку,
+    поэтому её нужно создавать на каждый запуск страницы.
+
+    Чтение и запись идут через соединение, переданное в вызов (как у get_ai_category):
+    фоновый расчёт работает со своим соединением, а не с соединением сессии, на котором
+    обёртка создана. conn — только для вызовов без соединения (conn_=None).
+    """
+    state = {"products": None, "mappings": {}, "unresolved": set()}
+
+    def products_index(c: sqlite3.Connection) -> Dict[str, Tuple[str, str]]:
+        if state["products"] is None:
+            rows = c.execute("""
+                SELECT name, category, COALESCE(brand, '') FROM products
+                WHERE category IS NOT NULL AND TRIM(category) <> ''
+            """).fetchall()
+            state["products"] = {name: (pc.strip(), brand.strip()) for name, pc, brand in rows}
+        return state["products"]
+
+    def resolve(c: sqlite3.Connection, pim_category: str, brand: str, categories: list,
+                client_key: str) -> Optional[str]:
+        mapping = state["mappings"].get(client_key)
+        if mapping is None:
+            mapping = state["mappings"][client_key] = load(c, client_key)
+        for key in ((pim_category, brand), (pim_category, ANY_BRAND)):
+            hit = mapping.get(key)
+            if hit and hit[0] in categories:
+                return hit[0]
+
+        if (client_key, pim_category) in state["unresolved"]:
+            return None
+        key_ = api_key
+        if key_ is None:
+            import streamlit as st
+            key_ = st.session_state.get("openai_key", "")
+        category = classify_pim_category(pim_category, categories, client_key, key_)
+        if category is None:
+            state["unresolved"].add((client_key, pim_category))  # не повторяем запрос для каждого SKU
+            return None
+        set_mapping(c, pim_category, client_key, category, source="model")
+        mapping[(pim_category, ANY_BRAND)] = (category, "model")
+        return category
+
+    def get_category(name: str, categories: list, conn_, client_key: str, *args, **kwargs) -> str:
+        c = conn if conn_ is None else conn_
+        pim = products_index(c).get(name)
+        if pim and categories:
+            category = resolve(c, pim[0], pim[1], categories, client_key)
+            metrics.cache_lookup("category_mapping", category is not None, client_key)
+            if category is not None:
+                perf.count("category_mapping_hit")
+                return category
+            perf.count("category_mapping_miss")
+        return get_ai_category(name, categories, c, client_key, *args, **kwargs)
+
+    return get_category
+
+
+def render_editor(conn: sqlite3.Connection, marketplaces: Dict[str, list]):
+    """Таблица сопоставлений для ручной правки (marketplaces: client_key -> категории)."""
+    import pandas as pd
+    import streamlit as st
+
+    client_key = st.selectbox("Маркетплейс", list(marketplaces), key="catmap_client")
+    categories = marketplaces[client_key]
+    pim_categories = [r[0] for r in conn.execute("""
+        SELECT DISTINCT TRIM(category) FROM products
+        WHERE category IS NOT NULL AND TRIM(category) <> '' ORDER BY 1
+    """)]
+    mapping = load(conn, client_key)
+    rows = [{"Категория PIM": pc, "Бренд": ANY_BRAND,
+             "Категория маркетплейса": mapping.get((pc, ANY_BRAND), (None, None))[0],
+             "Источник": mapping.get((pc, ANY_BRAND), (None, ""))[1]} for pc in pim_categories]
+    rows += [{"Категория PIM": pc, "Бренд": brand, "Категория маркетплейса": cat, "Источник": source}
+             for (pc, brand), (cat, source) in sorted(mapping.items()) if brand != ANY_BRAND]
+    st.caption(f"Категорий PIM: {len(pim_categories)}, сопоставлено: "
+               f"{sum(1 for pc in pim_categories if (pc, ANY_BRAND) in mapping)}. "
+               "Для отдельного бренда добавьте строку с заполненным «Бренд».")
+    edited = st.data_editor(
+        pd.DataFrame(rows, columns=["Категория PIM", "Бренд", "Категория маркетплейса", "Источник"]),
+        column_config={
+            "Категория маркетплейса": st.column_config.SelectboxColumn(options=categories),
+            "Источник": st.column_config.TextColumn(disabled=True),
+        },
+        num_rows="dynamic", use_container_width=True, hide_index=True, key=f"catmap_editor_{client_key}",
+    )
+    if st.button("💾 Сохранить сопоставления", key="catmap_save"):
+        saved = 0
+        cell = lambda v: "" if v is None or pd.isna(v) else str(v).strip()
+        for _, r in edited.iterrows():
+            pc, brand, cat = cell(r["Категория PIM"]), cell(r["Бренд"]), cell(r["Категория маркетплейса"])
+            if pc and cat and mapping.get((pc, brand), (None,))[0] != cat:
+                set_mapping(conn, pc, client_key, cat, brand=brand, source="manual")
+                saved += 1
+        st.success(f"Сохранено: {saved}")
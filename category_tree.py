@@ -0,0 +1,122 @@
+"""
+Двухэтапная классификация для длинных списков категорий (Спортмастер — 120+).
+
+Дерево строится автоматически по названиям категорий: категории с общей основой
+слова («Велосипеды», «Велокомпоненты», «Велоодежда» → «вело») собираются в группу,
+категории без пары остаются отдельными листьями верхнего уровня. Классификация:
+
+1. группа — по ключевым словам названия товара локально, а если совпадения нет
+   или оно неоднозначно — коротким промптом со списком групп (с одним примером) и листьев;
+   выбранный моделью лист сразу является ответом;
+2. категория — промптом только с категориями выбранной группы и вариантом NONE_OF_THESE.
+
+Если модель выбирает NONE_OF_THESE или отвечает вне списка, core.get_ai_category
+задаёт вопрос по полному списку — точность не ниже плоской схемы.
+"""
+import functools
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+MIN_CATEGORIES = int(os.environ.get("CATEGORY_TREE_MIN", 50))  # короче — плоский промпт
+STEM_LEN = 4
+MIN_GROUP = 2
+NONE_OF_THESE = "Нет подходящей"
+
+_WORD_RE = re.compile(r"[a-zа-я0-9]+")
+STOP_WORDS = {
+    "для", "и", "или", "на", "с", "в", "из", "по",
+    "аксессуары", "прочие", "иные", "категории", "взрослых", "детей", "специальная",
+    "спорта", "видов", "инвентарь", "наборы", "товары",
+}
+
+
+def stems(text: str) -> set:
+    """Основы слов (первые STEM_LEN букв) без служебных слов."""
+    words = _WORD_RE.findall(str(text).lower().replace("ё", "е"))
+    return {w[:STEM_LEN] for w in words if len(w) >= 3 and w not in STOP_WORDS and not w.isdigit()}
+
+
+class CategoryTree:
+    """Группы категорий (лист — группа из одной категории с её же названием) и индекс основ."""
+
+    def __init__(self, groups: Dict[str, List[str]]):
+        self.groups = groups
+        index: Dict[str, set] = {}
+        for g, cats in groups.items():
+            for cat in cats:
+                for s in stems(cat):
+                    index.setdefault(s, set()).add(g)
+        # Основа, встречающаяся во многих группах, почти ничего не говорит о группе
+        self.weights = {s: {g: 1.0 / len(gs) for g in gs} for s, gs in index.items()}
+
+    def match(self, name: str) -> Optional[str]:
+        """Группа по ключевым словам названия или None, если совпадений нет / лидеров несколько."""
+        scores = Counter()
+        for s in stems(name):
+            for g, w in self.weights.get(s, {}).items():
+                scores[g] += w
+        if not scores:
+            return None
+        (best, s1), *rest = scores.most_common(2)
+        if rest and rest[0][1] >= s1:
+            return None
+        return best
+
+    def is_leaf(self, group: str) -> bool:
+        return self.groups[group] == [group]
+
+    def options(self) -> List[str]:
+        """Варианты промпта первой стадии: «группа: самая короткая категория, …» и листья как есть."""
+        return [group if self.is_leaf(group) else f"{group}: {min(cats, key=len)}, …"
+                for group, cats in self.groups.items()]
+
+    def resolve(self, answer: str) -> Optional[str]:
+        """Группа по ответу первой стадии (модель может повторить примеры после двоеточия)."""
+        answer = answer.strip().strip("-").strip()
+        if answer in self.groups:
+            return answer
+        head = answer.split(":", 1)[0].strip()
+        return head if head in self.groups else None
+
+
+def build_groups(categories: List[str]) -> Dict[str, List[str]]:
+    """
+    Жадная группировка: на каждом шаге берётся основа, общая для наибольшего числа
+    ещё не распределённых категорий (не меньше MIN_GROUP). Название группы — самое частое
+    слово с этой основой. Оставшиеся категории становятся листьями.
+    """
+    cat_stems = {cat: stems(cat) for cat in categories}
+    words = Counter(w for cat in categories for w in _WORD_RE.findall(cat.lower().replace("ё", "е"))
+                    if w not in STOP_WORDS)
+    free = list(categories)
+    groups: Dict[str, List[str]] = {}
+    while True:
+        counts = Counter(s for cat in free for s in cat_stems[cat])
+        if not counts:
+            break
+        stem, n = min(counts.items(), key=lambda kv: (-kv[1], kv[0]))
+        if n < MIN_GROUP:
+            break
+        name = max((w for w in words if w.startswith(stem)), key=lambda w: (words[w], -len(w)))
+        name = name.capitalize()
+        if name in groups or name in cat_stems:
+            name += " (группа)"
+        groups[name] = [cat for cat in free if stem in cat_stems[cat]]
+        free = [cat for cat in free if stem not in cat_stems[cat]]
+    for cat in free:
+        groups[cat] = [cat]
+    return groups
+
+
+@functools.lru_cache(maxsize=32)
+def _tree(categories: Tuple[str, ...]) -> CategoryTree:
+    return CategoryTree(build_groups(list(categories)))
+
+
+def get_tree(categories: list) -> Optional[CategoryTree]:
+    """Дерево для списка категорий или None, если список короткий и дерево не нужно."""
+    if not categories or len(categories) < MIN_CATEGORIES:
+        return None
+    return _tree(tuple(categories))
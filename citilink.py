@@ -2,6 +2,12 @@
 import streamlit as st
 import pandas as pd
 
+import columnar
+import core
+import commission_tables
+import perf
+import pricing_jobs
+
 # ─────────────────────────────────────────────────────────────────────────────
 # 1. СПРАВОЧНИКИ КОМИССИЙ (Placeholder)
 # ─────────────────────────────────────────────────────────────────────────────
@@ -18,48 +24,43 @@ CATEGORY_COMMISSIONS = {
 # 2. ТАРИФЫ ЛОГИСТИКИ (Citilink FBS Placeholder)
 # ─────────────────────────────────────────────────────────────────────────────
 def get_logistics_tariff(weight_kg):
-    # Условный тариф: фиксированный 120 руб + 40 руб за крупногабарит (> 20 кг)
+    # Условный тариф: фиксированный 120 руб + 40 руб за крупногабарит (> 20 кг); число или массив NumPy
     base = 120.0
-    extra = 40.0 if weight_kg > 20 else 0.0
+    extra = 40.0 * (weight_kg > 20)
     return base + extra
 
+def calculate(conn, products, get_ai_category, calc_tax, params: dict, commissions: dict,
+              commissions_version: str = commission_tables.DEFAULT_VERSION) -> pd.DataFrame:
+    """Расчёт РРЦ и маржи по каталогу (columnar.Catalog или строки sku, name, length, width, height, weight, cost)."""
+    catalog = columnar.as_catalog(products)
+    logistics_cl = get_logistics_tariff(catalog.weight)
+
+    # AI Классификация
+    category = catalog.classify(get_ai_category, list(commissions.keys()), conn, "citilink")
+    commission = columnar.lookup(category, commissions)
+
+    economics = columnar.unit_economics(catalog.cost, logistics_cl + params["extra_logistics"], commission,
+                                        params, calc_tax)
+    return columnar.result_frame({
+        "SKU": catalog.sku,
+        "Название": catalog.name_array(),
+        "Вес, кг": core.pyround(catalog.weight, 3),
+        "Логистика Ситилинк, руб": logistics_cl,
+        "Категория": category,
+        "Комиссия, %": commission,
+        "Версия комиссий": columnar.constant(commissions_version, len(catalog)),
+    }, economics)
+
 def render(conn, get_ai_category, normalize_value, calc_tax, params: dict):
     st.header("Ситилинк — Юнит-экономика (FBS)")
 
     # ── Боковая панель: настройки комиссий ──────────────────────────────────
     with st.sidebar:
-        st.divider()
-        st.subheader("Комиссии Ситилинк")
-        uploaded_comm = st.file_uploader(
-            "Загрузить Excel с комиссиями", type=["xlsx"], key="cl_comm_upload"
+        comm_table = commission_tables.render_sidebar(
+            conn, "citilink", "Комиссии Ситилинк", "cl", CATEGORY_COMMISSIONS
         )
-        if uploaded_comm and st.button("Обновить справочник", key="cl_update_comm"):
-            try:
-                df_comm = pd.read_excel(uploaded_comm)
-                new_comm = {}
-                for _, row in df_comm.iterrows():
-                    cols = list(df_comm.columns)
-                    name = str(row[cols[0]]).strip()
-                    try:
-                        val = float(str(row[cols[1]]).replace(",", "."))
-                        if name and 0 < val < 100:
-                            new_comm[name] = val
-                    except (ValueError, TypeError):
-                        pass
-                if new_comm:
-                    st.session_state["cl_commissions"] = new_comm
-                    st.success(f"Обновлено {len(new_comm)} категорий")
-                else:
-                    st.warning("Не удалось распознать категории в файле.")
-            except Exception as e:
-                st.error(f"Ошибка: {e}")
-
-        if "cl_commissions" in st.session_state:
-            st.caption(f"В кэше: {len(st.session_state['cl_commissions'])} категорий (из Excel)")
-        else:
-            st.caption(f"Используется справочник по умолчанию ({len(CATEGORY_COMMISSIONS)} категорий)")
 
-    commissions: dict = st.session_state.get("cl_commissions", CATEGORY_COMMISSIONS)
+    commissions: dict = comm_table.rates
 
     # ── Блок 1: Каталог товаров ─────────────────────────────────────────────
     with st.expander("Блок 1. Каталог товаров", expanded=True):
@@ -113,96 +114,25 @@ def render(conn, get_ai_category, normalize_value, calc_tax, params: dict):
             conn.commit()
             st.success(f"Сохранено: {saved}, пропущено: {skipped}")
 
-        all_products = conn.execute(
-            "SELECT sku, name, length_cm, width_cm, height_cm, weight_kg, cost FROM products"
-        ).fetchall()
+        catalog = columnar.read_catalog(conn)
 
-        if all_products:
-            df_show = pd.DataFrame(
-                all_products,
-                columns=["SKU", "Название", "Длина, см", "Ширина, см", "Высота, см", "Вес, кг", "Себестоимость, руб"]
-            )
-            st.dataframe(df_show, use_container_width=True)
+        if len(catalog):
+            df_show = catalog.frame()
+            with perf.span("render_catalog_table", rows=len(df_show)):
+                st.dataframe(df_show, use_container_width=True)
         else:
             st.info("Каталог пуст. Загрузите Excel.")
 
-    all_products = conn.execute(
-        "SELECT sku, name, length_cm, width_cm, height_cm, weight_kg, cost FROM products"
-    ).fetchall()
-
-    if not all_products:
+    if not len(catalog):
         st.warning("Загрузите каталог товаров для расчёта.")
         return
 
     # ── Блок 2: Расчёт юнит-экономики ──────────────────────────────────────
     with st.expander("Блок 2. Расчёт юнит-экономики", expanded=True):
-        cat_list = list(commissions.keys())
         if st.button("Рассчитать РРЦ для всего каталога", key="cl_calc"):
-            target_m = params["target_margin"]
-            acq = params["acquiring"]
-            ep = params["early_payout"]
-            mkt = params["marketing"]
-            extra_c = params["extra_costs"]
-            extra_l = params["extra_logistics"]
-            tax_regime = params["tax_regime"]
-
-            results = []
-            for p in all_products:
-                sku, name, l, w, h, wt, cost = p
-                cost = cost or 0.0
-
-                # Логистика Ситилинк
-                logistics_cl = get_logistics_tariff(wt)
-                logistics_total = logistics_cl + extra_l
-
-                # AI Классификация
-                category = get_ai_category(name, cat_list, conn, "citilink")
-                commission = commissions.get(category, 0.0)
-
-                # Формула РРЦ
-                k_percent = commission + acq + ep + mkt
-                denom = 1 - (k_percent / 100) - (target_m / 100)
-
-                if denom > 0 and cost > 0:
-                    rrc = (cost + logistics_total + extra_c) / denom
-                else:
-                    rrc = 0.0
-
-                if rrc > 0:
-                    percent_costs = rrc * (k_percent / 100)
-                    profit_before = rrc - cost - logistics_total - extra_c - percent_costs
-                    margin_before = (profit_before / rrc * 100) if rrc > 0 else 0
-                    
-                    tax, profit_after, margin_after = calc_tax(
-                        rrc,
-                        cost + logistics_total + extra_c + percent_costs,
-                        tax_regime
-                    )
-                else:
-                    profit_before = margin_before = tax = profit_after = margin_after = 0.0
-
-                results.append({
-                    "SKU": sku,
-                    "Название": name,
-                    "Вес, кг": round(wt, 3),
-                    "Логистика Ситилинк, руб": logistics_cl,
-                    "Категория": category,
-                    "Комиссия, %": commission,
-                    "Себестоимость, руб": round(cost, 0),
-                    "РРЦ, руб": round(rrc, 0),
-                    "Прибыль до налога, руб": round(profit_before, 0),
-                    "Маржа до налога, %": round(margin_before, 1),
-                    "Налог, руб": round(tax, 0),
-                    "Прибыль после налога, руб": round(profit_after, 0),
-                    "Маржа после налога, %": round(margin_after, 1),
-                })
-
-            res_df = pd.DataFrame(results)
-            st.subheader("Результаты расчёта")
-            st.dataframe(res_df, use_container_width=True)
-            st.download_button(
-                "Скачать результат (CSV)",
-                res_df.to_csv(index=False).encode("utf-8"),
-                "citilink_rrc_results.csv",
-                mime="text/csv"
-            )
+            pricing_jobs.start("citilink", conn, catalog,
+                               lambda c, chunk: calculate(c, chunk, get_ai_category, calc_tax, params, commissions,
+                                                          comm_table.version),
+                               pool=("citilink", (params, commissions, comm_table.version)),
+                               meta={"params": params, "commissions_version": comm_table.version})
+        pricing_jobs.render("citilink", "citilink_rrc_results.csv")
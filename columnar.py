@@ -0,0 +1,175 @@
+"""
+Колоночное представление каталога и результатов расчёта.
+
+Каталог читается из SQLite пачками по FETCH_ROWS прямо в массивы NumPy: габариты,
+вес и себестоимость — float64, названия — словарь (коды int32 + уникальные
+названия), поэтому одинаковые названия хранятся и классифицируются один раз.
+Кортежи строк живут только в пределах пачки.
+
+Расчёт маркетплейса идёт целыми массивами (unit_economics), результат — DataFrame,
+в котором категория, зона и тип размера — pd.Categorical; он же показывается в
+st.dataframe и пишется в CSV. Словари на строку не создаются.
+
+    catalog = columnar.read_catalog(conn)
+    df = mvideo.calculate(conn, catalog, get_ai_category, calc_tax, params)
+"""
+import functools
+import sqlite3
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+import core
+import perf
+
+COLUMNS = "sku, name, length_cm, width_cm, height_cm, weight_kg, cost"
+FETCH_ROWS = 50_000
+DISPLAY_COLUMNS = ["SKU", "Название", "Длина, см", "Ширина, см", "Высота, см", "Вес, кг", "Себестоимость, руб"]
+
+
+class Catalog:
+    """Товары (sku, name, length, width, height, weight, cost) массивами одной длины."""
+
+    __slots__ = ("sku", "name_codes", "names", "length", "width", "height", "weight", "cost")
+
+    def __init__(self, sku: np.ndarray, name_codes: np.ndarray, names: np.ndarray, length: np.ndarray,
+                 width: np.ndarray, height: np.ndarray, weight: np.ndarray, cost: np.ndarray):
+        self.sku = sku
+        self.name_codes = name_codes
+        self.names = names
+        self.length = length
+        self.width = width
+        self.height = height
+        self.weight = weight
+        self.cost = cost
+
+    def __len__(self) -> int:
+        return len(self.sku)
+
+    def __getitem__(self, rows) -> "Catalog":
+        """Срез или маска строк; словарь названий общий с исходным каталогом."""
+        return Catalog(self.sku[rows], self.name_codes[rows], self.names, self.length[rows],
+                       self.width[rows], self.height[rows], self.weight[rows], self.cost[rows])
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[tuple]) -> "Catalog":
+        return _build([rows])
+
+    def name_array(self) -> np.ndarray:
+        """Названия по строкам — ссылки на объекты словаря, не копии."""
+        return self.names[self.name_codes]
+
+    def frame(self) -> pd.DataFrame:
+        """Таблица каталога для показа на странице."""
+        return pd.DataFrame(dict(zip(DISPLAY_COLUMNS, (
+            self.sku, self.name_array(), self.length, self.width, self.height, self.weight, self.cost))))
+
+    def classify(self, get_ai_category: Callable, categories: list, conn: sqlite3.Connection,
+                 client_key: str) -> pd.Categorical:
+        """Категория по строкам: get_ai_category вызывается один раз на уникальное название."""
+        used, inverse = np.unique(self.name_codes, return_inverse=True)
+        labels: Dict[str, int] = {}
+        codes = np.empty(len(used), dtype=np.int32)
+        with perf.span("classify_unique", rows=len(used)):
+            for i, code in enumerate(used):
+                category = get_ai_category(self.names[code], categories, conn, client_key)
+                codes[i] = labels.setdefault(category, len(labels))
+        return categorical(codes[inverse.reshape(-1)], labels)
+
+
+def _build(batches: List[Sequence[tuple]]) -> Catalog:
+    columns: List[List[np.ndarray]] = [[] for _ in range(7)]
+    for rows in batches:
+        if not rows:
+            continue
+        for i, values in enumerate(zip(*rows)):
+            # None в числовых колонках — 0, как `x or 0.0` в построчном расчёте
+            columns[i].append(np.array(values, dtype=object if i < 2 else np.float64))
+    joined = [np.concatenate(c) if c else np.empty(0, dtype=object if i < 2 else np.float64)
+              for i, c in enumerate(columns)]
+    sku, names = joined[0], joined[1]
+    codes, uniques = pd.factorize(names, use_na_sentinel=False)
+    numeric = [np.nan_to_num(c, nan=0.0) for c in joined[2:]]
+    return Catalog(sku, codes.astype(np.int32), np.asarray(uniques, dtype=object), *numeric)
+
+
+def as_catalog(products) -> Catalog:
+    """Catalog как есть; список кортежей из fetchall() — перекладывается в массивы."""
+    return products if isinstance(products, Catalog) else Catalog.from_rows(products)
+
+
+def read_catalog(conn: sqlite3.Connection, where: str = "", params: tuple = (), order_by: str = "") -> Catalog:
+    """Каталог из products пачками; where — условие без WHERE (например, диапазон SKU)."""
+    sql = (f"SELECT {COLUMNS} FROM products" + (f" WHERE {where}" if where else "")
+           + (f" ORDER BY {order_by}" if order_by else ""))
+    with perf.span("sqlite_read") as sp:
+        cur = conn.execute(sql, params)
+        batches = []
+        while True:
+            rows = cur.fetchmany(FETCH_ROWS)
+            if not rows:
+                break
+            batches.append(rows)
+        catalog = _build(batches)
+        sp["rows"] = len(catalog)
+    return catalog
+
+
+# ── Расчёт по массивам ──────────────────────────────────────────────
+@functools.lru_cache(maxsize=4096)
+def _category_dtype(categories: tuple) -> pd.CategoricalDtype:
+    return pd.CategoricalDtype(list(categories))
+
+
+def categorical(codes: np.ndarray, categories) -> pd.Categorical:
+    """
+    Categorical из готовых кодов. Тип кэшируется по набору категорий: проверка
+    категорий в pandas стоит ~0.15 мс — больше, чем весь расчёт одного SKU в pricing_api.
+    """
+    return pd.Categorical.from_codes(codes, dtype=_category_dtype(tuple(categories)), validate=False)
+
+
+def constant(value: str, n: int) -> pd.Categorical:
+    """Колонка из одного значения (зона, версия комиссий) — одна категория на всю таблицу."""
+    return categorical(np.zeros(n, dtype=np.int8), (value,))
+
+
+def lookup(categories: pd.Categorical, table: Dict[str, float], default: float = 0.0) -> np.ndarray:
+    """Значение из справочника по категории: один поиск на категорию, а не на строку."""
+    values = np.array([table.get(c, default) for c in categories.categories], dtype=np.float64)
+    return values[categories.codes] if len(values) else np.zeros(len(categories))
+
+
+def unit_economics(cost: np.ndarray, logistics_total: np.ndarray, commission: np.ndarray,
+                   params: dict, calc_tax: Callable) -> Dict[str, np.ndarray]:
+    """
+    РРЦ под целевую маржу и маржа до/после налога — те же формулы, что были в
+    построчном расчёте модулей маркетплейсов. calc_tax принимает массивы (core.calc_tax).
+    """
+    k_percent = commission + params["acquiring"] + params["early_payout"] + params["marketing"]
+    denom = 1 - (k_percent / 100) - (params["target_margin"] / 100)
+    extra_c = params["extra_costs"]
+
+    priced = (denom > 0) & (cost > 0)
+    rrc = np.where(priced, (cost + logistics_total + extra_c) / np.where(priced, denom, 1.0), 0.0)
+    positive = rrc > 0
+    percent_costs = rrc * (k_percent / 100)
+    profit_before = np.where(positive, rrc - cost - logistics_total - extra_c - percent_costs, 0.0)
+    margin_before = np.where(positive, profit_before / np.where(positive, rrc, 1.0) * 100, 0.0)
+    tax, profit_after, margin_after = calc_tax(rrc, cost + logistics_total + extra_c + percent_costs,
+                                               params["tax_regime"])
+    return {
+        "Себестоимость, руб": core.pyround(cost, 0),
+        "РРЦ, руб": core.pyround(rrc, 0),
+        "Прибыль до налога, руб": core.pyround(profit_before, 0),
+        "Маржа до налога, %": core.pyround(margin_before, 1),
+        "Налог, руб": core.pyround(np.where(positive, tax, 0.0), 0),
+        "Прибыль после налога, руб": core.pyround(np.where(positive, profit_after, 0.0), 0),
+        "Маржа после налога, %": core.pyround(np.where(positive, margin_after, 0.0), 1),
+    }
+
+
+def result_frame(columns: Dict[str, object], economics: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """Итоговая таблица: колонки маркетплейса, затем общие колонки unit_economics."""
+    return pd.DataFrame({**columns, **economics})
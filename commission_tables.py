@@ -0,0 +1,151 @@
+"""
+Справочники комиссий маркетплейсов в SQLite с версиями и датой начала действия.
+
+    rates = commission_tables.parse_excel(df)              # {категория: %}
+    version_id = commission_tables.save_version(conn, "dns", rates, "2026-11-01")
+    table = commission_tables.active(conn, "dns", CATEGORY_COMMISSIONS)
+    table.rates, table.version                             # dict и метка "v3 от 2026-11-01"
+
+Активная версия — последняя с effective_from <= сегодня. Скомпилированные
+таблицы кэшируются на процесс (общие для всех сессий) по id версии, поэтому
+на каждом перезапуске остаётся один индексный SELECT.
+"""
+import datetime
+import sqlite3
+import threading
+from typing import Dict, NamedTuple, Optional
+
+DEFAULT_VERSION = "по умолчанию"
+
+_compiled: Dict = {}
+_lock = threading.Lock()
+
+
+class CommissionTable(NamedTuple):
+    version: str
+    version_id: Optional[int]
+    effective_from: Optional[str]
+    rates: Dict[str, float]
+
+
+def init_tables(c):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS commission_versions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            marketplace TEXT NOT NULL,
+            effective_from TEXT NOT NULL,
+            source TEXT,
+            categories INTEGER,
+            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_commission_versions_mp
+        ON commission_versions (marketplace, effective_from)
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS commission_rates (
+            version_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            rate REAL NOT NULL,
+            PRIMARY KEY (version_id, category)
+        )
+    """)
+
+
+def parse_excel(df) -> Dict[str, float]:
+    """Первая колонка — категория, вторая — комиссия в % (0 < x < 100, допускается запятая)."""
+    import pandas as pd
+
+    if df.shape[1] < 2:
+        return {}
+    names = df.iloc[:, 0].astype("string").str.strip()
+    values = pd.to_numeric(df.iloc[:, 1].astype("string").str.replace(",", ".", regex=False), errors="coerce")
+    mask = names.notna() & names.ne("") & values.gt(0) & values.lt(100)
+    return dict(zip(names[mask].tolist(), values[mask].astype(float).tolist()))
+
+
+def save_version(conn: sqlite3.Connection, marketplace: str, rates: Dict[str, float],
+                 effective_from: Optional[str] = None, source: str = "") -> int:
+    """Сохраняет новую версию справочника и возвращает её id."""
+    effective_from = effective_from or datetime.date.today().isoformat()
+    c = conn.cursor()
+    c.execute(
+        "INSERT INTO commission_versions (marketplace, effective_from, source, categories) VALUES (?,?,?,?)",
+        (marketplace, effective_from, source, len(rates)),
+    )
+    version_id = c.lastrowid
+    c.executemany(
+        "INSERT INTO commission_rates (version_id, category, rate) VALUES (?,?,?)",
+        [(version_id, cat, float(rate)) for cat, rate in rates.items()],
+    )
+    conn.commit()
+    return version_id
+
+
+def versions(conn: sqlite3.Connection, marketplace: str) -> list:
+    return conn.execute("""
+        SELECT id, effective_from, categories, source, uploaded_at
+        FROM commission_versions WHERE marketplace=?
+        ORDER BY effective_from DESC, id DESC
+    """, (marketplace,)).fetchall()
+
+
+def _db_file(conn: sqlite3.Connection) -> str:
+    return conn.execute("PRAGMA database_list").fetchone()[2] or f":memory:{id(conn)}"
+
+
+def active(conn: sqlite3.Connection, marketplace: str, default: Dict[str, float],
+           on_date: Optional[str] = None) -> CommissionTable:
+    """Действующий на дату справочник; без загруженных версий — встроенный default."""
+    on_date = on_date or datetime.date.today().isoformat()
+    row = conn.execute("""
+        SELECT id, effective_from FROM commission_versions
+        WHERE marketplace=? AND effective_from<=?
+        ORDER BY effective_from DESC, id DESC LIMIT 1
+    """, (marketplace, on_date)).fetchone()
+    if row is None:
+        return CommissionTable(DEFAULT_VERSION, None, None, default)
+
+    key = (_db_file(conn), row[0])
+    table = _compiled.get(key)
+    if table is None:
+        rates = dict(conn.execute(
+            "SELECT category, rate FROM commission_rates WHERE version_id=?", (row[0],)
+        ).fetchall())
+        table = CommissionTable(f"v{row[0]} от {row[1]}", row[0], row[1], rates)
+        with _lock:
+            _compiled[key] = table
+    return table
+
+
+def render_sidebar(conn: sqlite3.Connection, marketplace: str, title: str, key_prefix: str,
+                   default: Dict[str, float]) -> CommissionTable:
+    """Блок сайдбара: загрузка новой версии из Excel и подпись действующей версии."""
+    import pandas as pd
+    import streamlit as st
+
+    st.divider()
+    st.subheader(title)
+    uploaded_comm = st.file_uploader(
+        "Загрузить Excel с комиссиями", type=["xlsx"], key=f"{key_prefix}_comm_upload"
+    )
+    effective_from = st.date_input("Действует с", key=f"{key_prefix}_comm_date")
+    if uploaded_comm and st.button("Обновить справочник", key=f"{key_prefix}_update_comm"):
+        try:
+            new_comm = parse_excel(pd.read_excel(uploaded_comm))
+            if new_comm:
+                version_id = save_version(conn, marketplace, new_comm, effective_from.isoformat(),
+                                          getattr(uploaded_comm, "name", ""))
+                st.success(f"Сохранена версия v{version_id}: {len(new_comm)} категорий")
+            else:
+                st.warning("Не удалось распознать категории в файле.")
+        except Exception as e:
+            st.error(f"Ошибка: {e}")
+
+    table = active(conn, marketplace, default)
+    if table.version_id is None:
+        st.caption(f"Используется справочник по умолчанию ({len(default)} категорий)")
+    else:
+        st.caption(f"Версия {table.version}: {len(table.rates)} категорий")
+    return table
@@ -0,0 +1,493 @@
+"""
+Общая логика сервиса без UI: БД каталога, нормализация единиц,
+AI-классификация категорий и расчёт налога.
+
+Используется в app.py, модулях маркетплейсов и вне Streamlit (benchmark.py).
+"""
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+import ai_client
+import category_tree
+import local_classifier
+import metrics
+import names
+import perf
+
+DB_PATH = "products_storage.db"
+AI_CACHE_MAX_ROWS = int(os.environ.get("AI_CACHE_MAX_ROWS", 500_000))
+AI_CACHE_COMPACT_EVERY = 5_000   # новых записей между проверками размера кэша
+AI_CACHE_FLUSH_EVERY = (1_000, 30.0)  # статистика попаданий пишется пачкой: записей / секунд
+
+
+def _add_columns(c, table: str, columns: dict):
+    """ALTER TABLE ... ADD COLUMN для отсутствующих колонок (старые БД без user_version)."""
+    existing = {r[1] for r in c.execute(f"PRAGMA table_info({table})")}
+    for name, decl in columns.items():
+        if name not in existing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+
+def _migration_base(c):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sku TEXT UNIQUE,
+            name TEXT,
+            length_cm REAL,
+            width_cm REAL,
+            height_cm REAL,
+            weight_kg REAL,
+            cost REAL DEFAULT 0
+        )
+    """)
+    _add_columns(c, "products", {"cost": "REAL DEFAULT 0"})
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS ai_cache (
+            name TEXT,
+            client TEXT,
+            category TEXT,
+            PRIMARY KEY (name, client)
+        )
+    """)
+
+
+def _migration_pim(c):
+    import pim_enrich
+
+    pim_enrich.init_pim_tables(c.connection)
+
+
+def _migration_commissions(c):
+    import commission_tables
+
+    commission_tables.init_tables(c)
+
+
+def _migration_ai_cache_source(c):
+    # model — ответ модели, local — локальный классификатор, fallback — первая категория списка
+    _add_columns(c, "ai_cache", {"source": "TEXT"})
+
+
+def _migration_ai_cache_name_key(c):
+    import names
+
+    _add_columns(c, "ai_cache", {"name_key": "TEXT"})
+    c.connection.create_function("name_key", 1, names.name_key, deterministic=True)
+    c.execute("UPDATE ai_cache SET name_key = name_key(name) WHERE name_key IS NULL")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ai_cache_name_key ON ai_cache (name_key, client)")
+
+
+def _migration_ai_cache_lru(c):
+    # cats_hash — хеш списка категорий, по которому классифицировали; last_used/hits — для вытеснения
+    _add_columns(c, "ai_cache", {
+        "cats_hash": "TEXT",
+        "last_used": "INTEGER",
+        "hits": "INTEGER DEFAULT 0",
+    })
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ai_cache_last_used ON ai_cache (last_used)")
+
+
+def _migration_category_mapping(c):
+    import category_mapping
+
+    category_mapping.init_tables(c)
+
+
+def _migration_dim_stats(c):
+    import dim_stats
+
+    dim_stats.init_tables(c)
+
+
+def _migration_dim_stats_triggers(c):
+    # Триггеры пересоздаются: источник knn исключён из статистики, очистка — по ключу товара
+    import dim_stats
+
+    dim_stats.init_tables(c)
+
+
+def _migration_ean_reference(c):
+    import ean_index
+
+    ean_index.init_tables(c)
+
+
+def _migration_search_cache(c):
+    import search_web
+
+    search_web.init_tables(c)
+
+
+def _migration_dim_stats_log_buckets(c):
+    # Корзины гистограммы — логарифмические: триггеры пересоздаются, статистика пересчитывается
+    import dim_stats
+
+    dim_stats.init_tables(c)
+
+
+# Схема версионируется через PRAGMA user_version: версия = число применённых миграций.
+# Новые изменения схемы — только добавлением функции в конец списка.
+MIGRATIONS = [
+    _migration_base,
+    _migration_pim,
+    _migration_commissions,
+    _migration_ai_cache_source,
+    _migration_ai_cache_name_key,
+    _migration_ai_cache_lru,
+    _migration_category_mapping,
+    _migration_dim_stats,
+    _migration_dim_stats_triggers,
+    _migration_ean_reference,
+    _migration_search_cache,
+    _migration_dim_stats_log_buckets,
+]
+
+_migrate_lock = threading.Lock()
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Применяет недостающие миграции и возвращает версию схемы.
+
+    Для актуальной БД это одно чтение PRAGMA user_version — DDL выполняется
+    только при первом открытии файла новой версией кода.
+    """
+    c = conn.cursor()
+    version = c.execute("PRAGMA user_version").fetchone()[0]
+    if version >= len(MIGRATIONS):
+        return version
+    with _migrate_lock:
+        version = c.execute("PRAGMA user_version").fetchone()[0]
+        for i in range(version, len(MIGRATIONS)):
+            MIGRATIONS[i](c)
+            c.execute(f"PRAGMA user_version = {i + 1}")
+            conn.commit()
+    return len(MIGRATIONS)
+
+
+def init_db(db_path: str = DB_PATH):
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    # INSERT OR REPLACE в products должен вызывать триггеры удаления (dim_stats)
+    conn.execute("PRAGMA recursive_triggers = ON")
+    migrate(conn)
+    return conn
+
+
+def normalize_value(raw, unit):
+    try:
+        v = float(str(raw).replace(",", ".").strip())
+    except (ValueError, TypeError):
+        return 0.0
+    u = str(unit).strip().lower() if unit else ""
+    if u in ("мм", "mm"):
+        return v / 10.0
+    if u in ("г", "g", "гр", "gr"):
+        return v / 1000.0
+    return v
+
+
+def get_ai_category(name: str, categories: list, conn, client_key: str, api_key: Optional[str] = None) -> str:
+    """
+    Категория товара для маркетплейса client_key: сначала ai_cache по каноническому
+    названию (names.name_key), затем уверенный ответ локального классификатора
+    (local_classifier), затем gpt-4o-mini. Длинные списки категорий (Спортмастер)
+    классифицируются в две стадии — группа, затем категория (category_tree).
+
+    api_key=None — ключ берётся из st.session_state (страницы Streamlit);
+    вне UI (бенчмарки, фоновые задачи) ключ передаётся явно.
+    """
+    key = names.name_key(name)
+    cats_hash = categories_hash(categories)
+    row = _cached_row(conn, key, client_key, cats_hash, categories)
+    valid = row is not None
+    metrics.cache_lookup("ai_cache", valid, client_key)
+    if valid:
+        perf.count("ai_cache_hit")
+        _touch(conn, row[2], cats_hash if row[1] != cats_hash else None)
+        return row[0]
+    perf.count("ai_cache_miss")
+
+    guess, confident = local_classifier.predict(conn, client_key, name, categories)
+    if confident:
+        _cache_category(conn, name, key, client_key, guess, "local", cats_hash)
+        return guess
+
+    if api_key is None:
+        import streamlit as st
+        api_key = st.session_state.get("openai_key", "")
+    if not categories or not ai_client.is_enabled(api_key):
+        return categories[0] if categories else "Неизвестно"
+
+    source = "model"
+    try:
+        client = ai_client.get_client(api_key)
+        tree = category_tree.get_tree(categories)
+        category = _classify_tree(client, client_key, name, tree) if tree else None
+        if category is None:
+            category = _ask_model(client, client_key, name, categories)
+        if category not in categories:
+            category, source = categories[0], "fallback"
+    except Exception:
+        # Сбой/таймаут/открытый предохранитель: ответ по ключевым словам и без записи в кэш,
+        # чтобы товар классифицировался моделью, когда эндпоинт оживёт
+        perf.count("ai_failure_fallback")
+        return guess if guess in categories else categories[0]
+
+    if source == "model":
+        local_classifier.record_agreement(client_key, guess, category)
+    _cache_category(conn, name, key, client_key, category, source, cats_hash)
+    return category
+
+
+def _cached_row(conn, key: str, client_key: str, cats_hash: str, categories: list):
+    row = conn.execute(
+        "SELECT category, cats_hash, rowid FROM ai_cache WHERE name_key=? AND client=? "
+        "ORDER BY cats_hash IS ? DESC LIMIT 1",
+        (key, client_key, cats_hash)
+    ).fetchone()
+    # Запись по другому списку категорий годится, только если её категория всё ещё в списке
+    if row and (row[1] == cats_hash or not categories or row[0] in categories):
+        return row
+    return None
+
+
+def cached_category(name: str, categories: list, conn, client_key: str, *args, **kwargs) -> Optional[str]:
+    """
+    Категория из ai_cache без классификатора и модели (None — промах). Сигнатура как у
+    get_ai_category; только чтение — годится для соединения только на чтение.
+    """
+    row = _cached_row(conn, names.name_key(name), client_key, categories_hash(categories), categories)
+    return row[0] if row else None
+
+
+def _ask_model(client, client_key: str, name: str, options: list,
+               header: str = "Категории", what: str = "категорию") -> str:
+    opts = chr(10).join(f"- {o}" for o in options)
+    with perf.span("classify_model", rows=1):
+        resp = ai_client.create_chat(
+            client, client_key,
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": (
+                    f"Ты классификатор товаров для маркетплейса {client_key}. "
+                    f"Выбери ОДНУ {what} из списка. Ответь ТОЛЬКО её названием."
+                )},
+                {"role": "user", "content": f"Товар: {name}{chr(10)}{header}:{chr(10)}{opts}"}
+            ],
+            max_tokens=60,
+            temperature=0
+        )
+    return resp.choices[0].message.content.strip()
+
+
+def _classify_tree(client, client_key: str, name: str, tree: "category_tree.CategoryTree") -> Optional[str]:
+    """
+    Двухэтапная классификация (category_tree): группа локально или коротким промптом,
+    затем категория внутри группы. None — ответить по полному списку.
+    """
+    group = tree.match(name)
+    stage = "local"
+    if group is None:
+        stage = "model"
+        group = tree.resolve(_ask_model(client, client_key, name, tree.options(), "Группы", "группу"))
+    if group is None:
+        category = None
+    elif stage == "model" and tree.is_leaf(group):
+        category = group  # лист выбран среди всего верхнего уровня — это уже ответ
+    else:
+        cats = tree.groups[group]
+        answer = _ask_model(client, client_key, name, cats + [category_tree.NONE_OF_THESE])
+        category = answer if answer in cats else None
+    result = "flat" if category is None else f"{stage}_group"
+    metrics.inc("category_tree_total", 1, {"client": client_key, "result": result},
+                "Исходы двухэтапной классификации")
+    perf.count(f"category_tree_{result}")
+    return category
+
+
+@functools.lru_cache(maxsize=256)
+def _categories_hash(categories: tuple) -> str:
+    return hashlib.blake2b("\n".join(sorted(categories)).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def categories_hash(categories: Iterable[str]) -> str:
+    """Хеш списка категорий (порядок не важен) — версия, по которой классифицирована запись ai_cache."""
+    return _categories_hash(tuple(categories or ()))
+
+
+_inserts = 0
+_pending: Dict[int, dict] = {}
+_pending_lock = threading.Lock()
+
+
+def _cache_category(conn, name: str, key: str, client_key: str, category: str, source: str, cats_hash: str):
+    global _inserts
+    conn.execute(
+        "INSERT OR REPLACE INTO ai_cache (name, client, category, source, name_key, cats_hash, last_used, hits) "
+        "VALUES (?,?,?,?,?,?,?,0)",
+        (name, client_key, category, source, key, cats_hash, int(time.time()))
+    )
+    conn.commit()
+    _inserts += 1
+    if _inserts % AI_CACHE_COMPACT_EVERY == 0:
+        if conn.execute("SELECT COUNT(*) FROM ai_cache").fetchone()[0] > AI_CACHE_MAX_ROWS:
+            compact_ai_cache(conn)
+
+
+def _touch(conn, rowid: int, new_hash: Optional[str]):
+    """Копит попадания (и перепривязку к новому списку категорий) до пакетной записи."""
+    now = time.monotonic()
+    with _pending_lock:
+        p = _pending.setdefault(id(conn), {"conn": conn, "hits": {}, "rehash": {}, "since": now})
+        p["hits"][rowid] = p["hits"].get(rowid, 0) + 1
+        if new_hash:
+            p["rehash"][rowid] = new_hash
+        due = len(p["hits"]) >= AI_CACHE_FLUSH_EVERY[0] or now - p["since"] >= AI_CACHE_FLUSH_EVERY[1]
+    if due:
+        flush_cache_stats(conn)
+
+
+def flush_cache_stats(conn: Optional[sqlite3.Connection] = None):
+    """Пишет накопленные hits/last_used в ai_cache (conn=None — для всех соединений)."""
+    with _pending_lock:
+        if conn is None:
+            batches = list(_pending.values())
+            _pending.clear()
+        else:
+            batches = [p for p in [_pending.pop(id(conn), None)] if p]
+    now = int(time.time())
+    for p in batches:
+        c = p["conn"]
+        c.executemany(
+            "UPDATE ai_cache SET hits=hits+?, last_used=? WHERE rowid=?",
+            [(n, now, rowid) for rowid, n in p["hits"].items()],
+        )
+        c.executemany(
+            "UPDATE ai_cache SET cats_hash=? WHERE rowid=?",
+            [(h, rowid) for rowid, h in p["rehash"].items()],
+        )
+        c.commit()
+
+
+def compact_ai_cache(conn: sqlite3.Connection, max_rows: int = None,
+                     current_categories: Optional[Dict[str, list]] = None) -> dict:
+    """
+    Уплотняет ai_cache: дубликаты по (name_key, client), записи с категориями,
+    которых нет в текущих списках (current_categories: client -> категории),
+    затем самые давно не использованные — до max_rows строк.
+    """
+    max_rows = AI_CACHE_MAX_ROWS if max_rows is None else max_rows
+    flush_cache_stats(conn)
+    c = conn.cursor()
+    stats = {"before": c.execute("SELECT COUNT(*) FROM ai_cache").fetchone()[0]}
+    c.execute("""
+        DELETE FROM ai_cache WHERE rowid NOT IN (
+            SELECT MAX(rowid) FROM ai_cache GROUP BY name_key, client
+        )
+    """)
+    stats["duplicates"] = c.rowcount
+    stats["stale"] = 0
+    for client_key, categories in (current_categories or {}).items():
+        c.execute("""
+            DELETE FROM ai_cache
+            WHERE client=? AND cats_hash IS NOT ?
+              AND category NOT IN (SELECT value FROM json_each(?))
+        """, (client_key, categories_hash(categories), json.dumps(list(categories), ensure_ascii=False)))
+        stats["stale"] += c.rowcount
+    excess = c.execute("SELECT COUNT(*) FROM ai_cache").fetchone()[0] - max_rows
+    stats["evicted"] = 0
+    if excess > 0:
+        c.execute("""
+            DELETE FROM ai_cache WHERE rowid IN (
+                SELECT rowid FROM ai_cache ORDER BY COALESCE(last_used, 0), hits LIMIT ?
+            )
+        """, (excess,))
+        stats["evicted"] = c.rowcount
+    conn.commit()
+    stats["after"] = c.execute("SELECT COUNT(*) FROM ai_cache").fetchone()[0]
+    metrics.inc("ai_cache_evictions_total", stats["duplicates"] + stats["stale"] + stats["evicted"],
+                help_text="Удалено записей ai_cache при уплотнении")
+    metrics.set_gauge("ai_cache_rows", stats["after"], help_text="Записей в ai_cache")
+    return stats
+
+
+def pyround(values, digits: int = 0):
+    """
+    np.round с результатом round() Python: половинки решаются по точному значению float
+    (0.855 хранится как 0.85499… → 0.85), а не после умножения на 10**digits, как в NumPy.
+    """
+    out = np.round(values, digits)
+    scaled = np.asarray(values, dtype=np.float64) * 10.0 ** digits
+    tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if tie.any():
+        if np.ndim(out) == 0:
+            return round(float(values), digits)
+        out[tie] = [round(v, digits) for v in np.asarray(values)[tie].tolist()]
+    return out
+
+
+TAX_RATES = {
+    "ОСНО (25% от прибыли)": ("profit", 0.25),
+    "УСН Доходы (6%)": ("revenue", 0.06),
+    "УСН Доходы-Расходы (15%)": ("profit", 0.15),
+    "АУСН (8% от дохода)": ("revenue", 0.08),
+    "УСН с НДС 5%": ("revenue", 0.05),
+    "УСН с НДС 7%": ("revenue", 0.07),
+}
+
+
+def calc_tax(revenue, cost_total, regime: str):
+    """Налог, прибыль и маржа после налога; revenue и cost_total — числа или массивы NumPy."""
+    profit_before = revenue - cost_total
+    mode, rate = TAX_RATES.get(regime, ("profit", 0.0))
+    if mode == "revenue":
+        tax = revenue * rate
+    else:
+        tax = np.maximum(profit_before * rate, 0)
+    profit_after = profit_before - tax
+    margin_after = np.where(revenue > 0, profit_after / np.where(revenue > 0, revenue, 1) * 100, 0)
+    return pyround(tax, 2), pyround(profit_after, 2), pyround(margin_after, 1)
+
+
+def current_categories(conn: sqlite3.Connection) -> Dict[str, list]:
+    """Действующие списки категорий маркетплейсов (с учётом загруженных версий комиссий)."""
+    import citilink
+    import commission_tables
+    import dns
+    import lemanpro_fbs
+    import mvideo
+    import sportmaster_fbs
+
+    return {
+        "mvideo": list(mvideo.COMMISSIONS),
+        "lemanpro": list(commission_tables.active(conn, "lemanpro", lemanpro_fbs.CATEGORY_COMMISSIONS).rates),
+        "dns": list(commission_tables.active(conn, "dns", dns.CATEGORY_COMMISSIONS).rates),
+        "citilink": list(commission_tables.active(conn, "citilink", citilink.CATEGORY_COMMISSIONS).rates),
+        "sportmaster": list(sportmaster_fbs.CATEGORY_COMMISSIONS),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Обслуживание БД каталога")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_compact = sub.add_parser("compact-cache", help="уплотнить ai_cache")
+    p_compact.add_argument("--db", default=DB_PATH)
+    p_compact.add_argument("--max-rows", type=int, default=AI_CACHE_MAX_ROWS)
+    p_compact.add_argument("--vacuum", action="store_true", help="вернуть место на диске (VACUUM)")
+    args = parser.parse_args()
+
+    db = init_db(args.db)
+    print(compact_ai_cache(db, args.max_rows, current_categories(db)))
+    if args.vacuum:
+        db.execute("VACUUM")
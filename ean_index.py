@@ -0,0 +1,211 @@
+"""
+Локальный справочник EAN → габариты и вес (выгрузка поставщика / GS1 в CSV или Parquet).
+
+Справочник загружается в таблицу ean_reference (ключ — нормализованный EAN-13/EAN-8),
+у товаров нормализованный EAN хранится в products.ean_key. Дальше:
+
+- enrich_product сначала ищет EAN товара в справочнике (один индексный поиск);
+- enrich_from_reference заполняет все совпавшие товары одним UPDATE ... FROM.
+
+    python ean_index.py import reference.csv [--dim-unit мм] [--weight-unit г]
+    python ean_index.py enrich [--force]
+"""
+import os
+import sqlite3
+import time
+from typing import Dict, Optional
+
+import metrics
+import perf
+
+DIMS = ("length_cm", "width_cm", "height_cm", "weight_kg")
+SOURCE = "ean_reference"
+CHUNK = 100_000
+
+# Допустимые названия колонок выгрузки (без учёта регистра)
+COLUMN_ALIASES = {
+    "ean": ("ean", "gtin", "barcode", "штрихкод", "штрих-код"),
+    "length_cm": ("length_cm", "length", "длина"),
+    "width_cm": ("width_cm", "width", "ширина"),
+    "height_cm": ("height_cm", "height", "высота"),
+    "weight_kg": ("weight_kg", "weight", "вес"),
+}
+
+
+def normalize_ean(raw) -> Optional[str]:
+    """
+    EAN-13 / EAN-8 с верной контрольной цифрой или None.
+
+    UPC-A (12 цифр) дополняется ведущим нулём, GTIN-14 с ведущим нулём сокращается
+    до EAN-13; «4601234567890.0» из Excel и пробелы/дефисы допускаются.
+    """
+    if raw is None:
+        return None
+    s = str(raw).strip()
+    if s.endswith(".0"):
+        s = s[:-2]
+    digits = "".join(ch for ch in s if ch.isdigit())
+    if len(digits) == 12:
+        digits = "0" + digits
+    elif len(digits) == 14 and digits[0] == "0":
+        digits = digits[1:]
+    if len(digits) not in (8, 13):
+        return None
+    body, check = digits[:-1], int(digits[-1])
+    # Веса 3/1 справа налево, начиная с цифры перед контрольной
+    total = sum(int(d) * (3 if i % 2 == 0 else 1) for i, d in enumerate(reversed(body)))
+    return digits if (10 - total % 10) % 10 == check else None
+
+
+def init_tables(c):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS ean_reference (
+            ean TEXT PRIMARY KEY,
+            length_cm REAL,
+            width_cm REAL,
+            height_cm REAL,
+            weight_kg REAL,
+            source TEXT,
+            imported_at INTEGER
+        ) WITHOUT ROWID
+    """)
+    cols = {r[1] for r in c.execute("PRAGMA table_info(products)")}
+    if "ean_key" not in cols:
+        c.execute("ALTER TABLE products ADD COLUMN ean_key TEXT")
+    c.connection.create_function("normalize_ean", 1, normalize_ean, deterministic=True)
+    c.execute("UPDATE products SET ean_key = normalize_ean(ean) WHERE ean IS NOT NULL AND ean <> ''")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_products_ean_key ON products (ean_key)")
+
+
+def _read_chunks(path: str):
+    """DataFrame-ы по CHUNK строк, все колонки строками (как в выгрузках с запятыми)."""
+    import pandas as pd
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Для Parquet нужен pyarrow: pip install pyarrow") from None
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=CHUNK):
+            yield batch.to_pandas().astype(str)
+    else:
+        yield from pd.read_csv(path, dtype=str, chunksize=CHUNK, sep=None, engine="python")
+
+
+def _columns(df) -> Dict[str, str]:
+    lower = {str(col).strip().lower(): col for col in df.columns}
+    found = {}
+    for key, aliases in COLUMN_ALIASES.items():
+        col = next((lower[a] for a in aliases if a in lower), None)
+        if col is not None:
+            found[key] = col
+    if "ean" not in found:
+        raise ValueError(f"В файле нет колонки EAN (ожидается одна из: {', '.join(COLUMN_ALIASES['ean'])})")
+    return found
+
+
+def import_reference(conn: sqlite3.Connection, path: str, dim_unit: str = "см", weight_unit: str = "кг",
+                     source: Optional[str] = None) -> Dict[str, int]:
+    """
+    Загружает справочник (CSV или Parquet) в ean_reference, существующие EAN обновляются.
+    Строки с неверным EAN или без единого положительного значения пропускаются.
+    """
+    import pandas as pd
+
+    dim_k = 10.0 if dim_unit in ("мм", "mm") else 1.0
+    wt_k = 1000.0 if weight_unit in ("г", "g", "гр", "gr") else 1.0
+    source = source or os.path.basename(path)
+    stats = {"rows": 0, "imported": 0, "invalid": 0}
+    now = int(time.time())
+    t0 = time.perf_counter()
+    with perf.span("ean_import") as sp:
+        for df in _read_chunks(path):
+            cols = _columns(df)
+            stats["rows"] += len(df)
+            keys = df[cols["ean"]].map(normalize_ean)
+            values = {}
+            for d in DIMS:
+                if d in cols:
+                    v = pd.to_numeric(df[cols[d]].str.replace(",", ".", regex=False).str.strip(), errors="coerce")
+                    v = (v / (wt_k if d == "weight_kg" else dim_k)).round(3 if d == "weight_kg" else 1)
+                    values[d] = v.where(v > 0)
+                else:
+                    values[d] = pd.Series(float("nan"), index=df.index)
+            frame = pd.DataFrame({"ean": keys, **values})
+            valid = frame["ean"].notna() & frame[list(DIMS)].notna().any(axis=1)
+            stats["invalid"] += int((~valid).sum())
+            frame = frame[valid].astype(object).where(frame[valid].notna(), None)
+            conn.executemany(f"""
+                INSERT INTO ean_reference (ean, {", ".join(DIMS)}, source, imported_at)
+                VALUES (?,?,?,?,?,?,?)
+                ON CONFLICT(ean) DO UPDATE SET
+                    {", ".join(f"{d}=COALESCE(excluded.{d}, {d})" for d in DIMS)},
+                    source=excluded.source, imported_at=excluded.imported_at
+            """, [(*row, source, now) for row in frame.itertuples(index=False, name=None)])
+            conn.commit()
+            stats["imported"] += len(frame)
+        sp["rows"] = stats["rows"]
+    metrics.observe_throughput("ean_import", stats["rows"], time.perf_counter() - t0)
+    return stats
+
+
+def lookup(conn: sqlite3.Connection, ean) -> Optional[Dict[str, float]]:
+    """Значения справочника для EAN товара (все четыре поля) или None."""
+    key = normalize_ean(ean)
+    if key is None:
+        return None
+    row = conn.execute(f"SELECT {', '.join(DIMS)} FROM ean_reference WHERE ean=?", (key,)).fetchone()
+    if row is None or any(v is None or v <= 0 for v in row):
+        return None
+    return dict(zip(DIMS, row))
+
+
+def enrich_from_reference(conn: sqlite3.Connection, force: bool = False) -> int:
+    """
+    Заполняет габариты всех товаров, чей EAN есть в справочнике, одним UPDATE ... FROM.
+    Без force — только незаполненные поля у товаров без полного набора значений.
+    Возвращает число обновлённых товаров.
+    """
+    if force:
+        sets = ", ".join(f"{d}=COALESCE(r.{d}, products.{d})" for d in DIMS)
+        where = ""
+    else:
+        sets = ", ".join(f"{d}=CASE WHEN products.{d} > 0 THEN products.{d} ELSE r.{d} END" for d in DIMS)
+        where = "AND (" + " OR ".join(f"COALESCE(products.{d}, 0) <= 0 AND r.{d} > 0" for d in DIMS) + ")"
+    t0 = time.perf_counter()
+    with perf.span("ean_enrich") as sp:
+        cur = conn.execute(f"""
+            UPDATE products SET {sets}, enrich_source='{SOURCE}', enrich_status='enriched'
+            FROM ean_reference r
+            WHERE r.ean = products.ean_key {where}
+        """)
+        conn.commit()
+        sp["rows"] = cur.rowcount
+    metrics.inc("enrich_results_total", cur.rowcount, {"method": SOURCE}, "Результаты обогащения по методам")
+    metrics.observe_throughput("ean_enrich", cur.rowcount, time.perf_counter() - t0)
+    return cur.rowcount
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import core
+
+    parser = argparse.ArgumentParser(description="Локальный справочник EAN → габариты")
+    parser.add_argument("--db", default=core.DB_PATH)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_import = sub.add_parser("import", help="Загрузить справочник из CSV / Parquet")
+    p_import.add_argument("path")
+    p_import.add_argument("--dim-unit", choices=["см", "мм"], default="см")
+    p_import.add_argument("--weight-unit", choices=["кг", "г"], default="кг")
+    p_enrich = sub.add_parser("enrich", help="Заполнить габариты товаров по справочнику")
+    p_enrich.add_argument("--force", action="store_true", help="Перезаписать и заполненные значения")
+    args = parser.parse_args()
+
+    conn = core.init_db(args.db)
+    if args.cmd == "import":
+        r = import_reference(conn, args.path, args.dim_unit, args.weight_unit)
+        print(f"Строк: {r['rows']}, загружено: {r['imported']}, пропущено (EAN/значения): {r['invalid']}")
+    else:
+        print(f"Обновлено товаров: {enrich_from_reference(conn, args.force)}")
@@ -0,0 +1,145 @@
+"""
+Очередь обогащения по влиянию на юнит-экономику.
+
+Обогащать стоит прежде всего товары, у которых ошибка в весе или габаритах сильнее
+всего меняет логистику: тяжёлые и объёмные, у порогов тарифов Лемана Про и
+Спортмастера, дорогие. Оценка влияния товара:
+
+    impact = Σ по маркетплейсам [тариф(верхняя оценка) − тариф(нижняя оценка)]
+             + ENRICH_COST_SHARE · себестоимость
+
+Незаполненное измерение берётся из fallback по категории (dim_stats / справочник) и
+считается неточным в (1 + ENRICH_VALUE_ERROR) раз в обе стороны; заполненное —
+точным. Тарифы монотонны, поэтому разброс — разница тарифов на концах интервала:
+товар у порога веса получает разброс в ступень тарифа, далёкий от порога — ноль.
+
+Scheduler отдаёт группы (см. pim_enrich.plan_enrichment) по убыванию суммарного
+impact и останавливается по бюджету времени или токенов модели — частичный прогон
+закрывает самую дорогую часть ошибки.
+"""
+import heapq
+import itertools
+import os
+import sqlite3
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import citilink
+import dns
+import lemanpro_fbs
+import metrics
+import mvideo
+import pim_enrich
+import sportmaster_fbs
+
+VALUE_ERROR = float(os.environ.get("ENRICH_VALUE_ERROR", 0.5))
+COST_SHARE = float(os.environ.get("ENRICH_COST_SHARE", 0.01))
+DIMS = ("length_cm", "width_cm", "height_cm", "weight_kg")
+
+# Логистика по маркетплейсам: (габариты, вес) → руб
+TARIFFS = {
+    "lemanpro": lambda l, w, h, wt: lemanpro_fbs.get_last_mile_tariff("Регион", wt),
+    "sportmaster": lambda l, w, h, wt: sportmaster_fbs.get_fbs_logistics(wt),
+    "mvideo": lambda l, w, h, wt: mvideo.LOGISTICS[mvideo.classify_size(l, w, h, wt)],
+    "dns": lambda l, w, h, wt: dns.get_logistics_tariff(wt),
+    "citilink": lambda l, w, h, wt: citilink.get_logistics_tariff(wt),
+}
+
+
+def _value(v) -> float:
+    try:
+        v = float(v)
+    except (TypeError, ValueError):
+        return 0.0
+    return v if v > 0 else 0.0
+
+
+class Estimator:
+    """impact товара; оценки по категории кэшируются на время планирования."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self._fallback: Dict[Tuple[str, str], Dict] = {}
+
+    def _estimate(self, product: Dict) -> Dict:
+        category = (str(product.get("category") or "").strip()
+                    or pim_enrich.guess_category_by_name(str(product.get("name") or "")))
+        key = (category, str(product.get("brand") or "").strip())
+        if key not in self._fallback:
+            self._fallback[key] = pim_enrich.category_fallback(self.conn, {"category": category, "brand": key[1]})[0]
+        return self._fallback[key]
+
+    def impact(self, product: Dict, force: bool = False) -> float:
+        lo, hi = [], []
+        estimate = None
+        for d in DIMS:
+            v = 0.0 if force else _value(product.get(d))
+            if v:
+                lo.append(v)
+                hi.append(v)
+                continue
+            estimate = estimate or self._estimate(product)
+            e = _value(estimate.get(d))
+            lo.append(e / (1 + VALUE_ERROR))
+            hi.append(e * (1 + VALUE_ERROR))
+        spread = sum(tariff(*hi) - tariff(*lo) for tariff in TARIFFS.values())
+        return spread + COST_SHARE * _value(product.get("cost"))
+
+
+class Scheduler:
+    """
+    Приоритетная очередь задач (heapq по −impact) с бюджетом времени (с) и токенов.
+    Бюджет проверяется перед каждой задачей: начатая задача доводится до конца.
+    """
+
+    def __init__(self, time_budget_s: Optional[float] = None, token_budget: Optional[int] = None):
+        self.time_budget_s = time_budget_s or None
+        self.token_budget = token_budget or None
+        self._heap: List[Tuple[float, int, object]] = []
+        self._seq = itertools.count()
+        self.total_impact = 0.0
+        self.done_impact = 0.0
+        self.done = 0
+        self.stopped: Optional[str] = None  # "time" / "tokens", если бюджет закончился
+
+    def push(self, impact: float, job):
+        heapq.heappush(self._heap, (-impact, next(self._seq), job))
+        self.total_impact += impact
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def _exhausted(self, t0: float, tokens0: float) -> Optional[str]:
+        if self.time_budget_s and time.perf_counter() - t0 >= self.time_budget_s:
+            return "time"
+        if self.token_budget and metrics.total("ai_tokens_total") - tokens0 >= self.token_budget:
+            return "tokens"
+        return None
+
+    def __iter__(self) -> Iterator:
+        t0, tokens0 = time.perf_counter(), metrics.total("ai_tokens_total")
+        while self._heap:
+            self.stopped = self._exhausted(t0, tokens0)
+            if self.stopped:
+                metrics.inc("enrich_budget_stops_total", 1, {"budget": self.stopped},
+                            "Прогоны обогащения, остановленные по бюджету")
+                return
+            neg, _, job = heapq.heappop(self._heap)
+            self.done_impact -= neg
+            self.done += 1
+            yield job
+
+    @property
+    def coverage(self) -> float:
+        """Доля суммарного impact, закрытая обработанными задачами."""
+        return self.done_impact / self.total_impact if self.total_impact else 1.0
+
+
+def schedule(conn: sqlite3.Connection, groups: List[List[Dict]], force: bool = False,
+             time_budget_s: Optional[float] = None, token_budget: Optional[int] = None) -> Scheduler:
+    """Очередь групп вариантов: impact группы — сумма impact её товаров."""
+    estimator = Estimator(conn)
+    scheduler = Scheduler(time_budget_s, token_budget)
+    for group in groups:
+        scheduler.push(sum(estimator.impact(p, force) for p in group), group)
+    return scheduler
@@ -1,226 +1,346 @@
 """
-Generate sample PIM catalog Excel file.
-Usage: python generate_sample_catalog.py
-Output: pim_catalog_sample.xlsx
+Generate synthetic PIM catalog (sample, load and benchmark data).
+
+Usage:
+    python generate_sample_catalog.py
+    python generate_sample_catalog.py --rows 1000000 --format csv --output catalog.csv
+    python generate_sample_catalog.py --rows 500000 --format sqlite --output products_storage.db
+    python generate_sample_catalog.py --rows 100000 --dim-unit мм --weight-unit г --format parquet
+
+Output (default): pim_catalog_sample.xlsx
+
+Генератор детерминирован (seed) и потоковый: строки не накапливаются в памяти,
+поэтому можно выпускать миллионы товаров. Распределения категорий, брендов и
+габаритов строятся от CATEGORY_DEFAULTS_BUILTIN, названия содержат ключевые
+слова из CATEGORY_KEYWORDS. В данные намеренно подмешаны пропуски габаритов,
+дубликаты SKU, EAN-13 вперемешку с UPC-A и числа с десятичной запятой.
 """
-import pandas as pd
-
-
-def generate_sample():
-    """Create sample product catalog for PIM upload."""
-    
-    data = [
-        # Велосипеды / Bikes
-        {
-            "SKU": "VEL-001",
-            "Название": "Велосипед горный Trek Marlin 5 27.5",
-            "Длина": 175,
-            "Ширина": 60,
-            "Высота": 105,
-            "Вес": 13.5,
-            "Себестоимость": 25000,
-            "EAN": "4710476893205",
-            "Бренд": "Trek",
-            "Категория": "Велосипеды",
-            "Описание": "Горный велосипед начального уровня с 21 скоростью",
-            "Фото": "https://example.com/trek-marlin5.jpg",
-        },
-        {
-            "SKU": "VEL-002",
-            "Название": "Велосипед городской Giant Escape 3",
-            "Длина": 170,
-            "Ширина": 55,
-            "Высота": 100,
-            "Вес": 11.2,
-            "Себестоимость": 18000,
-            "EAN": "4713250803116",
-            "Бренд": "Giant",
-            "Категория": "Велосипеды",
-            "Описание": "Легкий городской велосипед с алюминиевой рамой",
-            "Фото": "",
-        },
-        # Самокаты / Scooters
-        {
-            "SKU": "SAM-001",
-            "Название": "Самокат детский Globber Primo 3-х колесный",
-            "Длина": 75,
-            "Ширина": 40,
-            "Высота": 80,
-            "Вес": 2.8,
-            "Себестоимость": 3500,
-            "EAN": "4897070183498",
-            "Бренд": "Globber",
-            "Категория": "Самокаты",
-            "Описание": "Трехколесный самокат для детей 2-6 лет",
-            "Фото": "",
-        },
-        {
-            "SKU": "SAM-002",
-            "Название": "Самокат Razor A5 Lux складной",
-            "Длина": 85,
-            "Ширина": 38,
-            "Высота": 95,
-            "Вес": 3.2,
-            "Себестоимость": 5200,
-            "EAN": "845423018498",
-            "Бренд": "Razor",
-            "Категория": "Самокаты",
-            "Описание": "Складной самокат для подростков и взрослых",
-            "Фото": "",
-        },
-        # Шлемы / Helmets
-        {
-            "SKU": "SHL-001",
-            "Название": "Шлем велосипедный Alpina Ownster Kids",
-            "Длина": 32,
-            "Ширина": 26,
-            "Высота": 22,
-            "Вес": 0.35,
-            "Себестоимость": 1800,
-            "EAN": "4003692289513",
-            "Бренд": "Alpina",
-            "Категория": "Шлемы",
-            "Описание": "Детский велосипедный шлем с регулировкой",
-            "Фото": "",
-        },
-        # Электротранспорт / E-transport
-        {
-            "SKU": "ELEC-001",
-            "Название": "Электросамокат Ninebot ES2",
-            "Длина": 113,
-            "Ширина": 43,
-            "Высота": 114,
-            "Вес": 12.5,
-            "Себестоимость": 28000,
-            "EAN": "8719324545136",
-            "Бренд": "Ninebot",
-            "Категория": "Электротранспорт",
-            "Описание": "Электрический самокат мощностью 300W",
-            "Фото": "",
-        },
-        # Товары без габаритов (для демонстрации обогащения)
-        {
-            "SKU": "VEL-003",
-            "Название": "Велосипед BMX Mongoose Legion L20",
-            "Длина": None,
-            "Ширина": None,
-            "Высота": None,
-            "Вес": None,
-            "Себестоимость": 12000,
-            "EAN": "",
-            "Бренд": "Mongoose",
-            "Категория": "Велосипеды",
-            "Описание": "",
-            "Фото": "",
-        },
-        {
-            "SKU": "ROL-001",
-            "Название": "Ролики Rollerblade Microblade G",
-            "Длина": None,
-            "Ширина": None,
-            "Высота": None,
-            "Вес": None,
-            "Себестоимость": 4800,
-            "EAN": "7630017001085",
-            "Бренд": "Rollerblade",
-            "Категория": "Ролики",
-            "Описание": "Детские ролики с регулируемым размером 28-32",
-            "Фото": "",
-        },
-        # Для М.Видео
-        {
-            "SKU": "TV-001",
-            "Название": "Телевизор Samsung 55 QLED 4K",
-            "Длина": None,
-            "Ширина": None,
-            "Высота": None,
-            "Вес": None,
-            "Себестоимость": 55000,
-            "EAN": "8806092044074",
-            "Бренд": "Samsung",
-            "Категория": "Телевизоры",
-            "Описание": "55-дюймовый QLED телевизор с 4K разрешением",
-            "Фото": "",
-        },
-        {
-            "SKU": "PHN-001",
-            "Название": "Смартфон Apple iPhone 15 128GB",
-            "Длина": None,
-            "Ширина": None,
-            "Высота": None,
-            "Вес": None,
-            "Себестоимость": 65000,
-            "EAN": "194253714644",
-            "Бренд": "Apple",
-            "Категория": "Смартфоны",
-            "Описание": "Смартфон Apple iPhone 15 с 128 ГБ памяти",
-            "Фото": "",
-        },
-        # Для Леман Про
-        {
-            "SKU": "TOOL-001",
-            "Название": "Перфоратор Bosch GBH 2-28 DFV",
-            "Длина": None,
-            "Ширина": None,
-            "Высота": None,
-            "Вес": None,
-            "Себестоимость": 12500,
-            "EAN": "4060649198504",
-            "Бренд": "Bosch",
-            "Категория": "Профессиональные инструменты",
-            "Описание": "Перфоратор с функцией удара и сверления",
-            "Фото": "",
-        },
-        {
-            "SKU": "TOOL-002",
-            "Название": "Шуруповерт Dewalt DCD791D2",
-            "Длина": None,
-            "Ширина": None,
-            "Высота": None,
-            "Вес": None,
-            "Себестоимость": 18000,
-            "EAN": "5706452506189",
-            "Бренд": "Dewalt",
-            "Категория": "Профессиональные инструменты",
-            "Описание": "Бесщеточный шуруповерт 18V в кейсе",
-            "Фото": "",
-        },
-    ]
-    
-    df = pd.DataFrame(data)
-    
-    # Save to Excel
-    output_file = "pim_catalog_sample.xlsx"
-    with pd.ExcelWriter(output_file, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="Каталог")
-        
-        # Format the sheet
-        ws = writer.sheets["Каталог"]
-        
-        # Set column widths
-        col_widths = {
-            "A": 12,   # SKU
-            "B": 45,   # Название
-            "C": 10,   # Длина
-            "D": 10,   # Ширина
-            "E": 10,   # Высота
-            "F": 10,   # Вес
-            "G": 15,   # Себестоимость
-            "H": 18,   # EAN
-            "I": 15,   # Бренд
-            "J": 25,   # Категория
-            "K": 50,   # Описание
-            "L": 40,   # Фото
-        }
-        for col, width in col_widths.items():
-            ws.column_dimensions[col].width = width
-    
-    print(f"Sample catalog saved to {output_file}")
-    print(f"Total products: {len(df)}")
-    print(f"With dimensions: {df['Длина'].notna().sum()}")
-    print(f"Without dimensions (for enrichment demo): {df['Длина'].isna().sum()}")
-    return df
+import argparse
+import csv
+import itertools
+import math
+import os
+import random
+from typing import Dict, Iterator, List, Optional
+
+from pim_enrich import CATEGORY_DEFAULTS_BUILTIN, CATEGORY_KEYWORDS
+
+
+COLUMNS = [
+    "SKU", "Название", "Длина", "Ширина", "Высота", "Вес", "Себестоимость",
+    "EAN", "Бренд", "Категория", "Описание", "Фото",
+]
+
+# ── Справочники для генерации ──────────────────────────────────────
+# Доли категорий в ассортименте (остальные категории — вес 1)
+CATEGORY_WEIGHTS = {
+    "Велосипеды": 8, "Самокаты": 6, "Одежда": 10, "Ботинки": 6, "Аксессуары": 8,
+    "Велозапчасти": 9, "Туризм": 7, "Инструменты": 5, "Детские товары": 5,
+    "Шлемы": 4, "Защита": 3, "Ролики": 3, "Электротранспорт": 3, "Прочее": 4,
+}
+
+# Названия по категориям: каждое содержит ключевое слово из CATEGORY_KEYWORDS
+CATEGORY_NOUNS = {
+    "Велосипеды": ["Велосипед горный", "Велосипед городской", "Велосипед BMX", "Bike MTB", "Велосипед складной"],
+    "Самокаты": ["Самокат детский", "Самокат трюковой", "Кикборд", "Scooter складной"],
+    "Скейтборды": ["Скейтборд", "Лонгборд", "Skateboard cruiser"],
+    "Ролики": ["Ролики раздвижные", "Роликовые коньки", "Inline коньки"],
+    "Шлемы": ["Шлем велосипедный", "Шлем горнолыжный", "Helmet urban", "Каска защитная"],
+    "Защита": ["Защита колена", "Наколенники", "Налокотники", "Комплект защиты"],
+    "Зимний спорт": ["Зимний комплект", "Winter набор санки"],
+    "Лыжи": ["Лыжи беговые", "Лыжи горные", "Ski комплект"],
+    "Сноуборды": ["Сноуборд", "Snowboard all-mountain"],
+    "Ботинки": ["Ботинки треккинговые", "Ботинки зимние", "Boot hiking"],
+    "Одежда": ["Куртка мембранная", "Брюки утепленные", "Футболка беговая", "Jacket softshell", "Pants trail"],
+    "Аксессуары": ["Бутылка для воды", "Чехол для телефона", "Органайзер"],
+    "Электротранспорт": ["Электросамокат", "Гироскутер", "Electric самокат"],
+    "Велозапчасти": ["Втулка задняя", "Педали алюминиевые", "Седло спортивное", "Руль райзер", "Покрышка 27.5"],
+    "Инструменты": ["Ключ шестигранный", "Насос напольный", "Набор инструментов", "Tool multitool"],
+    "Детские товары": ["Детский беговел", "Kids качели", "Детская горка"],
+    "Туризм": ["Палатка 3-местная", "Рюкзак туристический", "Спальник", "Tent ultralight"],
+    "Прочее": ["Подарочный сертификат", "Коврик для йоги", "Мяч футбольный"],
+}
+
+BRANDS = {
+    "Велосипеды": ["Trek", "Giant", "Stels", "Forward", "Merida", "Mongoose"],
+    "Самокаты": ["Globber", "Razor", "Micro", "Novatrack"],
+    "Скейтборды": ["Tempish", "Ridex", "Penny"],
+    "Ролики": ["Rollerblade", "K2", "Powerslide"],
+    "Шлемы": ["Alpina", "Giro", "Bell", "Uvex"],
+    "Защита": ["Tempish", "Ridex", "Triple Eight"],
+    "Зимний спорт": ["Nordway", "Atemi"],
+    "Лыжи": ["Fischer", "Atomic", "Salomon"],
+    "Сноуборды": ["Burton", "Nidecker", "Terror"],
+    "Ботинки": ["Salomon", "Merrell", "Columbia"],
+    "Одежда": ["Columbia", "The North Face", "Demix", "Outventure"],
+    "Аксессуары": ["Demix", "Camelbak", "Xiaomi"],
+    "Электротранспорт": ["Ninebot", "Kugoo", "Xiaomi"],
+    "Велозапчасти": ["Shimano", "SRAM", "Schwalbe", "Continental"],
+    "Инструменты": ["Topeak", "Park Tool", "Bosch", "Dewalt"],
+    "Детские товары": ["Small Rider", "Kettler", "Hape"],
+    "Туризм": ["Tramp", "Outventure", "Sivera", "MSR"],
+    "Прочее": ["Noname", "Demix"],
+}
+
+COLORS = ["черный", "белый", "красный", "синий", "зеленый", "серый", "black", "white", "red", "blue"]
+PACK_SUFFIXES = ["", "", "", "", "(2 шт)", "набор 3 шт", "x10", "упаковка 5 шт"]
+
+# Себестоимость по категориям, руб (медиана логнормального распределения)
+CATEGORY_COST = {
+    "Велосипеды": 25000, "Самокаты": 5000, "Скейтборды": 4000, "Ролики": 5000, "Шлемы": 2000,
+    "Защита": 1200, "Зимний спорт": 3000, "Лыжи": 9000, "Сноуборды": 15000, "Ботинки": 6000,
+    "Одежда": 3500, "Аксессуары": 800, "Электротранспорт": 30000, "Велозапчасти": 1500,
+    "Инструменты": 2500, "Детские товары": 3000, "Туризм": 5000, "Прочее": 1000,
+}
+
+DIM_FIELDS = [("Длина", "length_cm"), ("Ширина", "width_cm"), ("Высота", "height_cm")]
+
+
+def _ean13(rng: random.Random, prefix: str) -> str:
+    """Генерирует EAN-13 с корректной контрольной цифрой."""
+    n = 12 - len(prefix)
+    body = prefix + str(rng.randrange(10 ** n)).zfill(n)
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(body))
+    return body + str((10 - total % 10) % 10)
+
+
+def _fmt_number(rng: random.Random, value: float, comma_share: float):
+    """Часть чисел отдаём строкой с десятичной запятой — как в реальных выгрузках."""
+    if rng.random() < comma_share:
+        return f"{value:.1f}".replace(".", ",")
+    return value
+
+
+def iter_products(
+    rows: int,
+    seed: int = 42,
+    dim_unit: str = "см",
+    weight_unit: str = "кг",
+    missing_dims_share: float = 0.25,
+    duplicate_share: float = 0.02,
+    no_keyword_share: float = 0.08,
+    comma_share: float = 0.05,
+) -> Iterator[Dict]:
+    """
+    Потоково генерирует строки каталога в формате колонок Excel для PIM.
+
+    Значения габаритов/веса выдаются в единицах dim_unit / weight_unit
+    (см/мм, кг/г) — ровно так, как их прочитает импорт с нормализацией.
+    """
+    rng = random.Random(seed)
+    categories = list(CATEGORY_DEFAULTS_BUILTIN.keys())
+    cum_weights = list(itertools.accumulate(CATEGORY_WEIGHTS.get(c, 1) for c in categories))
+    dim_k = 10.0 if dim_unit in ("мм", "mm") else 1.0
+    wt_k = 1000.0 if weight_unit in ("г", "g", "гр", "gr") else 1.0
+    # Небольшой буфер последних SKU — для дубликатов без хранения всего каталога
+    recent_skus: List[str] = []
+
+    for i in range(rows):
+        category = rng.choices(categories, cum_weights=cum_weights)[0]
+        brands = BRANDS.get(category, BRANDS["Прочее"])
+        # Zipf-подобное распределение брендов внутри категории
+        brand = brands[min(int(rng.paretovariate(1.2)) - 1, len(brands) - 1)]
+
+        if rng.random() < no_keyword_share:
+            noun = rng.choice(CATEGORY_NOUNS["Прочее"])
+        else:
+            noun = rng.choice(CATEGORY_NOUNS.get(category) or CATEGORY_KEYWORDS.get(category, ["Товар"]))
+        model = f"{rng.choice('ABCDEFGHKMPRSTX')}{rng.randint(1, 999)}"
+        parts = [noun, brand, model]
+        if rng.random() < 0.5:
+            parts.append(rng.choice(COLORS))
+        pack = rng.choice(PACK_SUFFIXES)
+        if pack:
+            parts.append(pack)
+        name = " ".join(parts)
+
+        if recent_skus and rng.random() < duplicate_share:
+            sku = rng.choice(recent_skus)
+        else:
+            sku = f"{category[:3].upper()}-{seed}-{i:08d}"
+            recent_skus.append(sku)
+            if len(recent_skus) > 1000:
+                recent_skus.pop(0)
+
+        defaults = CATEGORY_DEFAULTS_BUILTIN[category]
+        row = {"SKU": sku, "Название": name}
+        missing_roll = rng.random()
+        for col, key in DIM_FIELDS:
+            value = defaults[key] * math.exp(rng.gauss(0, 0.25))
+            if missing_roll < missing_dims_share or (missing_roll < missing_dims_share * 1.2 and rng.random() < 0.5):
+                row[col] = None
+            else:
+                row[col] = _fmt_number(rng, round(value * dim_k, 1), comma_share)
+        weight = defaults["weight_kg"] * math.exp(rng.gauss(0, 0.35))
+        row["Вес"] = None if missing_roll < missing_dims_share else _fmt_number(rng, round(weight * wt_k, 3), comma_share)
+
+        row["Себестоимость"] = round(CATEGORY_COST.get(category, 1000) * math.exp(rng.gauss(0, 0.5)), 0)
+        ean_roll = rng.random()
+        if ean_roll < 0.15:
+            row["EAN"] = ""
+        elif ean_roll < 0.2:
+            row["EAN"] = _ean13(rng, "0")[1:]  # UPC-A (12 цифр)
+        else:
+            row["EAN"] = _ean13(rng, rng.choice(["460", "400", "471", "690", "880"]))
+        row["Бренд"] = brand
+        row["Категория"] = "" if rng.random() < 0.1 else category
+        row["Описание"] = f"{noun} {brand}" if rng.random() < 0.3 else ""
+        row["Фото"] = ""
+        yield row
+
+
+# ── Запись в форматы ────────────────────────────────────────────────
+def write_xlsx(rows: Iterator[Dict], output_file: str) -> int:
+    """Потоковая запись через openpyxl write_only (без загрузки листа в память)."""
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Каталог")
+    col_widths = [12, 45, 10, 10, 10, 10, 15, 18, 15, 25, 50, 40]
+    for idx, width in enumerate(col_widths):
+        ws.column_dimensions[chr(ord("A") + idx)].width = width
+    ws.append(COLUMNS)
+    count = 0
+    for row in rows:
+        if count >= 1_048_575:
+            raise ValueError("Excel ограничен 1 048 576 строками — используйте csv/parquet/sqlite")
+        ws.append([row[c] for c in COLUMNS])
+        count += 1
+    wb.save(output_file)
+    return count
+
+
+def write_csv(rows: Iterator[Dict], output_file: str) -> int:
+    count = 0
+    with open(output_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for row in rows:
+            writer.writerow(["" if row[c] is None else row[c] for c in COLUMNS])
+            count += 1
+    return count
+
+
+def write_parquet(rows: Iterator[Dict], output_file: str, batch_size: int = 100_000) -> int:
+    """Запись батчами через pyarrow; все колонки строковые, как после чтения Excel с запятыми."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(c, pa.string()) for c in COLUMNS])
+    count = 0
+    with pq.ParquetWriter(output_file, schema, compression="zstd") as writer:
+        batch = {c: [] for c in COLUMNS}
+        for row in rows:
+            for c in COLUMNS:
+                v = row[c]
+                batch[c].append(None if v is None else str(v))
+            count += 1
+            if count % batch_size == 0:
+                writer.write_table(pa.table(batch, schema=schema))
+                batch = {c: [] for c in COLUMNS}
+        if batch["SKU"]:
+            writer.write_table(pa.table(batch, schema=schema))
+    return count
+
+
+def write_sqlite(rows: Iterator[Dict], db_path: str, dim_unit: str = "см", weight_unit: str = "кг",
+                 chunk_size: int = 50_000) -> int:
+    """Пишет прямо в таблицу products (значения нормализуются в см/кг, дубликаты SKU — upsert)."""
+    import core
+    import ean_index
+
+    conn = core.init_db(db_path)
+
+    dim_k = 10.0 if dim_unit in ("мм", "mm") else 1.0
+    wt_k = 1000.0 if weight_unit in ("г", "g", "гр", "gr") else 1.0
+
+    def num(v, k):
+        if v is None:
+            return None
+        return float(str(v).replace(",", ".")) / k
+
+    sql = """
+        INSERT INTO products
+        (sku, name, length_cm, width_cm, height_cm, weight_kg, cost,
+         ean, ean_key, brand, category, description, main_image_url)
+        VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
+        ON CONFLICT(sku) DO UPDATE SET
+            name=excluded.name, length_cm=excluded.length_cm, width_cm=excluded.width_cm,
+            height_cm=excluded.height_cm, weight_kg=excluded.weight_kg, cost=excluded.cost,
+            ean=excluded.ean, ean_key=excluded.ean_key, brand=excluded.brand, category=excluded.category,
+            description=excluded.description, main_image_url=excluded.main_image_url
+    """
+    count = 0
+    chunk = []
+    for row in rows:
+        chunk.append((
+            row["SKU"], row["Название"],
+            num(row["Длина"], dim_k), num(row["Ширина"], dim_k), num(row["Высота"], dim_k),
+            num(row["Вес"], wt_k), row["Себестоимость"],
+            row["EAN"], ean_index.normalize_ean(row["EAN"]),
+            row["Бренд"], row["Категория"], row["Описание"], row["Фото"],
+        ))
+        if len(chunk) >= chunk_size:
+            conn.executemany(sql, chunk)
+            conn.commit()
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        conn.executemany(sql, chunk)
+        count += len(chunk)
+    conn.commit()
+    conn.close()
+    return count
+
+
+WRITERS = {"xlsx": write_xlsx, "csv": write_csv, "parquet": write_parquet, "sqlite": write_sqlite}
+DEFAULT_OUTPUT = {
+    "xlsx": "pim_catalog_sample.xlsx",
+    "csv": "pim_catalog_sample.csv",
+    "parquet": "pim_catalog_sample.parquet",
+    "sqlite": "products_storage.db",
+}
+
+
+def generate_sample(
+    rows: int = 20,
+    seed: int = 42,
+    fmt: str = "xlsx",
+    output_file: Optional[str] = None,
+    dim_unit: str = "см",
+    weight_unit: str = "кг",
+) -> int:
+    """Создаёт синтетический каталог товаров для загрузки в PIM и бенчмарков."""
+    output_file = output_file or DEFAULT_OUTPUT[fmt]
+    products = iter_products(rows, seed=seed, dim_unit=dim_unit, weight_unit=weight_unit)
+    if fmt == "sqlite":
+        count = write_sqlite(products, output_file, dim_unit=dim_unit, weight_unit=weight_unit)
+    else:
+        count = WRITERS[fmt](products, output_file)
+
+    print(f"Catalog saved to {output_file} ({fmt})")
+    print(f"Total rows: {count}")
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Синтетический каталог товаров для PIM")
+    parser.add_argument("--rows", type=int, default=20, help="Количество строк")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--format", choices=sorted(WRITERS), default=None,
+                        help="Формат вывода (по умолчанию — по расширению --output или xlsx)")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--dim-unit", choices=["см", "мм"], default="см")
+    parser.add_argument("--weight-unit", choices=["кг", "г"], default="кг")
+    args = parser.parse_args(argv)
+
+    fmt = args.format
+    if fmt is None and args.output:
+        ext = os.path.splitext(args.output)[1].lower().lstrip(".")
+        fmt = {"db": "sqlite", "sqlite3": "sqlite"}.get(ext, ext)
+    fmt = fmt if fmt in WRITERS else "xlsx"
+    generate_sample(args.rows, args.seed, fmt, args.output, args.dim_unit, args.weight_unit)
 
 
 if __name__ == "__main__":
-    generate_sample()
+    main()
@@ -1,7 +1,14 @@
 # lemanpro_fbs.py
 import streamlit as st
+import numpy as np
 import pandas as pd
 
+import columnar
+import core
+import commission_tables
+import perf
+import pricing_jobs
+
 # ─────────────────────────────────────────────────────────────────────────────
 # 1. СПРАВОЧНИКИ КОМИССИЙ (Sheet 1: Комиссия_FBS и FBO)
 # ─────────────────────────────────────────────────────────────────────────────
@@ -33,49 +40,44 @@ LAST_MILE = {
 
 
 def get_last_mile_tariff(zone, weight_kg):
+    """Тариф по первому порогу веса не меньше weight_kg; weight_kg — число или массив NumPy."""
     table = LAST_MILE.get(zone, LAST_MILE["Регион"])
     thresholds = sorted(table.keys())
-    for t in thresholds:
-        if weight_kg <= t:
-            return table[t]
-    return table[max(thresholds)]
-
+    tariffs = np.array([table[t] for t in thresholds])
+    return tariffs[np.minimum(np.searchsorted(thresholds, weight_kg), len(thresholds) - 1)]
+
+
+def calculate(conn, products, get_ai_category, calc_tax, params: dict, commissions: dict, zone: str,
+              commissions_version: str = commission_tables.DEFAULT_VERSION) -> pd.DataFrame:
+    """Расчёт РРЦ и маржи по каталогу (columnar.Catalog или строки sku, name, length, width, height, weight, cost)."""
+    catalog = columnar.as_catalog(products)
+    n = len(catalog)
+    logistics_lp = get_last_mile_tariff(zone, catalog.weight)
+
+    category = catalog.classify(get_ai_category, list(commissions.keys()), conn, "lemanpro")
+    commission = columnar.lookup(category, commissions)
+
+    economics = columnar.unit_economics(catalog.cost, logistics_lp + params["extra_logistics"], commission,
+                                        params, calc_tax)
+    return columnar.result_frame({
+        "SKU": catalog.sku,
+        "Название": catalog.name_array(),
+        "Вес, кг": core.pyround(catalog.weight, 3),
+        "Зона": columnar.constant(zone, n),
+        "Последняя миля, руб": logistics_lp,
+        "Категория": category,
+        "Комиссия, %": commission,
+        "Версия комиссий": columnar.constant(commissions_version, n),
+    }, economics)
 
 def render(conn, get_ai_category, normalize_value, calc_tax, params: dict):
     st.header("Лемана Про — Юнит-экономика (FBS)")
 
     # ── Боковая панель: настройки комиссий ──────────────────────────────────
     with st.sidebar:
-        st.divider()
-        st.subheader("Комиссии Лемана Про")
-        uploaded_comm = st.file_uploader(
-            "Загрузить Excel с комиссиями", type=["xlsx"], key="lp_comm_upload"
+        comm_table = commission_tables.render_sidebar(
+            conn, "lemanpro", "Комиссии Лемана Про", "lp", CATEGORY_COMMISSIONS
         )
-        if uploaded_comm and st.button("Обновить справочник", key="lp_update_comm"):
-            try:
-                df_comm = pd.read_excel(uploaded_comm)
-                new_comm = {}
-                for _, row in df_comm.iterrows():
-                    cols = list(df_comm.columns)
-                    name = str(row[cols[0]]).strip()
-                    try:
-                        val = float(str(row[cols[1]]).replace(",", "."))
-                        if name and 0 < val < 100:
-                            new_comm[name] = val
-                    except (ValueError, TypeError):
-                        pass
-                if new_comm:
-                    st.session_state["lp_commissions"] = new_comm
-                    st.success(f"Обновлено {len(new_comm)} категорий")
-                else:
-                    st.warning("Не удалось распознать категории в файле.")
-            except Exception as e:
-                st.error(f"Ошибка: {e}")
-
-        if "lp_commissions" in st.session_state:
-            st.caption(f"В кэше: {len(st.session_state['lp_commissions'])} категорий (из Excel)")
-        else:
-            st.caption(f"Используется справочник по умолчанию ({len(CATEGORY_COMMISSIONS)} категорий)")
 
         st.divider()
         st.subheader("Зона доставки")
@@ -85,7 +87,7 @@ def render(conn, get_ai_category, normalize_value, calc_tax, params: dict):
             key="lp_zone"
         )
 
-    commissions: dict = st.session_state.get("lp_commissions", CATEGORY_COMMISSIONS)
+    commissions: dict = comm_table.rates
 
     # ── Блок 1: Каталог товаров ─────────────────────────────────────────────
     with st.expander("Блок 1. Каталог товаров", expanded=True):
@@ -136,93 +138,25 @@ def render(conn, get_ai_category, normalize_value, calc_tax, params: dict):
             conn.commit()
             st.success(f"Сохранено: {saved}, пропущено: {skipped}")
 
-        all_products = conn.execute(
-            "SELECT sku, name, length_cm, width_cm, height_cm, weight_kg, cost FROM products"
-        ).fetchall()
-        if all_products:
-            df_show = pd.DataFrame(
-                all_products,
-                columns=["SKU", "Название", "Длина, см", "Ширина, см", "Высота, см", "Вес, кг", "Себестоимость, руб"]
-            )
-            st.dataframe(df_show, use_container_width=True)
+        catalog = columnar.read_catalog(conn)
+        if len(catalog):
+            df_show = catalog.frame()
+            with perf.span("render_catalog_table", rows=len(df_show)):
+                st.dataframe(df_show, use_container_width=True)
         else:
             st.info("Каталог пуст. Загрузите Excel.")
 
-    all_products = conn.execute(
-        "SELECT sku, name, length_cm, width_cm, height_cm, weight_kg, cost FROM products"
-    ).fetchall()
-    if not all_products:
+    if not len(catalog):
         st.warning("Загрузите каталог товаров для расчёта.")
         return
 
     # ── Блок 2: Расчёт юнит-экономики ──────────────────────────────────────
     with st.expander("Блок 2. Расчёт юнит-экономики", expanded=True):
-        cat_list = list(commissions.keys())
-
         if st.button("Рассчитать РРЦ для всего каталога", key="lp_calc"):
-            target_m = params["target_margin"]
-            acq = params["acquiring"]
-            ep = params["early_payout"]
-            mkt = params["marketing"]
-            extra_c = params["extra_costs"]
-            extra_l = params["extra_logistics"]
-            tax_regime = params["tax_regime"]
             zone = st.session_state.get("lp_zone", "Регион")
-
-            results = []
-            for p in all_products:
-                sku, name, l, w, h, wt, cost = p
-                cost = cost or 0.0
-
-                logistics_lp = get_last_mile_tariff(zone, wt)
-                logistics_total = logistics_lp + extra_l
-
-                category = get_ai_category(name, cat_list, conn, "lemanpro")
-                commission = commissions.get(category, 0.0)
-
-                k_percent = commission + acq + ep + mkt
-                denom = 1 - (k_percent / 100) - (target_m / 100)
-
-                if denom > 0 and cost > 0:
-                    rrc = (cost + logistics_total + extra_c) / denom
-                else:
-                    rrc = 0.0
-
-                if rrc > 0:
-                    percent_costs = rrc * (k_percent / 100)
-                    profit_before = rrc - cost - logistics_total - extra_c - percent_costs
-                    margin_before = (profit_before / rrc * 100) if rrc > 0 else 0
-                    tax, profit_after, margin_after = calc_tax(
-                        rrc,
-                        cost + logistics_total + extra_c + percent_costs,
-                        tax_regime
-                    )
-                else:
-                    profit_before = margin_before = tax = profit_after = margin_after = 0.0
-
-                results.append({
-                    "SKU": sku,
-                    "Название": name,
-                    "Вес, кг": round(wt, 3),
-                    "Зона": zone,
-                    "Последняя миля, руб": logistics_lp,
-                    "Категория": category,
-                    "Комиссия, %": commission,
-                    "Себестоимость, руб": round(cost, 0),
-                    "РРЦ, руб": round(rrc, 0),
-                    "Прибыль до налога, руб": round(profit_before, 0),
-                    "Маржа до налога, %": round(margin_before, 1),
-                    "Налог, руб": round(tax, 0),
-                    "Прибыль после налога, руб": round(profit_after, 0),
-                    "Маржа после налога, %": round(margin_after, 1),
-                })
-
-            res_df = pd.DataFrame(results)
-            st.subheader("Результаты расчёта")
-            st.dataframe(res_df, use_container_width=True)
-            st.download_button(
-                "Скачать результат (CSV)",
-                res_df.to_csv(index=False).encode("utf-8"),
-                "lemanpro_rrc_results.csv",
-                mime="text/csv"
-            )
+            pricing_jobs.start("lemanpro_fbs", conn, catalog,
+                               lambda c, chunk: calculate(c, chunk, get_ai_category, calc_tax, params, commissions,
+                                                          zone, comm_table.version),
+                               pool=("lemanpro_fbs", (params, commissions, zone, comm_table.version)),
+                               meta={"params": params, "commissions_version": comm_table.version, "zone": zone})
+        pricing_jobs.render("lemanpro_fbs", "lemanpro_rrc_results.csv")
@@ -0,0 +1,238 @@
+"""
+Локальный классификатор категорий, обученный на ответах модели из ai_cache.
+
+Признаки — символьные 3-граммы и слова названия (TF-IDF), модель — центроид
+категории для каждого client. Уверенность — относительный отрыв лучшей категории
+от второй: (s1 - s2) / s1 по косинусу с центроидами; если сам косинус s1 ниже
+LOCAL_CLF_MIN_SIM, уверенность 0 — название не похоже ни на одну категорию
+(«Холодильник» при обучении на велосипедах и одежде), и большой отрыв между
+двумя слабыми совпадениями ничего не значит. Уверенные ответы
+(>= LOCAL_CLF_THRESHOLD) отдаются за микросекунды без запроса к модели,
+остальные уходят в gpt-4o-mini как раньше.
+
+Обучается только на строках ai_cache с source='model' (ответы самого
+классификатора и fallback-категории не учитываются). Дообучение инкрементальное:
+новые строки берутся по rowid > последнего просмотренного, не чаще раза в
+LOCAL_CLF_REFRESH_S секунд.
+
+Подбор порога:
+    python local_classifier.py products_storage.db mvideo --thresholds 0.4,0.5,0.6,0.7 --min-sim 0.4
+выводит покрытие и согласие с моделью на отложенной выборке из ai_cache.
+"""
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import metrics
+import perf
+
+THRESHOLD = float(os.environ.get("LOCAL_CLF_THRESHOLD", 0.6))
+MIN_SIM = float(os.environ.get("LOCAL_CLF_MIN_SIM", 0.4))
+MIN_SAMPLES = int(os.environ.get("LOCAL_CLF_MIN_SAMPLES", 50))
+REFRESH_S = float(os.environ.get("LOCAL_CLF_REFRESH_S", 30))
+ENABLED = os.environ.get("LOCAL_CLF", "1") != "0"
+
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01)
+
+_TOKEN_RE = re.compile(r"[^\w]+")
+
+_models: Dict[Tuple[str, str], "CentroidModel"] = {}
+_models_lock = threading.Lock()
+
+
+def features(name: str) -> Counter:
+    """Символьные 3-граммы по словам (с границами) и сами слова длиннее 2 символов."""
+    words = [w for w in _TOKEN_RE.sub(" ", str(name).lower()).split() if w]
+    feats = Counter()
+    for w in words:
+        if len(w) > 2 and not w.isdigit():
+            feats["w:" + w] += 1
+        padded = f" {w} "
+        for i in range(len(padded) - 2):
+            feats[padded[i:i + 3]] += 1
+    return feats
+
+
+class CentroidModel:
+    """TF-IDF центроиды категорий одного client с инвертированным индексом признаков."""
+
+    def __init__(self):
+        self.watermark = 0
+        self.docs = 0
+        self.df = Counter()
+        self.cat_tf: Dict[str, Counter] = defaultdict(Counter)
+        self.index: Dict[str, List[Tuple[str, float]]] = {}
+        self.idf: Dict[str, float] = {}
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, name: str, category: str):
+        feats = features(name)
+        self.docs += 1
+        self.df.update(feats.keys())
+        self.cat_tf[category].update(feats)
+
+    def compile(self):
+        n = self.docs
+        idf = {f: math.log((n + 1) / (d + 1)) + 1.0 for f, d in self.df.items()}
+        index = defaultdict(list)
+        for cat, tf in self.cat_tf.items():
+            weights = {f: (1.0 + math.log(c)) * idf[f] for f, c in tf.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for f, w in weights.items():
+                index[f].append((cat, w / norm))
+        self.idf = idf
+        self.index = dict(index)
+
+    def scores(self, name: str) -> Dict[str, float]:
+        q = {f: (1.0 + math.log(c)) * self.idf[f] for f, c in features(name).items() if f in self.idf}
+        norm = math.sqrt(sum(w * w for w in q.values()))
+        if not norm:
+            return {}
+        acc = defaultdict(float)
+        for f, w in q.items():
+            for cat, cw in self.index.get(f, ()):
+                acc[cat] += w * cw
+        return {cat: s / norm for cat, s in acc.items()}
+
+    def best(self, name: str, allowed: Optional[Iterable[str]] = None,
+             min_sim: Optional[float] = None) -> Tuple[Optional[str], float]:
+        """
+        (категория, уверенность 0..1 — относительный отрыв от второй категории;
+        0, если косинус с лучшей категорией ниже min_sim).
+        """
+        scores = self.scores(name)
+        if allowed is not None:
+            allowed = set(allowed)
+            scores = {c: s for c, s in scores.items() if c in allowed}
+        if not scores:
+            return None, 0.0
+        top = sorted(scores.values(), reverse=True)[:2]
+        cat = max(scores, key=scores.get)
+        if top[0] < (MIN_SIM if min_sim is None else min_sim):
+            return cat, 0.0
+        second = top[1] if len(top) > 1 else 0.0
+        return cat, (top[0] - second) / top[0]
+
+
+def _training_rows(conn, client_key: str, after_rowid: int = 0):
+    return conn.execute("""
+        SELECT rowid, name, category FROM ai_cache
+        WHERE client=? AND rowid>? AND (source='model' OR source IS NULL)
+        ORDER BY rowid
+    """, (client_key, after_rowid)).fetchall()
+
+
+def _db_file(conn) -> str:
+    return conn.execute("PRAGMA database_list").fetchone()[2] or f":memory:{id(conn)}"
+
+
+def get_model(conn, client_key: str, force_refresh: bool = False) -> CentroidModel:
+    """Модель client (общая на процесс), дообученная на новых строках ai_cache."""
+    key = (_db_file(conn), client_key)
+    model = _models.get(key)
+    if model is None:
+        with _models_lock:
+            model = _models.setdefault(key, CentroidModel())
+    now = time.monotonic()
+    if force_refresh or now - model.checked_at >= REFRESH_S:
+        with model.lock:
+            if force_refresh or now - model.checked_at >= REFRESH_S:
+                rows = _training_rows(conn, client_key, model.watermark)
+                for rowid, name, category in rows:
+                    model.add(name, category)
+                    model.watermark = rowid
+                if rows:
+                    model.compile()
+                model.checked_at = now
+    return model
+
+
+def predict(conn, client_key: str, name: str, categories: list,
+            threshold: Optional[float] = None) -> Tuple[Optional[str], bool]:
+    """(лучшая категория или None, уверен ли классификатор: отрыв >= threshold)."""
+    if not ENABLED or not categories:
+        return None, False
+    model = get_model(conn, client_key)
+    if model.docs < MIN_SAMPLES:
+        return None, False
+    t0 = time.perf_counter()
+    category, score = model.best(name, categories)
+    elapsed = time.perf_counter() - t0
+    confident = category is not None and score >= (THRESHOLD if threshold is None else threshold)
+    labels = {"client": client_key, "result": "answered" if confident else "deferred"}
+    metrics.inc("local_classifier_total", 1, labels, "Решения локального классификатора")
+    metrics.observe("local_classifier_seconds", elapsed, {"client": client_key},
+                    "Время предсказания локального классификатора", buckets=LATENCY_BUCKETS)
+    perf.count("local_clf_hit" if confident else "local_clf_miss")
+    return category, confident
+
+
+def record_agreement(client_key: str, local_category: Optional[str], model_category: str):
+    """Согласие с моделью на неуверенных ответах (когда модель всё равно вызывалась)."""
+    if local_category is not None:
+        metrics.inc("local_classifier_agreement_total", 1,
+                    {"client": client_key, "agree": str(local_category == model_category).lower()},
+                    "Совпадение лучшей догадки классификатора с ответом модели")
+
+
+def evaluate(conn, client_key: str, thresholds: Iterable[float], holdout: float = 0.2,
+             min_sim: Optional[float] = None) -> List[Dict]:
+    """
+    Покрытие, согласие с моделью и задержка по порогам на отложенной части ai_cache.
+
+    Разбиение детерминированное (crc32 названия), поэтому результаты сопоставимы между запусками.
+    """
+    rows = _training_rows(conn, client_key)
+    model, test = CentroidModel(), []
+    for _, name, category in rows:
+        if zlib.crc32(name.encode("utf-8")) % 1000 < holdout * 1000:
+            test.append((name, category))
+        else:
+            model.add(name, category)
+    model.compile()
+    categories = list(model.cat_tf)
+
+    t0 = time.perf_counter()
+    predictions = [(model.best(name, categories, min_sim), category) for name, category in test]
+    latency_us = (time.perf_counter() - t0) / max(len(test), 1) * 1e6
+
+    report = []
+    for th in thresholds:
+        answered = [(cat, truth) for (cat, score), truth in predictions if cat is not None and score >= th]
+        agree = sum(1 for cat, truth in answered if cat == truth)
+        report.append({
+            "threshold": th,
+            "train": model.docs,
+            "test": len(test),
+            "coverage": round(len(answered) / len(test), 3) if test else 0.0,
+            "agreement": round(agree / len(answered), 3) if answered else None,
+            "latency_us": round(latency_us, 1),
+        })
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    import sqlite3
+
+    parser = argparse.ArgumentParser(description="Оценка локального классификатора на ai_cache")
+    parser.add_argument("db", nargs="?", default="products_storage.db")
+    parser.add_argument("client", help="client_key: mvideo, lemanpro, dns, citilink, sportmaster")
+    parser.add_argument("--thresholds", default="0.3,0.4,0.5,0.6,0.7,0.8")
+    parser.add_argument("--holdout", type=float, default=0.2)
+    parser.add_argument("--min-sim", type=float, default=MIN_SIM, help="Минимальный косинус с лучшей категорией")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    report = evaluate(conn, args.client, [float(t) for t in args.thresholds.split(",")], args.holdout, args.min_sim)
+    print(f"{'порог':>6} {'обучение':>9} {'тест':>6} {'покрытие':>9} {'согласие':>9} {'мкс/шт':>7}")
+    for r in report:
+        agreement = "—" if r["agreement"] is None else f"{r['agreement']:.3f}"
+        print(f"{r['threshold']:>6} {r['train']:>9} {r['test']:>6} {r['coverage']:>9.3f} "
+              f"{agreement:>9} {r['latency_us']:>7}")
@@ -0,0 +1,190 @@
+"""
+Операционные метрики процесса в формате Prometheus (text exposition 0.0.4).
+
+Экспорт:
+    METRICS_PORT=9108         — HTTP-эндпоинт http://<host>:9108/metrics (поднимается один раз на процесс)
+    METRICS_TEXTFILE=path.prom — файл для textfile-коллектора, перезаписывается после каждого запуска
+
+Что считаем: запросы к модели, задержки (гистограмма), ошибки и токены по
+client_key; попадания/промахи кэшей (ai_cache, обогащение и др.);
+строк/сек импорта и расчёта; очередь обогащения.
+"""
+import functools
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_meta: Dict[str, Tuple[str, str]] = {}  # name -> (type, help)
+_values: Dict[str, Dict[Tuple, float]] = {}
+_histograms: Dict[str, Dict[Tuple, Dict]] = {}
+_server = None
+
+
+def _key(labels: Optional[Dict]) -> Tuple:
+    return tuple(sorted((labels or {}).items()))
+
+
+def _declare(name: str, mtype: str, help_text: str):
+    if name not in _meta:
+        _meta[name] = (mtype, help_text)
+
+
+def inc(name: str, value: float = 1.0, labels: Optional[Dict] = None, help_text: str = ""):
+    _inc(name, _key(labels), value, help_text)
+
+
+def _inc(name: str, k: Tuple, value: float, help_text: str):
+    with _lock:
+        _declare(name, "counter", help_text)
+        series = _values.setdefault(name, {})
+        series[k] = series.get(k, 0.0) + value
+
+
+def set_gauge(name: str, value: float, labels: Optional[Dict] = None, help_text: str = ""):
+    with _lock:
+        _declare(name, "gauge", help_text)
+        _values.setdefault(name, {})[_key(labels)] = float(value)
+
+
+def observe(name: str, value: float, labels: Optional[Dict] = None, help_text: str = "",
+            buckets=LATENCY_BUCKETS):
+    with _lock:
+        _declare(name, "histogram", help_text)
+        series = _histograms.setdefault(name, {})
+        h = series.setdefault(_key(labels), {"buckets": list(buckets), "counts": [0] * len(buckets),
+                                             "sum": 0.0, "count": 0})
+        for i, b in enumerate(h["buckets"]):
+            if value <= b:
+                h["counts"][i] += 1
+        h["sum"] += value
+        h["count"] += 1
+
+
+def total(name: str) -> float:
+    """Сумма счётчика по всем сериям (например, токены модели с начала процесса)."""
+    with _lock:
+        return sum(_values.get(name, {}).values())
+
+
+# ── Доменные хелперы ────────────────────────────────────────────────
+def observe_ai_call(client_key: str, model: str, seconds: float, usage=None, error: Optional[BaseException] = None):
+    labels = {"client": client_key, "model": model}
+    inc("ai_requests_total", 1, labels, "Запросы к модели")
+    observe("ai_request_duration_seconds", seconds, labels, "Длительность запроса к модели")
+    if error is not None:
+        inc("ai_request_failures_total", 1, {**labels, "error": type(error).__name__}, "Неуспешные запросы к модели")
+    if usage is not None:
+        for kind in ("prompt_tokens", "completion_tokens"):
+            n = getattr(usage, kind, None)
+            if n:
+                inc("ai_tokens_total", n, {**labels, "type": kind.split("_")[0]}, "Токены модели")
+
+
+@functools.lru_cache(maxsize=1024)
+def _cache_labels(cache: str, hit: bool, client_key: str) -> Tuple:
+    labels = {"cache": cache, "result": "hit" if hit else "miss"}
+    if client_key:
+        labels["client"] = client_key
+    return _key(labels)
+
+
+def cache_lookup(cache: str, hit: bool, client_key: str = ""):
+    # вызывается на каждый поиск в кэше — ключ серии не пересобирается
+    _inc("cache_lookups_total", _cache_labels(cache, hit, client_key), 1, "Обращения к кэшам")
+
+
+def observe_throughput(stage: str, rows: int, seconds: float, **labels):
+    """Строки и время этапа (import / pricing / enrich): rate() даёт строк/сек."""
+    labels = {"stage": stage, **labels}
+    inc("stage_rows_total", rows, labels, "Обработано строк по этапам")
+    inc("stage_seconds_total", seconds, labels, "Время этапов, с")
+    if seconds > 0:
+        set_gauge("stage_rows_per_second", rows / seconds, labels, "Строк/сек последнего прогона этапа")
+
+
+# ── Экспорт ─────────────────────────────────────────────────────────
+def _fmt_labels(key: Tuple, extra: Optional[Tuple] = None) -> str:
+    items = list(key) + list(extra or ())
+    if not items:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+def render_text() -> str:
+    lines = []
+    with _lock:
+        for name in sorted(_meta):
+            mtype, help_text = _meta[name]
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {mtype}")
+            if mtype == "histogram":
+                for k, h in _histograms.get(name, {}).items():
+                    for b, c in zip(h["buckets"], h["counts"]):
+                        lines.append(f"{name}_bucket{_fmt_labels(k, (('le', repr(float(b))),))} {c}")
+                    lines.append(f"{name}_bucket{_fmt_labels(k, (('le', '+Inf'),))} {h['count']}")
+                    lines.append(f"{name}_sum{_fmt_labels(k)} {h['sum']}")
+                    lines.append(f"{name}_count{_fmt_labels(k)} {h['count']}")
+            else:
+                for k, v in _values.get(name, {}).items():
+                    lines.append(f"{name}{_fmt_labels(k)} {v}")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: str):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render_text())
+    os.replace(tmp, path)
+
+
+def start_http_server(port: int, host: str = "0.0.0.0"):
+    """Поднимает /metrics в фоновом потоке (повторные вызовы игнорируются)."""
+    global _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    with _lock:
+        if _server is not None:
+            return _server
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = render_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        _server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    return _server
+
+
+def export_from_env():
+    """Вызывается в конце каждого запуска app.py: эндпоинт и/или textfile по переменным окружения."""
+    # До записи файла: иначе в файле оказывается время предыдущего экспорта
+    set_gauge("process_last_export_timestamp_seconds", time.time(), help_text="Время последнего экспорта метрик")
+    port = os.environ.get("METRICS_PORT")
+    if port:
+        try:
+            start_http_server(int(port))
+        except OSError:
+            pass  # порт занят другим процессом — метрики остаются доступны через textfile
+    path = os.environ.get("METRICS_TEXTFILE")
+    if path:
+        try:
+            write_textfile(path)
+        except OSError:
+            pass
@@ -1,8 +1,13 @@
 # mvideo.py — модуль М.Видео FBS
 import streamlit as st
+import numpy as np
 import pandas as pd
 import sqlite3
 
+import columnar
+import perf
+import pricing_jobs
+
 # Фиксированные комиссии М.Видео из файла (applications-1new.xlsx)
 COMMISSIONS = {
     "Автотовары": 20.5,
@@ -48,17 +53,44 @@ COMMISSIONS = {
 
 # Тарифы логистики FBS (applications-2-v2.pdf, 2026)
 LOGISTICS = {"S": 109, "M": 149, "L": 259, "XL": 259}
+# Классы размера: (класс, макс. вес кг, макс. объём дм3); всё крупнее — XL
+SIZE_LIMITS = (("S", 1, 27), ("M", 5, 54), ("L", 25, 160))
+SIZE_TYPES = tuple(s for s, _, _ in SIZE_LIMITS) + ("XL",)
 
 def classify_size(length_cm: float, width_cm: float, height_cm: float, weight_kg: float) -> str:
     vol = (length_cm * width_cm * height_cm) / 1000.0  # дм3
-    if weight_kg <= 1 and vol <= 27:
-        return "S"
-    elif weight_kg <= 5 and vol <= 54:
-        return "M"
-    elif weight_kg <= 25 and vol <= 160:
-        return "L"
-    else:
-        return "XL"
+    for size_type, max_weight, max_vol in SIZE_LIMITS:
+        if weight_kg <= max_weight and vol <= max_vol:
+            return size_type
+    return "XL"
+
+def classify_sizes(length_cm: np.ndarray, width_cm: np.ndarray, height_cm: np.ndarray,
+                   weight_kg: np.ndarray) -> pd.Categorical:
+    """classify_size по массивам."""
+    vol = (length_cm * width_cm * height_cm) / 1000.0
+    fits = [(weight_kg <= max_weight) & (vol <= max_vol) for _, max_weight, max_vol in SIZE_LIMITS]
+    codes = np.select(fits, range(len(SIZE_LIMITS)), default=len(SIZE_LIMITS)).astype(np.int8)
+    return columnar.categorical(codes, SIZE_TYPES)
+
+def calculate(conn, products, get_ai_category, calc_tax, params: dict) -> pd.DataFrame:
+    """Расчёт РРЦ и маржи по каталогу (columnar.Catalog или строки sku, name, length, width, height, weight, cost)."""
+    catalog = columnar.as_catalog(products)
+    size_type = classify_sizes(catalog.length, catalog.width, catalog.height, catalog.weight)
+    logistics_mv = np.array([LOGISTICS[s] for s in SIZE_TYPES])[size_type.codes]
+
+    category = catalog.classify(get_ai_category, list(COMMISSIONS.keys()), conn, "mvideo")
+    commission = columnar.lookup(category, COMMISSIONS)
+
+    economics = columnar.unit_economics(catalog.cost, logistics_mv + params["extra_logistics"], commission,
+                                        params, calc_tax)
+    return columnar.result_frame({
+        "SKU": catalog.sku,
+        "Название": catalog.name_array(),
+        "Тип": size_type,
+        "Логистика МВ, руб": logistics_mv,
+        "Категория": category,
+        "Комиссия, %": commission,
+    }, economics)
 
 def render(conn, get_ai_category, normalize_value, calc_tax, params: dict):
     st.header("М.Видео — Юнит-экономика (FBS)")
@@ -118,87 +150,24 @@ def render(conn, get_ai_category, normalize_value, calc_tax, params: dict):
             conn.commit()
             st.success(f"Сохранено: {saved}, пропущено: {skipped}")
 
-        all_products = conn.execute(
-            "SELECT sku, name, length_cm, width_cm, height_cm, weight_kg, cost FROM products"
-        ).fetchall()
+        catalog = columnar.read_catalog(conn)
         
-        if all_products:
-            df_show = pd.DataFrame(all_products, 
-                columns=["SKU", "Название", "Длина, см", "Ширина, см", "Высота, см", "Вес, кг", "Себестоимость, руб"])
-            st.dataframe(df_show, use_container_width=True)
+        if len(catalog):
+            df_show = catalog.frame()
+            with perf.span("render_catalog_table", rows=len(df_show)):
+                st.dataframe(df_show, use_container_width=True)
         else:
             st.info("Каталог пуст. Загрузите Excel.")
 
     # Блок 2: Расчёт
     with st.expander("Блок 2. Расчёт юнит-экономики", expanded=True):
-        all_products = conn.execute(
-            "SELECT sku, name, length_cm, width_cm, height_cm, weight_kg, cost FROM products"
-        ).fetchall()
-        
-        if not all_products:
+        if not len(catalog):
             st.warning("Загрузите каталог товаров для расчёта.")
             return
 
-        cat_list = list(COMMISSIONS.keys())
         if st.button("Рассчитать РРЦ для всего каталога", key="mv_calc"):
-            target_m = params["target_margin"]
-            acq = params["acquiring"]
-            ep = params["early_payout"]
-            mkt = params["marketing"]
-            extra_c = params["extra_costs"]
-            extra_l = params["extra_logistics"]
-            tax_regime = params["tax_regime"]
-
-            results = []
-            for p in all_products:
-                sku, name, l, w, h, wt, cost = p
-                cost = cost or 0.0
-                
-                size_type = classify_size(l, w, h, wt)
-                logistics_mv = LOGISTICS.get(size_type, 259)
-                logistics_total = logistics_mv + extra_l
-                
-                category = get_ai_category(name, cat_list, conn, "mvideo")
-                commission = COMMISSIONS.get(category, 0.0)
-                
-                k_percent = commission + acq + ep + mkt
-                denom = 1 - (k_percent / 100) - (target_m / 100)
-                
-                if denom > 0 and cost > 0:
-                    rrc = (cost + logistics_total + extra_c) / denom
-                else:
-                    rrc = 0.0
-                
-                if rrc > 0:
-                    percent_costs = rrc * (k_percent / 100)
-                    profit_before = rrc - cost - logistics_total - extra_c - percent_costs
-                    margin_before = (profit_before / rrc * 100) if rrc > 0 else 0
-                    tax, profit_after, margin_after = calc_tax(rrc, cost + logistics_total + extra_c + percent_costs, tax_regime)
-                else:
-                    profit_before = margin_before = tax = profit_after = margin_after = 0.0
-                
-                results.append({
-                    "SKU": sku,
-                    "Название": name,
-                    "Тип": size_type,
-                    "Логистика МВ, руб": logistics_mv,
-                    "Категория": category,
-                    "Комиссия, %": commission,
-                    "Себестоимость, руб": round(cost, 0),
-                    "РРЦ, руб": round(rrc, 0),
-                    "Прибыль до налога, руб": round(profit_before, 0),
-                    "Маржа до налога, %": round(margin_before, 1),
-                    "Налог, руб": round(tax, 0),
-                    "Прибыль после налога, руб": round(profit_after, 0),
-                    "Маржа после налога, %": round(margin_after, 1),
-                })
-            
-            res_df = pd.DataFrame(results)
-            st.subheader("Результаты расчёта")
-            st.dataframe(res_df, use_container_width=True)
-            st.download_button(
-                "Скачать результат (CSV)",
-                res_df.to_csv(index=False).encode("utf-8"),
-                "mvideo_rrc_results.csv",
-                mime="text/csv"
-            )
+            pricing_jobs.start("mvideo", conn, catalog,
+                               lambda c, chunk: calculate(c, chunk, get_ai_category, calc_tax, params),
+                               pool=("mvideo", (params,)),
+                               meta={"params": params})
+        pricing_jobs.render("mvideo", "mvideo_rrc_results.csv")
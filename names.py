@@ -0,0 +1,108 @@
+"""
+Канонизация названий товаров для ключей кэшей (ai_cache.name_key).
+
+Варианты одного товара у разных поставщиков отличаются регистром, пробелами,
+кавычками, цветом и фасовкой в конце названия:
+
+    «Самокат  Globber X584» синий (2 шт)  →  самокат globber x584
+    Самокат Globber X584, Blue, упаковка 5 шт  →  самокат globber x584
+
+Цвет и фасовка срезаются только в хвосте названия, модели и артикулы внутри не трогаются;
+одиночный «X5» в конце — тоже модель (Razor X5), фасовка — «x5 шт», «2 x 5», «серый x10».
+
+variant_name — ключ вариантов одной модели для обогащения габаритов: в хвосте срезаются
+цвет (в любом роде) и размер одежды/обуви, а фасовка остаётся — упаковка из 5 штук
+весит иначе, чем одна:
+
+    Куртка Columbia R320 синяя, размер XL  →  куртка columbia r320
+    Каска Bell B368 (2 шт)                 →  каска bell b368 (2 шт)
+"""
+import functools
+import hashlib
+import re
+
+COLORS = {
+    "черный", "белый", "красный", "синий", "голубой", "зеленый", "серый",
+    "желтый", "оранжевый", "розовый", "фиолетовый", "коричневый", "бежевый",
+    "серебристый", "золотистый", "хаки", "бирюзовый", "мультиколор",
+    "black", "white", "red", "blue", "green", "grey", "gray", "yellow", "orange", "pink",
+    "purple", "brown", "beige", "silver", "gold",
+}
+
+_QUOTES_RE = re.compile(r"[\"'«»„“”‘’`]")
+_TAIL_PUNCT = " ,;.-–—/|"
+_PACK_RE = re.compile(
+    r"\(\s*\d+\s*шт\.?\s*\)"                               # (2 шт)
+    r"|(?:упаковка|набор|комплект)(?:\s+из)?\s+\d+\s*шт\.?"   # упаковка 5 шт, набор из 3 шт
+    r"|\d+\s*шт\.?(?:\s+в\s+упаковке)?"                      # 4 шт, 4 шт. в упаковке
+    # Множитель — только рядом с числом, единицей или словом упаковки: X5 у «Razor X5» — модель
+    r"|\d+\s?[xх×]\s?\d{1,3}"                                   # 2 x 5, 2x5
+    r"|(?:(?:упаковка|набор|комплект)\s+)?[xх×]\s?\d{1,3}\s*шт\.?"  # x5 шт, упаковка x5 шт
+    r"|(?:упаковка|набор|комплект)\s+[xх×]\s?\d{1,3}"             # упаковка x5
+    r"|\(\s*[xх×]\s?\d{1,3}\s*\)"                                # (x10)
+)
+_PACK_COUNT_RE = re.compile(r"[xх×]\d{1,3}")  # x10 сразу после цвета: «серый x10»
+_PACK_MAX_TOKENS = 5
+_LETTER_SIZE = r"x{0,3}s|m|l|x{1,4}l|[2-6]xl"                   # s, m, xl, 3xl
+# После префикса обязательно значение размера: «ручной», «рама», «usb», «euro» — не размеры
+_SIZE_RE = re.compile(
+    rf"(?:размер|разм\.?|р\.?|size|рост|eu|us|uk)\s?(?:\d+(?:[.,/-]\d+)*|{_LETTER_SIZE})"  # размер XL, р. 42, рост 164-170
+    rf"|{_LETTER_SIZE}"
+)
+_SIZE_MAX_TOKENS = 2
+_ADJ_ENDINGS = ("ый", "ий", "ой", "ая", "яя", "ое", "ее", "ые", "ие")
+_COLOR_STEMS = {c[:-2] for c in COLORS if c.endswith(_ADJ_ENDINGS)}
+
+
+def canonical_name(name) -> str:
+    tokens = _QUOTES_RE.sub(" ", str(name or "").lower().replace("ё", "е")).split()
+    while len(tokens) > 1:
+        last = tokens[-1].rstrip(_TAIL_PUNCT)
+        if not last:
+            tokens.pop()
+            continue
+        tokens[-1] = last
+        if last.strip("()") in COLORS:
+            tokens.pop()
+            continue
+        if _PACK_COUNT_RE.fullmatch(last) and tokens[-2].rstrip(_TAIL_PUNCT) in COLORS:
+            tokens.pop()
+            continue
+        for k in range(min(_PACK_MAX_TOKENS, len(tokens) - 1), 0, -1):
+            if _PACK_RE.fullmatch(" ".join(tokens[-k:])):
+                del tokens[-k:]
+                break
+        else:
+            break
+    return " ".join(tokens)
+
+
+@functools.lru_cache(maxsize=65536)
+def name_key(name) -> str:
+    """Короткий хеш канонического названия (индексируемый ключ поиска)."""
+    return hashlib.blake2b(canonical_name(name).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _is_color(token: str) -> bool:
+    return token in COLORS or (len(token) > 4 and token.endswith(_ADJ_ENDINGS) and token[:-2] in _COLOR_STEMS)
+
+
+def variant_name(name) -> str:
+    """Название без цвета и размера в хвосте — общее для вариантов одной модели."""
+    tokens = _QUOTES_RE.sub(" ", str(name or "").lower().replace("ё", "е")).split()
+    while len(tokens) > 1:
+        last = tokens[-1].rstrip(_TAIL_PUNCT)
+        if not last:
+            tokens.pop()
+            continue
+        tokens[-1] = last
+        if _is_color(last.strip("()")):
+            tokens.pop()
+            continue
+        for k in range(min(_SIZE_MAX_TOKENS, len(tokens) - 1), 0, -1):
+            if _SIZE_RE.fullmatch(" ".join(tokens[-k:]).strip("()")):
+                del tokens[-k:]
+                break
+        else:
+            break
+    return " ".join(tokens)
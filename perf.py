@@ -0,0 +1,138 @@
+"""
+Лёгкие замеры этапов (spans) одного прогона Streamlit-скрипта.
+
+    perf.start_run("М.Видео (FBS)")
+    with perf.span("sqlite_read") as sp:
+        rows = conn.execute(...).fetchall()
+        sp["rows"] = len(rows)
+    perf.count("ai_cache_hit")
+    run = perf.end_run()          # + строка в perf_log.jsonl (путь — PERF_LOG)
+    perf.render_panel(run)        # свёрнутая панель в сайдбаре
+
+Spans с одинаковым именем суммируются (время, вызовы, строки). В каждый span
+записывается прирост счётчиков *_hit / *_miss за время его работы — отсюда
+доля попаданий в кэш по этапам. Без start_run() все вызовы — no-op, поэтому
+модули можно вызывать и вне Streamlit (бенчмарки, фоновые задачи).
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+LOG_PATH = os.environ.get("PERF_LOG", "perf_log.jsonl")
+
+_local = threading.local()
+_log_lock = threading.Lock()
+
+
+def _current():
+    return getattr(_local, "run", None)
+
+
+def start_run(label: str = ""):
+    _local.run = {
+        "label": label,
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "t0": time.perf_counter(),
+        "spans": {},
+        "counters": {},
+        "depth": 0,
+    }
+
+
+def count(name: str, n: int = 1):
+    run = _current()
+    if run is not None:
+        run["counters"][name] = run["counters"].get(name, 0) + n
+
+
+def _cache_counters(counters: dict) -> dict:
+    return {k: v for k, v in counters.items() if k.endswith("_hit") or k.endswith("_miss")}
+
+
+@contextmanager
+def span(name: str, rows=None):
+    """Замер этапа; в yield-словарь можно дописать rows, после выхода в нём есть seconds."""
+    run = _current()
+    info = {"rows": rows, "seconds": 0.0}
+    if run is None:
+        t0 = time.perf_counter()
+        try:
+            yield info
+        finally:
+            info["seconds"] = time.perf_counter() - t0
+        return
+    before = _cache_counters(run["counters"])
+    run["depth"] += 1
+    depth = run["depth"]
+    t0 = time.perf_counter()
+    try:
+        yield info
+    finally:
+        elapsed = time.perf_counter() - t0
+        info["seconds"] = elapsed
+        run["depth"] -= 1
+        s = run["spans"].setdefault(name, {
+            "name": name, "depth": depth, "ms": 0.0, "calls": 0, "rows": 0,
+            "cache_hits": 0, "cache_misses": 0,
+        })
+        s["ms"] += elapsed * 1000
+        s["calls"] += 1
+        s["rows"] += info.get("rows") or 0
+        after = _cache_counters(run["counters"])
+        for k, v in after.items():
+            delta = v - before.get(k, 0)
+            s["cache_hits" if k.endswith("_hit") else "cache_misses"] += delta
+
+
+def end_run(log_path: str = LOG_PATH):
+    """Завершает прогон, пишет его в структурированный лог и возвращает сводку."""
+    run = _current()
+    if run is None:
+        return None
+    _local.run = None
+    spans = []
+    for s in run["spans"].values():
+        s = dict(s)
+        s["ms"] = round(s["ms"], 2)
+        lookups = s["cache_hits"] + s["cache_misses"]
+        s["cache_hit_rate"] = round(s["cache_hits"] / lookups, 3) if lookups else None
+        spans.append(s)
+    summary = {
+        "ts": run["ts"],
+        "label": run["label"],
+        "total_ms": round((time.perf_counter() - run["t0"]) * 1000, 2),
+        "spans": spans,
+        "counters": run["counters"],
+    }
+    if log_path:
+        try:
+            with _log_lock, open(log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(summary, ensure_ascii=False) + "\n")
+        except OSError:
+            pass
+    return summary
+
+
+def render_panel(summary, title: str = "⏱ Производительность (последний запуск)"):
+    """Свёрнутая панель в сайдбаре с разбивкой последнего прогона."""
+    import streamlit as st
+
+    if not summary:
+        return
+    with st.sidebar.expander(title, expanded=False):
+        st.caption(f"{summary['label']} · всего {summary['total_ms']:.0f} мс")
+        if summary["spans"]:
+            import pandas as pd
+
+            df = pd.DataFrame(summary["spans"])
+            df["name"] = df["depth"].map(lambda d: "  " * (d - 1)) + df["name"]
+            st.dataframe(
+                df[["name", "ms", "calls", "rows", "cache_hit_rate"]].rename(columns={
+                    "name": "Этап", "ms": "мс", "calls": "Вызовы", "rows": "Строк", "cache_hit_rate": "Кэш, доля",
+                }),
+                use_container_width=True, hide_index=True,
+            )
+        if summary["counters"]:
+            st.caption(", ".join(f"{k}: {v}" for k, v in sorted(summary["counters"].items())))
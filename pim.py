@@ -2,16 +2,90 @@
 import streamlit as st
 import pandas as pd
 import sqlite3
+from io import BytesIO
+import os
+import tempfile
+import time
+import ai_client
+import category_mapping
+import core
+import dim_impute
+import ean_index
+import enrich_scheduler
+import metrics
+import perf
 import pim_enrich
+import search_web
+
+
+def import_catalog(conn: sqlite3.Connection, df: pd.DataFrame, normalize_value, dim_unit: str, weight_unit: str) -> int:
+    """Загружает товары из DataFrame (колонки как в Excel-шаблоне) в products. Возвращает число строк."""
+    c = conn.cursor()
+    count = 0
+    t0 = time.perf_counter()
+    for _, row in df.iterrows():
+        sku = str(row.get("SKU", "")).strip()
+        name = str(row.get("Название", "")).strip()
+        if not sku or not name:
+            continue
+
+        length = normalize_value(row.get("Длина", 0), dim_unit)
+        width = normalize_value(row.get("Ширина", 0), dim_unit)
+        height = normalize_value(row.get("Высота", 0), dim_unit)
+        weight = normalize_value(row.get("Вес", 0), weight_unit)
+        cost = float(row.get("Себестоимость", 0) or 0)
+
+        ean = str(row.get("EAN", "") or "").strip()
+        brand = str(row.get("Бренд", "") or "").strip()
+        category = str(row.get("Категория", "") or "").strip()
+        desc = str(row.get("Описание", "") or "").strip()
+        img = str(row.get("Фото", "") or "").strip()
+
+        c.execute("""
+            INSERT INTO products
+            (sku, name, length_cm, width_cm, height_cm, weight_kg, cost,
+             ean, ean_key, brand, category, description, main_image_url)
+            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
+            ON CONFLICT(sku) DO UPDATE SET
+                name=excluded.name, length_cm=excluded.length_cm, width_cm=excluded.width_cm,
+                height_cm=excluded.height_cm, weight_kg=excluded.weight_kg, cost=excluded.cost,
+                ean=excluded.ean, ean_key=excluded.ean_key, brand=excluded.brand, category=excluded.category,
+                description=excluded.description, main_image_url=excluded.main_image_url
+        """, (sku, name, length, width, height, weight, cost, ean, ean_index.normalize_ean(ean),
+              brand, category, desc, img))
+        count += 1
+    conn.commit()
+    metrics.observe_throughput("import", count, time.perf_counter() - t0)
+    return count
+
+
+def filter_catalog(df_view: pd.DataFrame, categories, brands, only_empty: bool) -> pd.DataFrame:
+    """Фильтры каталога по категориям, брендам и незаполненным габаритам."""
+    df_filtered = df_view.copy()
+    if categories:
+        df_filtered = df_filtered[df_filtered["Категория"].isin(categories)]
+    if brands:
+        df_filtered = df_filtered[df_filtered["Бренд"].isin(brands)]
+    if only_empty:
+        df_filtered = df_filtered[
+            df_filtered[["Длина (см)", "Ширина (см)", "Высота (см)", "Вес (кг)"]].isna().any(axis=1)
+        ]
+    return df_filtered
+
+
+def export_excel(df: pd.DataFrame) -> BytesIO:
+    """Excel-файл каталога в памяти (для download_button)."""
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name="Каталог")
+    output.seek(0)
+    return output
 
 
 def render(conn: sqlite3.Connection, normalize_value, api_key: str):
     """Отображает страницу PIM с каталогом товаров и функциями обогащения."""
     st.title("📦 PIM — Каталог товаров")
 
-    # Инициализация PIM-таблиц
-    pim_enrich.init_pim_tables(conn)
-
     st.divider()
 
     # ── Блок 1: Загрузка каталога из Excel ──────────────────────────
@@ -29,37 +103,8 @@ def render(conn: sqlite3.Connection, normalize_value, api_key: str):
             if not all(c in df.columns for c in required):
                 st.error(f"Файл должен содержать минимум: {required}")
             else:
-                c = conn.cursor()
-                for _, row in df.iterrows():
-                    sku = str(row.get("SKU", "")).strip()
-                    name = str(row.get("Название", "")).strip()
-                    if not sku or not name:
-                        continue
-
-                    length = normalize_value(row.get("Длина", 0), dim_unit)
-                    width = normalize_value(row.get("Ширина", 0), dim_unit)
-                    height = normalize_value(row.get("Высота", 0), dim_unit)
-                    weight = normalize_value(row.get("Вес", 0), weight_unit)
-                    cost = float(row.get("Себестоимость", 0) or 0)
-
-                    ean = str(row.get("EAN", "") or "").strip()
-                    brand = str(row.get("Бренд", "") or "").strip()
-                    category = str(row.get("Категория", "") or "").strip()
-                    desc = str(row.get("Описание", "") or "").strip()
-                    img = str(row.get("Фото", "") or "").strip()
-
-                    c.execute("""
-                        INSERT INTO products
-                        (sku, name, length_cm, width_cm, height_cm, weight_kg, cost,
-                         ean, brand, category, description, main_image_url)
-                        VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
-                        ON CONFLICT(sku) DO UPDATE SET
-                            name=excluded.name, length_cm=excluded.length_cm, width_cm=excluded.width_cm,
-                            height_cm=excluded.height_cm, weight_kg=excluded.weight_kg, cost=excluded.cost,
-                            ean=excluded.ean, brand=excluded.brand, category=excluded.category,
-                            description=excluded.description, main_image_url=excluded.main_image_url
-                    """, (sku, name, length, width, height, weight, cost, ean, brand, category, desc, img))
-                conn.commit()
+                with perf.span("import_catalog") as sp:
+                    sp["rows"] = import_catalog(conn, df, normalize_value, dim_unit, weight_unit)
                 st.success(f"✅ Загружено {len(df)} товаров")
                 st.rerun()
 
@@ -67,11 +112,13 @@ def render(conn: sqlite3.Connection, normalize_value, api_key: str):
 
     # ── Блок 2: Просмотр каталога ───────────────────────────────────
     c = conn.cursor()
-    products = c.execute("""
-        SELECT id, sku, name, brand, category, length_cm, width_cm, height_cm, weight_kg,
-               cost, ean, enrich_status, enrich_source
-        FROM products ORDER BY id DESC
-    """).fetchall()
+    with perf.span("sqlite_read") as sp:
+        products = c.execute("""
+            SELECT id, sku, name, brand, category, length_cm, width_cm, height_cm, weight_kg,
+                   cost, ean, enrich_status, enrich_source
+            FROM products ORDER BY id DESC
+        """).fetchall()
+        sp["rows"] = len(products)
 
     st.subheader(f"Товары в каталоге ({len(products)})")
 
@@ -79,11 +126,12 @@ def render(conn: sqlite3.Connection, normalize_value, api_key: str):
         st.info("Каталог пуст — загрузите Excel файл")
         return
 
-    df_view = pd.DataFrame(products, columns=[
-        "ID", "SKU", "Название", "Бренд", "Категория",
-        "Длина (см)", "Ширина (см)", "Высота (см)", "Вес (кг)", "Себестоимость",
-        "EAN", "Статус обогащения", "Источник"
-    ])
+    with perf.span("catalog_dataframe", rows=len(products)):
+        df_view = pd.DataFrame(products, columns=[
+            "ID", "SKU", "Название", "Бренд", "Категория",
+            "Длина (см)", "Ширина (см)", "Высота (см)", "Вес (кг)", "Себестоимость",
+            "EAN", "Статус обогащения", "Источник"
+        ])
 
     # Фильтры
     col1, col2, col3 = st.columns(3)
@@ -94,30 +142,22 @@ def render(conn: sqlite3.Connection, normalize_value, api_key: str):
     with col3:
         show_empty = st.checkbox("Только без габаритов/веса", key="show_empty")
 
-    df_filtered = df_view.copy()
-    if filt_cat:
-        df_filtered = df_filtered[df_filtered["Категория"].isin(filt_cat)]
-    if filt_brand:
-        df_filtered = df_filtered[df_filtered["Бренд"].isin(filt_brand)]
-    if show_empty:
-        df_filtered = df_filtered[
-            df_filtered[["Длина (см)", "Ширина (см)", "Высота (см)", "Вес (кг)"]].isna().any(axis=1)
-        ]
+    with perf.span("filter_catalog", rows=len(df_view)):
+        df_filtered = filter_catalog(df_view, filt_cat, filt_brand, show_empty)
 
-    st.dataframe(df_filtered, use_container_width=True, height=400)
+    with perf.span("render_catalog_table", rows=len(df_filtered)):
+        st.dataframe(df_filtered, use_container_width=True, height=400)
 
         # Кнопка экспорта каталога в Excel
     if len(df_filtered) > 0:
-        # Создаем Excel файл в памяти
-        from io import BytesIO
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df_filtered.to_excel(writer, index=False, sheet_name="Каталог")
-        output.seek(0)
-        
+        # Excel собирается только по нажатию кнопки, а не на каждом перезапуске
+        def build_excel(df=df_filtered):
+            with perf.span("export_excel", rows=len(df)):
+                return export_excel(df).getvalue()
+
         st.download_button(
             label="📥 Скачать каталог в Excel",
-            data=output,
+            data=build_excel,
             file_name=f"pim_catalog_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             key="export_catalog",
@@ -126,6 +166,12 @@ def render(conn: sqlite3.Connection, normalize_value, api_key: str):
 
     st.divider()
 
+    # ── Сопоставление категорий PIM с категориями маркетплейсов ──────
+    with st.expander("🔗 Сопоставление категорий с маркетплейсами", expanded=False):
+        category_mapping.render_editor(conn, core.current_categories(conn))
+
+    st.divider()
+
     # ── Блок 3: Обогащение габаритов и веса ─────────────────────────
     st.subheader("🔍 Обогащение габаритов и веса")
 
@@ -137,11 +183,56 @@ def render(conn: sqlite3.Connection, normalize_value, api_key: str):
             key="enrich_mode"
         )
     with col2:
-        use_web = False  # Web-поиск временно отключен (требуется модуль search_web)
+        use_web = st.checkbox(
+            "🌐 Искать габариты в интернете",
+            value=False,
+            key="enrich_use_web",
+            disabled=not search_web.is_enabled(),
+            help="Сниппеты поиска по названию, артикулу и EAN передаются модели. "
+                 "Провайдер — SEARCH_PROVIDER (searxng или local), ответы кэшируются"
+        )
+
+    col1, col2 = st.columns(2)
+    with col1:
+        time_budget = st.number_input("Лимит времени, с (0 — без лимита)", min_value=0, value=0, step=30,
+                                      key="enrich_time_budget",
+                                      help="Товары обогащаются по убыванию влияния на логистику и цену")
+    with col2:
+        token_budget = st.number_input("Лимит токенов модели (0 — без лимита)", min_value=0, value=0, step=10_000,
+                                       key="enrich_token_budget")
 
-    if not api_key and use_web:
+    if use_web and not ai_client.is_enabled(api_key):
         st.warning("⚠️ OpenAI ключ не настроен — будут использоваться только средние по категории")
 
+    if st.button("🧮 Заполнить по похожим товарам (без AI)", key="impute_btn",
+                 help="Пустые габариты выбранных товаров — по ближайшим заполненным товарам той же категории"):
+        with st.spinner("Поиск похожих товаров..."):
+            result = dim_impute.impute_missing(conn, ids=df_filtered["ID"].tolist())
+        st.success(f"Заполнено {result['filled']} из {result['missing']} товаров без габаритов; "
+                   f"для {result['skipped']} похожие товары не найдены")
+
+    with st.expander("📚 Справочник EAN → габариты", expanded=False):
+        ref_file = st.file_uploader("CSV или Parquet с колонками EAN, Длина, Ширина, Высота, Вес",
+                                    type=["csv", "parquet"], key="ean_ref_file")
+        col1, col2 = st.columns(2)
+        with col1:
+            ref_dim_unit = st.selectbox("Единица габаритов", ["см", "мм"], key="ean_dim_unit")
+        with col2:
+            ref_weight_unit = st.selectbox("Единица веса", ["кг", "г"], key="ean_weight_unit")
+        if ref_file and st.button("Загрузить справочник", key="ean_ref_load"):
+            suffix = os.path.splitext(ref_file.name)[1]
+            with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+                tmp.write(ref_file.getvalue())
+            try:
+                result = ean_index.import_reference(conn, tmp.name, ref_dim_unit, ref_weight_unit, ref_file.name)
+            finally:
+                os.remove(tmp.name)
+            st.success(f"Загружено {result['imported']} EAN, пропущено {result['invalid']}")
+        total = conn.execute("SELECT COUNT(*) FROM ean_reference").fetchone()[0]
+        st.caption(f"EAN в справочнике: {total}")
+        if total and st.button("📚 Заполнить пустые габариты по EAN", key="ean_enrich_btn"):
+            st.success(f"Обновлено товаров: {ean_index.enrich_from_reference(conn)}")
+
     if st.button("🚀 Обогатить выбранные товары", key="enrich_btn", type="primary"):
         force = (enrich_mode == "Все товары (перезаписать)")
         products_to_enrich = []
@@ -155,6 +246,7 @@ def render(conn: sqlite3.Connection, normalize_value, api_key: str):
                 "brand": row["Бренд"],
                 "category": row["Категория"],
                 "ean": row["EAN"],
+                "cost": row["Себестоимость"],
                 "length_cm": row["Длина (см)"],
                 "width_cm": row["Ширина (см)"],
                 "height_cm": row["Высота (см)"],
@@ -165,51 +257,50 @@ def render(conn: sqlite3.Connection, normalize_value, api_key: str):
         progress = st.progress(0)
         status = st.empty()
         results = []
-
-        for i, prod in enumerate(products_to_enrich):
-            status.text(f"Обработка {i+1}/{len(products_to_enrich)}: {prod['name']}")
+        t0 = time.perf_counter()
+        plan = pim_enrich.plan_enrichment(products_to_enrich, force=force)
+        with perf.span("enrich_schedule", rows=len(plan)):
+            queue = enrich_scheduler.schedule(conn, plan, force, time_budget, token_budget)
+        # Очередь — группы вариантов, метрика — товары в ещё не начатых группах
+        backlog = sum(len(group) for group in plan)
+
+        for i, group in enumerate(queue):
+            prod = group[0]
+            backlog -= len(group)
+            metrics.set_gauge("enrich_backlog", backlog, help_text="Товаров в очереди обогащения")
+            suffix = f" (+{len(group) - 1} вариантов)" if len(group) > 1 else ""
+            status.text(f"Обработка {i+1}/{len(plan)}: {prod['name']}{suffix}")
 
             # Web-поиск (если включён)
             search_snippets = None
-            if use_web and api_key:
-                try:
-                    from search_web import search_web
-                    query = f"{prod['brand']} {prod['name']} {prod['sku']} габариты вес размеры"
-                    search_results = search_web([query])
-                    search_snippets = [r.get("snippet", "") for r in search_results[:5] if r.get("snippet")]
-                except Exception:
-                    pass
-
-            updated_prod, method = pim_enrich.enrich_product(
-                prod, conn, api_key, search_results=search_snippets, force=force
-            )
-
-            # Сохраняем в БД
-            c.execute("""
-                UPDATE products
-                SET length_cm=?, width_cm=?, height_cm=?, weight_kg=?,
-                    enrich_source=?, enrich_status=?
-                WHERE id=?
-            """, (
-                updated_prod.get("length_cm"),
-                updated_prod.get("width_cm"),
-                updated_prod.get("height_cm"),
-                updated_prod.get("weight_kg"),
-                updated_prod.get("enrich_source", method),
-                updated_prod.get("enrich_status", "enriched" if method != "failed" else "failed"),
-                prod["id"]
-            ))
-            conn.commit()
-
-            # Логируем
-            success = (method not in ("failed", "already_filled"))
-            pim_enrich.log_enrichment(conn, prod["id"], method, success)
+            if use_web and ai_client.is_enabled(api_key):
+                search_results = search_web.search_web(search_web.product_queries(prod), conn)
+                search_snippets = [r["snippet"] for r in search_results] or None
+
+            with perf.span("enrich_product", rows=1):
+                updated_prod, method = pim_enrich.enrich_product(
+                    prod, conn, api_key, search_results=search_snippets, force=force
+                )
 
-            results.append({"SKU": prod["sku"], "Метод": method, "Успех": success})
-            progress.progress((i + 1) / len(products_to_enrich))
+            # Сохраняем в БД — результат представителя всем вариантам группы
+            with perf.span("enrich_db_write", rows=len(group)):
+                pim_enrich.save_enrichment(conn, updated_prod, method, [p["id"] for p in group])
 
-        status.text("✅ Обогащение завершено")
-        st.success(f"Обработано {len(results)} товаров")
+            success = (method not in ("failed", "already_filled"))
+            for p in group:
+                results.append({"SKU": p["sku"], "Метод": method, "Успех": success, "По товару": prod["sku"]})
+            progress.progress((i + 1) / len(plan))
+
+        metrics.set_gauge("enrich_backlog", backlog, help_text="Товаров в очереди обогащения")
+        metrics.observe_throughput("enrich", len(results), time.perf_counter() - t0)
+        if queue.stopped:
+            budget = "времени" if queue.stopped == "time" else "токенов"
+            status.text(f"⏸ Лимит {budget} исчерпан")
+            st.warning(f"Обработано {len(results)} из {len(products_to_enrich)} товаров — "
+                       f"{queue.coverage:.0%} суммарного влияния на логистику; остальные можно обогатить позже")
+        else:
+            status.text("✅ Обогащение завершено")
+            st.success(f"Обработано {len(results)} товаров")
 
         df_results = pd.DataFrame(results)
         st.dataframe(df_results, use_container_width=True)
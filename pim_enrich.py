@@ -2,22 +2,30 @@
 PIM Enrichment Module — поиск габаритов и веса товаров.
 
 Логика:
+0. Локальный справочник EAN (ean_index) — без обращения к модели
 1. Поиск в интернете по названию/артикулу/EAN через AI (web search + GPT)
 2. Извлечение характеристик из результатов поиска
-3. Fallback на средние значения по категории из category_defaults
+3. Fallback на медианы по категории / бренду из нашего каталога (dim_stats),
+   а если данных мало — на встроенный справочник CATEGORY_DEFAULTS_BUILTIN
 4. Логирование источника значений
 
+Варианты одного товара (общий EAN или бренд + модель без цвета и размера) обогащаются
+один раз: plan_enrichment группирует очередь, save_enrichment раздаёт результат
+представителя всей группе одним UPDATE.
+
 Используется в pim.py (Streamlit страница PIM).
 """
 
 import json
 import sqlite3
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, List, Tuple
 
-try:
-    from openai import OpenAI
-except Exception:  # optional dependency for local runs
-    OpenAI = None
+import ai_client
+import dim_stats
+import ean_index
+import metrics
+import names
+import perf
 
 
 # ── Средние габариты по категориям (базовый справочник) ────────────
@@ -74,23 +82,25 @@ def guess_category_by_name(product_name: str) -> str:
     return "Прочее"
 
 
-def enrich_product_via_ai(product: Dict, openai_api_key: str) -> Optional[Dict]:
+def enrich_product_via_ai(product: Dict, openai_api_key: str, snippets: Optional[List[str]] = None) -> Optional[Dict]:
     """
     Обогащает товар через AI:
-    1) Делает web search по названию/артикулу
-    2) Извлекает габариты из результатов
-    3) Если не найдено → fallback на средние по категории
+    1) Передаёт модели название/артикул и сниппеты веб-поиска (search_web), если есть
+    2) Извлекает габариты из ответа
+    3) Если не найдено → None (fallback по категории делает enrich_product)
     """
-    if OpenAI is None:
-        raise RuntimeError("openai package not installed")
-    client = OpenAI(api_key=openai_api_key)
+    client = ai_client.get_client(openai_api_key)
     
     # 1) Формируем поисковый запрос
     search_query = f"{product['name']} {product.get('sku', '')} габариты вес характеристики"
+    context = ""
+    if snippets:
+        context = "\n\nФрагменты из поиска:\n" + "\n".join(f"- {sn}" for sn in snippets)
     
     try:
         # 2) Web search + GPT
-        response = client.chat.completions.create(
+        response = ai_client.create_chat(
+            client, "pim",
             model="gpt-4o",
             messages=[
                 {
@@ -103,7 +113,7 @@ def enrich_product_via_ai(product: Dict, openai_api_key: str) -> Optional[Dict]:
                 },
                 {
                     "role": "user",
-                    "content": f"Найди габариты и вес товара: {search_query}"
+                    "content": f"Найди габариты и вес товара: {search_query}{context}"
                 }
             ],
             temperature=0.3
@@ -128,17 +138,25 @@ def enrich_product_via_ai(product: Dict, openai_api_key: str) -> Optional[Dict]:
     except Exception as e:
         print(f"[enrich] AI search error: {e}")
     
-    # 4) Fallback на средние по категории
-    guessed_category = guess_category_by_name(product["name"])
-    defaults = CATEGORY_DEFAULTS_BUILTIN.get(guessed_category, CATEGORY_DEFAULTS_BUILTIN["Прочее"])
-    
-    return {
-        "length_cm": defaults["length_cm"],
-        "width_cm": defaults["width_cm"],
-        "height_cm": defaults["height_cm"],
-        "weight_kg": defaults["weight_kg"],
-        "source": f"category_default ({guessed_category})"
-    }
+    return None
+
+
+def category_fallback(conn: sqlite3.Connection, product: Dict) -> Tuple[Dict, str]:
+    """
+    Габариты по категории: медианы dim_stats (категория PIM + бренд, затем категория),
+    недостающие измерения — из CATEGORY_DEFAULTS_BUILTIN. Возвращает (значения, метод).
+    """
+    category = str(product.get("category") or "").strip() or guess_category_by_name(str(product.get("name") or ""))
+    brand = str(product.get("brand") or "").strip()
+    try:
+        learned, level = dim_stats.lookup(conn, category, brand)
+    except sqlite3.Error:
+        learned, level = {}, ""
+    defaults = CATEGORY_DEFAULTS_BUILTIN.get(category, CATEGORY_DEFAULTS_BUILTIN["Прочее"])
+    if not learned:
+        return dict(defaults), f"category_default ({category})"
+    label = f"{category} / {brand}" if level == "brand" else category
+    return {**defaults, **learned}, f"dim_stats ({label})"
 
 
 def init_pim_tables(conn: sqlite3.Connection):
@@ -197,16 +215,30 @@ def enrich_product(
 ) -> Tuple[Dict, str]:
     """API, которую ожидает pim.py: возвращает (updated_product, method)."""
     # если уже заполнено и не force — ничего не делаем
-    if not force and not any(_is_missing(product.get(k)) for k in ("length_cm", "width_cm", "height_cm", "weight_kg")):
+    filled = not any(_is_missing(product.get(k)) for k in ("length_cm", "width_cm", "height_cm", "weight_kg"))
+    if not force:
+        metrics.cache_lookup("enrich_filled", filled)
+    if not force and filled:
         return product, "already_filled"
 
     method = "failed"
     updated = dict(product)
 
-    # Пытаемся AI (без веб-поиска, только по названию/sku) — если есть ключ
-    if openai_api_key:
+    # Сначала локальный справочник EAN — без обращения к модели
+    try:
+        reference = ean_index.lookup(conn, product.get("ean"))
+    except sqlite3.Error:
+        reference = None
+    if reference:
+        perf.count("enrich_ean_hit")
+        updated.update(reference)
+        method = ean_index.SOURCE
+
+    # Пытаемся AI (без веб-поиска, только по названию/sku) — если есть ключ или локальный бэкенд
+    if method == "failed" and ai_client.is_enabled(openai_api_key):
         try:
-            r = enrich_product_via_ai(product, openai_api_key)
+            with perf.span("enrich_ai", rows=1):
+                r = enrich_product_via_ai(product, openai_api_key, search_results)
             if r:
                 updated.update({
                     "length_cm": r.get("length_cm"),
@@ -215,21 +247,106 @@ def enrich_product(
                     "weight_kg": r.get("weight_kg"),
                 })
                 method = r.get("source", "ai")
+                if search_results and method == "ai_search":
+                    method = "ai_search_web"
         except Exception:
             method = "failed"
 
     # Если AI не сработал/ключа нет — fallback на категорию
     if method == "failed":
-        guessed_category = guess_category_by_name(str(product.get("name") or ""))
-        defaults = CATEGORY_DEFAULTS_BUILTIN.get(guessed_category, CATEGORY_DEFAULTS_BUILTIN["Прочее"])
-        updated.update(defaults)
-        method = f"category_default ({guessed_category})"
+        perf.count("enrich_fallback")
+        updated_dims, method = category_fallback(conn, product)
+        updated.update(updated_dims)
 
+    metrics.inc("enrich_results_total", 1, {"method": method.split(" ")[0]}, "Результаты обогащения по методам")
     updated["enrich_source"] = method
     updated["enrich_status"] = "enriched" if method != "failed" else "failed"
     return updated, method
 
 
+def variant_keys(product: Dict) -> List[str]:
+    """Ключи, по которым товары считаются вариантами одной модели."""
+    keys = []
+    ean = ean_index.normalize_ean(product.get("ean"))
+    if ean:
+        keys.append(f"ean:{ean}")
+    brand = str(product.get("brand") or "").strip().lower()
+    model = names.variant_name(product.get("name"))
+    if brand and model:
+        keys.append(f"model:{brand}|{model}")
+    return keys
+
+
+def plan_enrichment(products: List[Dict], force: bool = False) -> List[List[Dict]]:
+    """
+    Группы вариантов в порядке очереди: товары с общим EAN или ключом бренд + модель
+    попадают в одну группу (транзитивно). Первый в группе — представитель: товар с EAN,
+    если он есть. Без force уже заполненные товары остаются одиночными.
+    """
+    parent = list(range(len(products)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    owner: Dict[str, int] = {}
+    for i, prod in enumerate(products):
+        if not force and not any(_is_missing(prod.get(k)) for k in ("length_cm", "width_cm", "height_cm", "weight_kg")):
+            continue
+        for key in variant_keys(prod):
+            if key in owner:
+                a, b = find(owner[key]), find(i)
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+            else:
+                owner[key] = i
+
+    groups: Dict[int, List[Dict]] = {}
+    for i, prod in enumerate(products):
+        groups.setdefault(find(i), []).append(prod)
+    plan = []
+    for members in groups.values():
+        with_ean = [p for p in members if ean_index.normalize_ean(p.get("ean"))]
+        head = with_ean[0] if with_ean else members[0]
+        plan.append([head] + [p for p in members if p is not head])
+    saved = len(products) - len(plan)
+    perf.count("enrich_dedup", saved)
+    metrics.inc("enrich_dedup_total", saved, help_text="Товаров, обогащённых по представителю группы вариантов")
+    return plan
+
+
+def save_enrichment(conn: sqlite3.Connection, updated: Dict, method: str, product_ids: List[int]):
+    """
+    Записывает результат представителя всем товарам группы и лог — одним UPDATE и одной вставкой.
+    already_filled только логируется: товар не менялся, а перезапись enrich_source сделала бы
+    оценённые значения (category_default, dim_stats, knn) «измеренными» для статистики.
+    """
+    ids = [int(i) for i in product_ids]
+    if method != "already_filled":
+        conn.execute("""
+            UPDATE products
+            SET length_cm=?, width_cm=?, height_cm=?, weight_kg=?,
+                enrich_source=?, enrich_status=?
+            WHERE id IN (SELECT value FROM json_each(?))
+        """, (
+            updated.get("length_cm"),
+            updated.get("width_cm"),
+            updated.get("height_cm"),
+            updated.get("weight_kg"),
+            updated.get("enrich_source", method),
+            updated.get("enrich_status", "enriched" if method != "failed" else "failed"),
+            json.dumps(ids),
+        ))
+    success = 1 if method not in ("failed", "already_filled") else 0
+    conn.executemany(
+        "INSERT INTO pim_enrichment_log (product_id, method, success) VALUES (?,?,?)",
+        [(i, str(method), success) for i in ids],
+    )
+    conn.commit()
+
+
 def log_enrichment(conn: sqlite3.Connection, product_id: int, method: str, success: bool):
     try:
         c = conn.cursor()
@@ -0,0 +1,504 @@
+"""
+Локальный HTTP API расчёта РРЦ для интеграций (ERP): отдельный SKU, пачка или поток NDJSON.
+
+    python pricing_api.py --db products_storage.db --port 8766
+
+    POST /v1/price/mvideo    {"sku": "АКС-42-00001413"}
+    POST /v1/price/dns       {"items": [{"sku": "..."}, {"name": "Кабель USB-C", "cost": 350, "weight_kg": 0.1}],
+                              "params": {"target_margin": 25}}
+    POST /v1/price/lemanpro_fbs?zone=Регион&target_margin=25   (Content-Type: application/x-ndjson)
+    GET  /health, GET /metrics, POST /v1/reload
+
+Товар — поля products (sku, name, length_cm, width_cm, height_cm, weight_kg, cost):
+только sku — данные берутся из каталога, переданные поля заменяют каталожные.
+Расчёт — тот же calculate маркетплейса, что на страницах и в pricing_pool, ответ —
+строки результата с теми же колонками, что в CSV. Ошибочные товары не валят
+пачку: они попадают в errors (в потоке — строкой {"index", "sku", "error"}).
+
+Состояние держится в памяти процесса: модули с тарифами, действующие
+справочники комиссий (перечитываются раз в PRICING_API_RELOAD_S), сопоставления
+категорий и категории уже виденных названий по маркетплейсам — новый SKU не
+идёт ни в ai_cache, ни к модели. Готовые строки ответа кэшируются по товару и
+параметрам: повторный SKU — поиск в каталоге и словаре, без pandas (доли
+миллисекунды против ~2 мс на расчёт одного товара). При старте категории каталога прогреваются в фоне
+из ai_cache и сопоставлений категорий — без классификатора и модели, не больше
+PRICING_API_CACHE_MAX названий на маркетплейс (PRICING_API_WARM=0 — выключить).
+После правки сопоставлений или кэша в интерфейсе — POST /v1/reload.
+
+NDJSON: тело читается целиком (во временный файл, если большое), ответ отдаётся
+кусками по PRICING_API_STREAM_CHUNK строк с Transfer-Encoding: chunked.
+Соединения keep-alive (HTTP/1.1) без алгоритма Нейгла.
+"""
+import functools
+import importlib
+import json
+import os
+import queue
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+import category_mapping
+import columnar
+import commission_tables
+import core
+import metrics
+import pricing_pool
+
+HOST = os.environ.get("PRICING_API_HOST", "127.0.0.1")
+PORT = int(os.environ.get("PRICING_API_PORT", 8766))
+RELOAD_S = float(os.environ.get("PRICING_API_RELOAD_S", 60))
+MEMO_MAX = int(os.environ.get("PRICING_API_CACHE_MAX", 500_000))  # названий на маркетплейс
+RESULTS_MAX = int(os.environ.get("PRICING_API_RESULTS_MAX", 200_000))  # строк на набор параметров
+STREAM_CHUNK = int(os.environ.get("PRICING_API_STREAM_CHUNK", 1_000))
+MAX_BATCH = int(os.environ.get("PRICING_API_MAX_BATCH", 10_000))  # больше — через NDJSON
+WARM = os.environ.get("PRICING_API_WARM", "1") != "0"
+SPOOL_BYTES = 16 << 20
+
+MARKETPLACES = pricing_pool.MARKETPLACES
+FIELDS = ("sku", "name", "length_cm", "width_cm", "height_cm", "weight_kg", "cost")
+NUMERIC_FIELDS = FIELDS[2:]
+COMMISSION_KEYS = {"lemanpro_fbs": "lemanpro", "dns": "dns", "citilink": "citilink"}
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl", "application/json-lines")
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.05, 0.25, 1.0, 5.0)
+SQL_VARS = 900
+
+
+class RequestError(ValueError):
+    """Ошибка в запросе — ответ 400."""
+
+
+def _params(raw: Optional[dict]) -> dict:
+    """Параметры расчёта: значения по умолчанию pricing_pool, поверх — переданные."""
+    params = dict(pricing_pool.DEFAULT_PARAMS)
+    for key, value in (raw or {}).items():
+        if key not in params:
+            raise RequestError(f"Неизвестный параметр: {key}")
+        if key == "tax_regime":
+            if value not in core.TAX_RATES:
+                raise RequestError(f"Неизвестный налоговый режим: {value} (доступны: {', '.join(core.TAX_RATES)})")
+            params[key] = value
+            continue
+        try:
+            params[key] = float(value)
+        except (TypeError, ValueError):
+            raise RequestError(f"Параметр {key} должен быть числом: {value!r}") from None
+    return params
+
+
+def _item(raw) -> dict:
+    """Проверенный товар запроса: известные поля, числа — float."""
+    if not isinstance(raw, dict):
+        raise RequestError("товар должен быть JSON-объектом")
+    unknown = set(raw) - set(FIELDS)
+    if unknown:
+        raise RequestError(f"неизвестные поля: {', '.join(sorted(unknown))}")
+    if raw.get("sku") in (None, "") and not raw.get("name"):
+        raise RequestError("нужен sku или name")
+    item = {k: v for k, v in raw.items() if v is not None}
+    if "sku" in item:
+        item["sku"] = str(item["sku"])
+    for key in NUMERIC_FIELDS:
+        if key in item:
+            try:
+                item[key] = float(item[key])
+            except (TypeError, ValueError):
+                raise RequestError(f"поле {key} должно быть числом: {item[key]!r}") from None
+    return item
+
+
+class Pricer:
+    """Тёплое состояние сервиса: соединения с базой, справочники комиссий, категории в памяти."""
+
+    def __init__(self, db_path: str, api_key: str = ""):
+        self.db_path = os.path.abspath(db_path)
+        self.api_key = api_key
+        self.modules = {mp: importlib.import_module(mp) for mp in MARKETPLACES}
+        self._readers: "queue.SimpleQueue[sqlite3.Connection]" = queue.SimpleQueue()
+        self._classify_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.reload()
+
+    def reload(self):
+        """Перечитывает сопоставления категорий и комиссии, сбрасывает категории и результаты в памяти."""
+        with self._classify_lock:
+            old, self._conn = self._conn, core.init_db(self.db_path)
+            self._conn.execute(f"PRAGMA busy_timeout = {pricing_pool.BUSY_TIMEOUT_MS}")
+            get_ai_category = functools.partial(core.get_ai_category, api_key=self.api_key)
+            self._get_category = category_mapping.bind(self._conn, get_ai_category, self.api_key)
+            self._memo: Dict[Tuple[str, tuple], Dict[str, str]] = {}
+            self._results: Dict[tuple, Dict[tuple, str]] = {}
+            self._commissions: Dict[str, Tuple[float, commission_tables.CommissionTable]] = {}
+        if old is not None:
+            core.flush_cache_stats(old)
+            old.close()
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Соединение только для чтения из пула: потоки сервера не делят одно соединение."""
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute(f"PRAGMA mmap_size = {pricing_pool.MMAP_MB * 1024 * 1024}")
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @property
+    def memo_size(self) -> int:
+        return sum(len(m) for m in self._memo.values())
+
+    @property
+    def results_size(self) -> int:
+        return sum(len(r) for r in self._results.values())
+
+    def commissions(self, marketplace: str) -> commission_tables.CommissionTable:
+        """Действующий справочник комиссий; база опрашивается не чаще раза в RELOAD_S."""
+        now = time.monotonic()
+        cached = self._commissions.get(marketplace)
+        if cached is not None and now - cached[0] < RELOAD_S:
+            return cached[1]
+        with self.reader() as conn:
+            table = commission_tables.active(conn, COMMISSION_KEYS[marketplace],
+                                             self.modules[marketplace].CATEGORY_COMMISSIONS)
+        self._commissions[marketplace] = (now, table)
+        return table
+
+    def category(self, name: str, categories: list, conn, client_key: str, *args, **kwargs) -> str:
+        """get_ai_category для calculate: сначала словарь в памяти, затем сопоставления, ai_cache, модель."""
+        memo_key = (client_key, tuple(categories))
+        memo = self._memo.get(memo_key)
+        if memo is not None:
+            category = memo.get(name)
+            if category is not None:
+                metrics.cache_lookup("pricing_api", True, client_key)
+                return category
+        metrics.cache_lookup("pricing_api", False, client_key)
+        # Промах пишет в ai_cache и может ждать модель — одно пишущее соединение на процесс
+        with self._classify_lock:
+            category = self._get_category(name, categories, self._conn, client_key)
+            memo = self._memo.setdefault(memo_key, {})
+            if len(memo) >= MEMO_MAX:
+                memo.clear()
+            memo[name] = category
+        return category
+
+    def args(self, marketplace: str, options: dict) -> Tuple[tuple, tuple]:
+        """
+        Аргументы calculate после calc_tax — как у страницы маркетплейса, и ключ
+        кэша результатов: маркетплейс, параметры, зона / промо, версия комиссий.
+        """
+        params = _params(options.get("params"))
+        key = (marketplace, tuple(sorted(params.items())))
+        if marketplace == "mvideo":
+            return (params,), key
+        if marketplace == "sportmaster_fbs":
+            is_promo = bool(options.get("is_promo", False))
+            return (params, is_promo), key + (is_promo,)
+        table = self.commissions(marketplace)
+        if marketplace == "lemanpro_fbs":
+            zone = options.get("zone") or "Регион"
+            if zone not in self.modules[marketplace].LAST_MILE:
+                raise RequestError(f"Неизвестная зона: {zone} (доступны: {', '.join(self.modules[marketplace].LAST_MILE)})")
+            return (params, table.rates, zone, table.version), key + (zone, table.version)
+        return (params, table.rates, table.version), key + (table.version,)
+
+    def _catalog_rows(self, conn: sqlite3.Connection, skus: Iterable[str]) -> Dict[str, tuple]:
+        found = {}
+        skus = list(skus)
+        for lo in range(0, len(skus), SQL_VARS):
+            part = skus[lo:lo + SQL_VARS]
+            found.update((row[0], row) for row in conn.execute(
+                f"SELECT {columnar.COLUMNS} FROM products WHERE sku IN ({','.join('?' * len(part))})", part))
+        return found
+
+    def price(self, marketplace: str, items: List[dict], options: dict,
+              offset: int = 0) -> Tuple[List[str], List[dict]]:
+        """
+        Считает товары запроса. Возвращает (строки результата в JSON по порядку
+        товаров, ошибки); index ошибки — позиция товара в запросе (offset — для
+        кусков потока). Строка кэшируется по товару (поля после подстановки из
+        каталога) и ключу args: правка товара или новая версия комиссий — новый ключ.
+        """
+        args, key = self.args(marketplace, options)
+        cache = self._results.get(key)
+        if cache is None:
+            cache = self._results[key] = {}
+        errors: List[dict] = []
+        rows: List[tuple] = []
+        with self.reader() as conn:
+            lookup = {it["sku"] for it in items
+                      if "error" not in it and "sku" in it and any(f not in it for f in FIELDS)}
+            catalog_rows = self._catalog_rows(conn, lookup) if lookup else {}
+            for i, it in enumerate(items):
+                if "error" in it:
+                    errors.append({"index": offset + i, **it})
+                    continue
+                base = catalog_rows.get(it.get("sku"))
+                if base is None and it.get("sku") in lookup:
+                    errors.append({"index": offset + i, "sku": it["sku"], "error": "SKU не найден в каталоге"})
+                    continue
+                rows.append(tuple(it.get(f, base[k] if base else None) for k, f in enumerate(FIELDS)))
+            out: List[Optional[str]] = [cache.get(row) for row in rows]
+            todo = [i for i, line in enumerate(out) if line is None]
+            metrics.inc("pricing_api_rows_total", len(rows) - len(todo), {"marketplace": marketplace, "cache": "hit"},
+                        "Товары в ответах API расчёта")
+            if todo:
+                metrics.inc("pricing_api_rows_total", len(todo), {"marketplace": marketplace, "cache": "miss"})
+                results = self.modules[marketplace].calculate(
+                    conn, columnar.Catalog.from_rows([rows[i] for i in todo]), self.category, core.calc_tax, *args)
+                # Одна строка JSON на товар: json-строки экранируют переводы строк
+                lines = results.to_json(orient="records", lines=True, force_ascii=False).splitlines()
+                if len(cache) + len(todo) > RESULTS_MAX:
+                    cache.clear()
+                for i, line in zip(todo, lines):
+                    out[i] = cache[rows[i]] = line
+        return out, errors
+
+    def warm(self):
+        """
+        Категории названий каталога по всем маркетплейсам — в память до первых запросов.
+        Только то, что уже известно: сопоставления категорий и ai_cache. Промахи не
+        запоминаются и не идут к модели — их классифицирует первый запрос с этим товаром.
+        """
+        t0 = time.perf_counter()
+        warmed = 0
+        with self.reader() as conn:
+            catalog = columnar.read_catalog(conn)
+            known = category_mapping.bind(conn, core.cached_category, api_key="")
+
+            def category(name: str, categories: list, conn_, client_key: str, *args, **kwargs) -> str:
+                nonlocal warmed
+                memo = self._memo.setdefault((client_key, tuple(categories)), {})
+                found = memo.get(name)
+                if found is None and len(memo) < MEMO_MAX:
+                    found = known(name, categories, conn, client_key)
+                    if found is not None:
+                        with self._classify_lock:
+                            memo[name] = found
+                        warmed += 1
+                # Промах — заглушка только для расчёта прогрева, в память не попадает
+                return found or (categories[0] if categories else "Неизвестно")
+
+            for marketplace in MARKETPLACES:
+                self.modules[marketplace].calculate(conn, catalog, category, core.calc_tax,
+                                                    *self.args(marketplace, {})[0])
+        metrics.observe_throughput("pricing_api_warm", warmed, time.perf_counter() - t0)
+
+
+# ── HTTP ────────────────────────────────────────────────────────────
+def _options(query: str) -> dict:
+    """Опции из строки запроса: zone, is_promo, остальное — параметры расчёта."""
+    options: dict = {"params": {}}
+    for key, value in parse_qsl(query):
+        if key == "zone":
+            options["zone"] = value
+        elif key == "is_promo":
+            options["is_promo"] = value.lower() in ("1", "true", "yes")
+        else:
+            options["params"][key] = value
+    return options
+
+
+def make_server(pricer: Pricer, host: str = HOST, port: int = PORT) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive: ERP шлёт запросы по одному соединению
+        disable_nagle_algorithm = True
+
+        def _send(self, code: int, body, content_type: str = "application/json"):
+            data = body.encode("utf-8") if isinstance(body, str) else body
+            self.send_response(code)
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _json(self, code: int, payload: dict):
+            self._send(code, json.dumps(payload, ensure_ascii=False))
+
+        def _chunk(self, data: str):
+            raw = data.encode("utf-8")
+            if raw:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(raw), raw))
+
+        def _body(self):
+            """Тело запроса в файл (в памяти до SPOOL_BYTES); поддерживает Transfer-Encoding: chunked."""
+            spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+            if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                while True:
+                    size = int(self.rfile.readline().split(b";")[0].strip() or b"0", 16)
+                    if size == 0:
+                        while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                            pass  # trailer-заголовки
+                        break
+                    spool.write(self.rfile.read(size))
+                    self.rfile.readline()
+            else:
+                remaining = int(self.headers.get("Content-Length") or 0)
+                while remaining > 0:
+                    block = self.rfile.read(min(remaining, 1 << 20))
+                    if not block:
+                        break
+                    spool.write(block)
+                    remaining -= len(block)
+            spool.seek(0)
+            return spool
+
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path == "/health":
+                self._json(200, {"status": "ok", "db": pricer.db_path, "marketplaces": list(MARKETPLACES),
+                                 "categories_in_memory": pricer.memo_size, "results_in_memory": pricer.results_size})
+            elif path == "/metrics":
+                self._send(200, metrics.render_text(), "text/plain; version=0.0.4")
+            else:
+                self._json(404, {"error": "not found"})
+
+        def do_POST(self):
+            path, _, query = self.path.partition("?")
+            if path == "/v1/reload":
+                self._body().close()
+                pricer.reload()
+                self._json(200, {"status": "reloaded"})
+                return
+            match = re.fullmatch(r"/v1/price/(\w+)", path)
+            if not match or match.group(1) not in MARKETPLACES:
+                self._body().close()
+                self._json(404, {"error": f"неизвестный маркетплейс; доступны: {', '.join(MARKETPLACES)}"})
+                return
+            marketplace = match.group(1)
+            stream = self.headers.get("Content-Type", "").split(";")[0].strip() in NDJSON_TYPES
+            mode = "stream" if stream else "json"
+            t0 = time.perf_counter()
+            status, rows = "ok", 0
+            try:
+                with self._body() as body:
+                    rows = self._price_stream(marketplace, body, query) if stream \
+                        else self._price_json(marketplace, body, query)
+            except RequestError as e:
+                status = "bad_request"
+                self._json(400, {"error": str(e)})
+            except Exception as e:  # noqa: BLE001 — ответ клиенту вместо обрыва соединения
+                status = "error"
+                if stream and getattr(self, "_streaming", False):
+                    self.close_connection = True  # заголовки ушли — поток обрывается без финального куска
+                else:
+                    self._json(500, {"error": f"{type(e).__name__}: {e}"})
+            seconds = time.perf_counter() - t0
+            labels = {"marketplace": marketplace, "mode": mode}
+            metrics.observe("pricing_api_request_seconds", seconds, labels,
+                            "Время ответа API расчёта, с", buckets=LATENCY_BUCKETS)
+            metrics.inc("pricing_api_requests_total", 1, {**labels, "status": status}, "Запросы к API расчёта")
+            metrics.observe_throughput("pricing_api", rows, seconds, marketplace=marketplace)
+
+        def _price_json(self, marketplace: str, body, query: str) -> int:
+            try:
+                payload = json.loads(body.read() or b"{}")
+            except ValueError as e:
+                raise RequestError(f"некорректный JSON: {e}") from None
+            if not isinstance(payload, dict):
+                raise RequestError("ожидается JSON-объект: товар или {\"items\": [...]}")
+            options = _options(query)
+            options["params"].update(payload.get("params") or {})
+            for key in ("zone", "is_promo"):
+                if key in payload:
+                    options[key] = payload[key]
+            single = "items" not in payload
+            raw_items = [{k: v for k, v in payload.items() if k in FIELDS}] if single else payload["items"]
+            if not isinstance(raw_items, list):
+                raise RequestError("items должен быть списком")
+            if len(raw_items) > MAX_BATCH:
+                raise RequestError(f"больше {MAX_BATCH} товаров — отправьте их потоком NDJSON")
+            items = []
+            for raw in raw_items:
+                try:
+                    items.append(_item(raw))
+                except RequestError as e:
+                    if single:
+                        raise
+                    items.append({"sku": raw.get("sku") if isinstance(raw, dict) else None, "error": str(e)})
+            lines, errors = pricer.price(marketplace, items, options)
+            if single:
+                if errors:
+                    self._json(404, {"error": errors[0]["error"], "sku": errors[0]["sku"]})
+                    return 0
+                self._send(200, f'{{"marketplace":"{marketplace}","result":{lines[0]}}}')
+            else:
+                self._send(200, f'{{"marketplace":"{marketplace}","results":[{",".join(lines)}],'
+                                f'"errors":{json.dumps(errors, ensure_ascii=False)}}}')
+            return len(lines)
+
+        def _price_stream(self, marketplace: str, body, query: str) -> int:
+            options = _options(query)
+            pricer.args(marketplace, options)  # ошибки параметров — 400 до начала потока
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            self._streaming = True
+            rows, index, batch = 0, 0, []
+            for line in body:
+                if not line.strip():
+                    continue
+                try:
+                    batch.append(_item(json.loads(line)))
+                except ValueError as e:  # и RequestError, и некорректный JSON
+                    batch.append({"sku": None, "error": str(e)})
+                if len(batch) >= STREAM_CHUNK:
+                    rows += self._emit(marketplace, batch, options, index)
+                    index, batch = index + len(batch), []
+            if batch:
+                rows += self._emit(marketplace, batch, options, index)
+            self.wfile.write(b"0\r\n\r\n")
+            self._streaming = False
+            return rows
+
+        def _emit(self, marketplace: str, batch: List[dict], options: dict, offset: int) -> int:
+            lines, errors = pricer.price(marketplace, batch, options, offset)
+            lines += [json.dumps(e, ensure_ascii=False) for e in errors]
+            self._chunk("".join(line + "\n" for line in lines))
+            return len(lines) - len(errors)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve(db_path: str = core.DB_PATH, host: str = HOST, port: int = PORT, warm: bool = WARM,
+          api_key: str = ""):
+    pricer = Pricer(db_path, api_key)
+    server = make_server(pricer, host, port)
+    if warm:
+        threading.Thread(target=pricer.warm, name="pricing-api-warm", daemon=True).start()
+    print(f"Pricing API listening on http://{host}:{server.server_port}/v1/price/<маркетплейс>")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        core.flush_cache_stats()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Локальный JSON API расчёта РРЦ")
+    parser.add_argument("--db", default=core.DB_PATH)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--no-warm", action="store_true", help="Не прогревать категории каталога при старте")
+    opts = parser.parse_args()
+    serve(opts.db, opts.host, opts.port, warm=WARM and not opts.no_warm,
+          api_key=os.environ.get("OPENAI_API_KEY", ""))
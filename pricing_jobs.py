@@ -0,0 +1,378 @@
+"""
+Фоновый расчёт РРЦ по кускам каталога с промежуточными результатами.
+
+    pricing_jobs.start("mvideo", conn, catalog,
+                       lambda c, chunk: calculate(c, chunk, get_ai_category, calc_tax, params))
+    pricing_jobs.render("mvideo", "mvideo_rrc_results.csv")
+
+Расчёт идёт в отдельном потоке кусками по PRICING_CHUNK товаров (срезы
+columnar.Catalog, результат куска — DataFrame). После каждого куска строки
+дописываются в CSV (PRICING_RESULTS_DIR) — скачивание готово сразу после
+окончания, а панель (st.fragment с опросом) показывает прогресс, первые
+строки результата и кнопку отмены. Задачи хранятся в процессе по паре (сессия
+Streamlit, маркетплейс): повторный запуск скрипта (rerun, клик по другой кнопке)
+расчёт не прерывает, повторное нажатие с теми же параметрами не запускает
+второй, а с другими — останавливает прежний и начинает заново. Другие сессии
+задачи и файлы друг друга не видят; завершённые задачи и их CSV удаляются через
+PRICING_JOB_TTL_S секунд.
+
+Каталог от PRICING_POOL_MIN_ROWS товаров при PRICING_PROCESSES > 1 считается в
+процессах (pricing_pool) — для этого странице нужно передать pool=(маркетплейс,
+аргументы calculate после calc_tax): лямбда в другой процесс не передаётся.
+
+Поток расчёта ведёт свой прогон perf (этапы pricing, results_csv,
+history_save): после окончания он пишется в PERF_LOG и показывается
+отдельной панелью в сайдбаре рядом с панелью прогона страницы.
+
+Если расчёт запущен из профилируемого запуска (profiling), поток расчёта пишет
+свой cProfile; профиль попадает в панель «Профилирование» после окончания.
+
+Завершённый расчёт сохраняется в историю (run_history, Parquet) вместе с meta
+страницы — параметрами и версией комиссий; версия каталога добавляется здесь.
+"""
+import cProfile
+import hashlib
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+import columnar
+import core
+import metrics
+import perf
+import pricing_pool
+import run_history
+
+CHUNK = int(os.environ.get("PRICING_CHUNK", 1_000))
+RESULTS_DIR = os.environ.get("PRICING_RESULTS_DIR", "pricing_results")
+PREVIEW_ROWS = 2_000
+POLL_S = 0.5
+POOL_MIN_ROWS = int(os.environ.get("PRICING_POOL_MIN_ROWS", 200_000))
+JOB_TTL_S = float(os.environ.get("PRICING_JOB_TTL_S", 24 * 3600))
+
+
+class PricingJob:
+    def __init__(self, key: str, products: list, calc: Callable, path: str,
+                 pool: Optional[Tuple[str, tuple]] = None, api_key: str = "", meta: Optional[Dict] = None,
+                 fingerprint: str = "", profile: bool = False):
+        self.key = key
+        self.fingerprint = fingerprint
+        self.products = products
+        self.calc = calc
+        self.path = path
+        self.pool = pool
+        self.api_key = api_key
+        self.total = len(products)
+        self.done = 0
+        self.status = "running"  # running / done / cancelled / failed
+        self.error = ""
+        self.meta = meta
+        self.run_id: Optional[str] = None
+        self.history_error = ""
+        self.perf: Optional[Dict] = None  # сводка perf.end_run() потока расчёта
+        self.profile = profile
+        self.profile_capture: Optional[Dict] = None  # profiling.finish() потока, пока не показан
+        self.preview: List[pd.DataFrame] = []
+        self.preview_rows = 0
+        self.started = time.time()
+        self.seconds = 0.0
+        self.finished: Optional[float] = None
+        self.discard = False  # заменена новым расчётом: файл удаляется по окончании
+        self.lock = threading.Lock()
+        self._cancel = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self.status == "running"
+
+    def cancel(self):
+        self._cancel.set()
+
+    def _add(self, rows: int, results: pd.DataFrame):
+        with self.lock:
+            self.done += rows
+            room = PREVIEW_ROWS - self.preview_rows
+            if room > 0 and len(results):
+                self.preview.append(results.head(room))
+                self.preview_rows += len(self.preview[-1])
+        metrics.set_gauge("pricing_job_progress", self.done / max(self.total, 1),
+                          {"marketplace": self.key}, "Доля рассчитанных товаров фонового расчёта")
+
+    def _run_chunks(self, c: sqlite3.Connection):
+        with open(self.path, "w", newline="", encoding="utf-8") as f:
+            header = True
+            for lo in range(0, self.total, CHUNK):
+                if self._cancel.is_set():
+                    self.status = "cancelled"
+                    break
+                chunk = self.products[lo:lo + CHUNK]
+                results = self.calc(c, chunk)
+                if len(results):
+                    with perf.span("results_csv", rows=len(results)):
+                        results.to_csv(f, header=header, index=False)
+                        f.flush()
+                    header = False
+                self._add(len(chunk), results)
+
+    def _run_pool(self, db_path: str):
+        marketplace, args = self.pool
+        pricing_pool.run(db_path, marketplace, args, self.path, api_key=self.api_key,
+                         on_shard=self._add, head=PREVIEW_ROWS, cancel=self._cancel, observe=False)
+        if self._cancel.is_set():
+            self.status = "cancelled"
+
+    def _save_history(self, c: sqlite3.Connection):
+        # История — дополнение: её ошибка не делает расчёт неудачным
+        try:
+            meta = {**self.meta, "catalog_version": run_history.catalog_version(c)}
+            self.run_id = run_history.save_csv(self.path, self.key, meta)
+        except Exception as e:
+            self.history_error = f"{type(e).__name__}: {e}"
+
+    def _start_profiler(self) -> Optional[cProfile.Profile]:
+        if not self.profile:
+            return None
+        profiler = cProfile.Profile()
+        profiler.label = f"{self.key}_job"
+        try:
+            profiler.enable()
+        except ValueError:  # Python 3.12+: профайлер скрипта ещё активен — второй не включить
+            self.profile = False
+            return None
+        return profiler
+
+    def _finish_profiler(self, profiler: Optional[cProfile.Profile]):
+        if profiler is None:
+            return
+        import profiling
+
+        try:
+            capture = profiling.finish(profiler, publish=False)
+        except OSError:
+            return
+        capture["note"] = f"Фоновый расчёт {self.key}: {self.done} товаров за {self.seconds:.1f} с" + (
+            "; расчёт шёл в процессах — здесь только ожидание" if self.pool is not None else "")
+        self.profile_capture = capture
+
+    def run(self, db_path: str, conn: sqlite3.Connection):
+        own, c = None, conn
+        # Прогон perf потока: span'ы основного потока сюда не попадают и наоборот
+        perf.start_run(f"Фоновый расчёт: {self.key}")
+        profiler = self._start_profiler()
+        t0 = time.perf_counter()
+        try:
+            # Своё соединение: основной поток продолжает читать каталог при каждом rerun
+            own = core.init_db(db_path) if db_path else None
+            c = own or conn
+            with perf.span("pricing") as sp:
+                if self.pool is not None:
+                    self._run_pool(db_path)
+                else:
+                    self._run_chunks(c)
+                sp["rows"] = self.done
+            if self.status == "running":
+                if self.meta is not None and run_history.is_enabled():
+                    self._save_history(c)
+                self.status = "done"
+        except Exception as e:  # ошибка показывается в панели, а не теряется в потоке
+            self.status, self.error = "failed", f"{type(e).__name__}: {e}"
+        finally:
+            self.seconds = time.perf_counter() - t0
+            core.flush_cache_stats(c)
+            if own is not None:
+                own.close()
+            self.perf = perf.end_run()
+            self._finish_profiler(profiler)
+            self.finished = time.time()
+            if self.discard:
+                _remove(self.path)
+            metrics.observe_throughput("pricing", self.done, self.seconds, marketplace=self.key,
+                                       mode="processes" if self.pool is not None else "thread")
+            metrics.inc("pricing_jobs_total", 1, {"marketplace": self.key, "status": self.status},
+                        "Фоновые расчёты по итогам")
+
+
+_jobs: Dict[Tuple[str, str], PricingJob] = {}  # (сессия, маркетплейс) -> задача
+_lock = threading.Lock()
+
+
+def _session_id() -> str:
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+        ctx = get_script_run_ctx(suppress_warning=True)
+        return ctx.session_id if ctx is not None else ""
+    except ImportError:
+        return ""
+
+
+def _fingerprint(products, pool, meta) -> str:
+    """Отпечаток параметров расчёта: те же параметры — та же задача."""
+    try:
+        raw = pickle.dumps((len(products), pool, meta))
+    except Exception:
+        raw = repr((len(products), pool, meta)).encode("utf-8")
+    return hashlib.sha1(raw).hexdigest()[:12]
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _prune(now: float):
+    """Забывает завершённые задачи старше JOB_TTL_S и удаляет их файлы и осиротевшие CSV."""
+    for k, job in list(_jobs.items()):
+        if not job.running and job.finished is not None and now - job.finished > JOB_TTL_S:
+            del _jobs[k]
+            _remove(job.path)
+    keep = {os.path.basename(job.path) for job in _jobs.values()}
+    for name in os.listdir(RESULTS_DIR):
+        path = os.path.join(RESULTS_DIR, name)
+        if name.endswith(".csv") and name not in keep:
+            try:
+                if now - os.path.getmtime(path) > JOB_TTL_S:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def _db_path(conn: sqlite3.Connection) -> str:
+    row = conn.execute("PRAGMA database_list").fetchone()
+    return row[2] if row else ""
+
+
+def get(key: str) -> Optional[PricingJob]:
+    """Задача маркетплейса в текущей сессии."""
+    return _jobs.get((_session_id(), key))
+
+
+def _session_api_key() -> str:
+    try:
+        import streamlit as st
+
+        return st.session_state.get("openai_key", "")
+    except Exception:
+        return ""
+
+
+def _profile_requested() -> bool:
+    """Запуск скрипта профилируется — фоновый расчёт профилируется тоже."""
+    try:
+        import profiling
+    except ImportError:
+        return False
+    return profiling.current() is not None
+
+
+def start(key: str, conn: sqlite3.Connection, products: columnar.Catalog,
+          calc: Callable[[sqlite3.Connection, columnar.Catalog], pd.DataFrame],
+          pool: Optional[Tuple[str, tuple]] = None, meta: Optional[Dict] = None) -> PricingJob:
+    """
+    Запускает расчёт calc(conn, кусок каталога) -> DataFrame в текущей сессии; идущий расчёт
+    с теми же параметрами не дублируется, с другими — останавливается и заменяется новым.
+    pool=(маркетплейс, аргументы) — тот же расчёт в процессах для больших каталогов.
+    meta — параметры прогона для истории (params, commissions_version); None — не сохранять.
+    """
+    sid = _session_id()
+    fingerprint = _fingerprint(products, pool, meta)
+    with _lock:
+        old = _jobs.get((sid, key))
+        if old is not None and old.running:
+            if old.fingerprint == fingerprint:
+                return old
+            old.discard = True
+            old.cancel()
+        elif old is not None:
+            _remove(old.path)
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        _prune(time.time())
+        # Сессия в имени файла: у каждой сессии свой CSV, чужие файлы не трогаются
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        session = re.sub(r"\W", "", sid)[:8] or "local"
+        path = os.path.join(RESULTS_DIR, f"{key}_{session}_{stamp}_{fingerprint[:6]}.csv")
+        db_path = _db_path(conn)
+        if not (pool and db_path and pricing_pool.WORKERS > 1 and len(products) >= POOL_MIN_ROWS):
+            pool = None
+        # Воркеры вне сессии Streamlit: ключ модели передаётся явно
+        job = _jobs[(sid, key)] = PricingJob(key, products, calc, path, pool,
+                                             _session_api_key() if pool else "", meta, fingerprint,
+                                             _profile_requested())
+        job.thread = threading.Thread(target=job.run, args=(db_path, conn),
+                                      name=f"pricing-{key}", daemon=True)
+        try:
+            # Контекст запустившей сессии: get_ai_category читает её ключ из st.session_state
+            from streamlit.runtime.scriptrunner import add_script_run_ctx
+
+            add_script_run_ctx(job.thread)
+        except ImportError:
+            pass
+        job.thread.start()
+    return job
+
+
+def render(key: str, filename: str):
+    """
+    Панель расчёта: прогресс и отмена, пока идёт; итог, таблица и скачивание — после.
+    Ниже — история расчётов маркетплейса и сравнение прогонов (run_history).
+    """
+    import streamlit as st
+
+    job = get(key)
+    if job is None:
+        run_history.render(key)
+        return
+
+    def panel():
+        with job.lock:
+            done, preview = job.done, list(job.preview)
+        if job.running:
+            st.progress(done / max(job.total, 1), text=f"Рассчитано {done} из {job.total} товаров")
+            if job.profile:
+                st.caption("🔬 Расчёт профилируется: профиль появится в панели «Профилирование» после окончания")
+            if st.button("⏹ Остановить расчёт", key=f"{key}_cancel"):
+                job.cancel()
+        elif job.status == "done":
+            st.success(f"Рассчитано {done} товаров за {job.seconds:.1f} с")
+            if job.history_error:
+                st.warning(f"Расчёт не сохранён в историю: {job.history_error}")
+        elif job.status == "cancelled":
+            st.warning(f"Расчёт остановлен: рассчитано {done} из {job.total} товаров")
+        else:
+            st.error(f"Расчёт прерван ошибкой после {done} товаров: {job.error}")
+
+        if preview:
+            with perf.span("results_dataframe") as sp:
+                table = pd.concat(preview, ignore_index=True)
+                sp["rows"] = len(table)
+            st.subheader("Результаты расчёта")
+            if done > len(table):
+                st.caption(f"Показаны первые {len(table)} строк, все {done} — в файле")
+            with perf.span("render_results_table", rows=len(table)):
+                st.dataframe(table, use_container_width=True)
+        if not job.running and os.path.exists(job.path):
+            with open(job.path, "rb") as f:
+                st.download_button("Скачать результат (CSV)", f.read(), filename, mime="text/csv",
+                                   key=f"{key}_download")
+        if not job.running and st.session_state.get(f"{key}_polling"):
+            # Опрос закончен — полный rerun, чтобы фрагмент перестал обновляться по таймеру
+            st.session_state[f"{key}_polling"] = False
+            st.rerun()
+
+    st.session_state[f"{key}_polling"] = job.running
+    st.fragment(run_every=POLL_S if job.running else None)(panel)()
+    if not job.running:
+        if job.profile_capture is not None:
+            # Профиль потока показывается в панели профилирования этой сессии один раз
+            st.session_state["last_profile"], job.profile_capture = job.profile_capture, None
+        perf.render_panel(job.perf, "⏱ Производительность (фоновый расчёт)")
+        run_history.render(key)
@@ -0,0 +1,229 @@
+"""
+Расчёт РРЦ очень больших каталогов в нескольких процессах.
+
+    rows = pricing_pool.run("products_storage.db", "mvideo", (params,), "mvideo.csv", workers=16)
+
+Каталог делится на диапазоны SKU примерно равного размера (границы — по индексу
+products.sku), по PRICING_SHARDS_PER_WORKER диапазонов на процесс, чтобы быстрые
+процессы разбирали хвост очереди. Процесс-воркер один раз открывает свою копию
+соединения с базой и обёртку category_mapping.bind, затем для каждого диапазона
+читает товары и считает их тем же calculate маркетплейса, что и страница, с теми
+же аргументами (args — всё после calc_tax). Результат диапазона пишется в свой CSV,
+после всех — склеивается в порядке SKU.
+
+Кэши классификации общие: файл базы отображается в память (PRAGMA mmap_size), и
+страницы ai_cache у всех процессов одни — page cache ОС, а не копия в каждом.
+Записи в базу (новые категории, статистика попаданий) редкие и ждут блокировку
+до PRICING_BUSY_TIMEOUT_MS.
+
+Процессы запускаются через forkserver (spawn вне Linux): fork из многопоточного
+процесса Streamlit небезопасен.
+
+    python pricing_pool.py mvideo --db products_storage.db --workers 16 --out mvideo.csv
+"""
+import functools
+import importlib
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+import columnar
+import core
+import metrics
+import perf
+
+WORKERS = int(os.environ.get("PRICING_PROCESSES", os.cpu_count() or 1))
+SHARDS_PER_WORKER = int(os.environ.get("PRICING_SHARDS_PER_WORKER", 4))
+MMAP_MB = int(os.environ.get("PRICING_MMAP_MB", 1024))
+BUSY_TIMEOUT_MS = int(os.environ.get("PRICING_BUSY_TIMEOUT_MS", 60_000))
+MARKETPLACES = ("mvideo", "lemanpro_fbs", "dns", "citilink", "sportmaster_fbs")
+
+Bound = Tuple[Optional[str], Optional[str]]
+
+
+def _context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def shard_bounds(conn: sqlite3.Connection, shards: int) -> List[Bound]:
+    """Диапазоны [lo, hi) по SKU примерно равного размера; товары без SKU — в первом."""
+    total = conn.execute("SELECT COUNT(sku) FROM products").fetchone()[0]
+    shards = max(1, min(shards, total))
+    cuts = []
+    for i in range(1, shards):
+        row = conn.execute("SELECT sku FROM products WHERE sku IS NOT NULL ORDER BY sku LIMIT 1 OFFSET ?",
+                           (total * i // shards,)).fetchone()
+        if row and (not cuts or row[0] != cuts[-1]):
+            cuts.append(row[0])
+    edges = [None] + cuts + [None]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _shard_where(lo: Optional[str], hi: Optional[str]) -> Tuple[str, tuple]:
+    if lo is None and hi is None:
+        return "1", ()
+    if lo is None:
+        return "(sku IS NULL OR sku < ?)", (hi,)
+    if hi is None:
+        return "sku >= ?", (lo,)
+    return "sku >= ? AND sku < ?", (lo, hi)
+
+
+DEFAULT_PARAMS = {
+    "tax_regime": "УСН Доходы (6%)",
+    "target_margin": 20.0,
+    "acquiring": 1.5,
+    "early_payout": 0.0,
+    "marketing": 0.0,
+    "extra_costs": 0.0,
+    "extra_logistics": 0.0,
+}
+
+
+def default_args(marketplace: str, params: dict) -> tuple:
+    """Аргументы calculate после calc_tax с комиссиями из кода (без загруженных таблиц)."""
+    module = importlib.import_module(marketplace)
+    if marketplace == "lemanpro_fbs":
+        return params, module.CATEGORY_COMMISSIONS, "Регион"
+    if marketplace in ("dns", "citilink"):
+        return params, module.CATEGORY_COMMISSIONS
+    return (params,)
+
+
+# ── Воркер ──────────────────────────────────────────────────────────
+_worker: Dict = {}
+
+
+def _init_worker(db_path: str, api_key: str):
+    import category_mapping
+
+    conn = core.init_db(db_path)
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_MB * 1024 * 1024}")
+    # Вне сессии Streamlit ключ модели передаётся явно — и классификации, и сопоставлению
+    get_ai_category = functools.partial(core.get_ai_category, api_key=api_key)
+    _worker.update(conn=conn, get_category=category_mapping.bind(conn, get_ai_category, api_key))
+
+
+def _price_shard(marketplace: str, args: tuple, bound: Bound, out_path: str,
+                 head: int) -> Tuple[int, pd.DataFrame]:
+    """Считает диапазон SKU в процессе-воркере; возвращает (строк, первые head строк результата)."""
+    conn = _worker["conn"]
+    module = importlib.import_module(marketplace)
+    where, params = _shard_where(*bound)
+    catalog = columnar.read_catalog(conn, where, params, order_by="sku")
+    results = module.calculate(conn, catalog, _worker["get_category"], core.calc_tax, *args)
+    core.flush_cache_stats(conn)
+    if len(results):
+        results.to_csv(out_path, index=False)
+    return len(catalog), results.head(head)
+
+
+# ── Запуск и склейка ────────────────────────────────────────────────
+def merge(parts: List[str], out_path: str):
+    """Склеивает CSV диапазонов в порядке списка; заголовок — из первого непустого."""
+    with open(out_path, "w", newline="", encoding="utf-8") as out:
+        header = None
+        for part in parts:
+            if not os.path.exists(part):
+                continue
+            with open(part, newline="", encoding="utf-8") as f:
+                first = f.readline()
+                if not first:
+                    continue
+                if header is None:
+                    header = first
+                    out.write(first)
+                shutil.copyfileobj(f, out)
+
+
+def run(db_path: str, marketplace: str, args: tuple, out_path: str, workers: Optional[int] = None,
+        api_key: str = "", on_shard: Optional[Callable[[int, pd.DataFrame], None]] = None, head: int = 0,
+        cancel: Optional[threading.Event] = None, observe: bool = True) -> int:
+    """
+    Считает весь каталог базы db_path в workers процессах и пишет результат в out_path.
+    on_shard(строк, первые head строк диапазона) вызывается по готовности каждого диапазона;
+    cancel — остановка: недоначатые диапазоны отменяются, в out_path — готовые.
+    observe=False — пропускная способность пишет вызывающий (pricing_jobs), иначе строки
+    этапа pricing учитывались бы дважды. Возвращает число рассчитанных товаров.
+    """
+    if marketplace not in MARKETPLACES:
+        raise ValueError(f"Неизвестный маркетплейс: {marketplace} (доступны: {', '.join(MARKETPLACES)})")
+    workers = max(1, workers or WORKERS)
+    conn = core.init_db(db_path)
+    try:
+        core.flush_cache_stats()  # воркеры читают ai_cache из файла — накопленное пишем до старта
+        bounds = shard_bounds(conn, workers * SHARDS_PER_WORKER)
+    finally:
+        conn.close()
+
+    tmp = tempfile.mkdtemp(prefix=f"pricing_{marketplace}_", dir=os.path.dirname(os.path.abspath(out_path)))
+    parts = [os.path.join(tmp, f"{i:05d}.csv") for i in range(len(bounds))]
+    done_rows = 0
+    t0 = time.perf_counter()
+    try:
+        with perf.span("pricing_pool") as sp, ProcessPoolExecutor(
+                max_workers=min(workers, len(bounds)), mp_context=_context(),
+                initializer=_init_worker, initargs=(os.path.abspath(db_path), api_key)) as ex:
+            pending = {ex.submit(_price_shard, marketplace, args, b, p, head): p for b, p in zip(bounds, parts)}
+            while pending:
+                finished, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    pending.pop(fut)
+                    rows, first = fut.result()
+                    done_rows += rows
+                    if on_shard is not None:
+                        on_shard(rows, first)
+                if cancel is not None and cancel.is_set():
+                    for fut in pending:
+                        fut.cancel()
+                    ex.shutdown(wait=True, cancel_futures=True)
+                    # Начатые диапазоны досчитаны — их строки тоже в результате
+                    for fut, path in pending.items():
+                        if fut.done() and not fut.cancelled() and fut.exception() is None:
+                            rows, first = fut.result()
+                            done_rows += rows
+                            if on_shard is not None:
+                                on_shard(rows, first)
+                        elif os.path.exists(path):
+                            os.remove(path)
+                    break
+            sp["rows"] = done_rows
+        merge(parts, out_path)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    seconds = time.perf_counter() - t0
+    if observe:
+        metrics.observe_throughput("pricing", done_rows, seconds, marketplace=marketplace, mode="processes")
+    metrics.set_gauge("pricing_pool_workers", workers, {"marketplace": marketplace},
+                      "Процессов в последнем многопроцессном расчёте")
+    return done_rows
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Многопроцессный расчёт РРЦ по каталогу")
+    parser.add_argument("marketplace", choices=MARKETPLACES)
+    parser.add_argument("--db", default=core.DB_PATH)
+    parser.add_argument("--out", default=None, help="CSV результата (по умолчанию <маркетплейс>_rrc.csv)")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--params", default="", help="JSON с параметрами расчёта (маржа, налог, эквайринг...)")
+    opts = parser.parse_args()
+    call_args = default_args(opts.marketplace, {**DEFAULT_PARAMS, **json.loads(opts.params or "{}")})
+    out = opts.out or f"{opts.marketplace}_rrc.csv"
+    t = time.perf_counter()
+    n = run(opts.db, opts.marketplace, call_args, out, opts.workers,
+            api_key=os.environ.get("OPENAI_API_KEY", ""))
+    elapsed = time.perf_counter() - t
+    print(f"{n} товаров за {elapsed:.1f} с ({n / max(elapsed, 1e-9):.0f} строк/с, {opts.workers} процессов) → {out}")
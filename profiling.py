@@ -0,0 +1,114 @@
+"""
+Профилирование одного перезапуска Streamlit-скрипта (cProfile).
+
+Включается кнопкой «Профилировать следующий запуск» в сайдбаре или
+параметром ?profile=1 в URL (профилируется сам этот запуск). Результат —
+файл .prof (для snakeviz / pstats) и таблица top-N горячих функций —
+сохраняется в PROFILE_DIR (по умолчанию profiles/) и доступен для скачивания.
+
+Фоновый расчёт РРЦ (pricing_jobs), запущенный из профилируемого запуска,
+профилируется в своём потоке: его профиль появляется в панели после окончания
+расчёта. Расчёт в процессах (pricing_pool) виден только как ожидание.
+"""
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+import time
+from typing import Optional
+
+import streamlit as st
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+TOP_N = 30
+
+_local = threading.local()
+
+
+def current() -> Optional[cProfile.Profile]:
+    """Профайлер, включённый в этом потоке скрипта (None — запуск не профилируется)."""
+    return getattr(_local, "profiler", None)
+
+
+def start_if_requested(label: str = "") -> Optional[cProfile.Profile]:
+    """Запускает профайлер, если запуск «взведён» кнопкой или ?profile=1."""
+    armed = st.session_state.pop("profile_armed", False)
+    if st.query_params.get("profile") == "1":
+        del st.query_params["profile"]
+        armed = True
+    if not armed:
+        return None
+    profiler = cProfile.Profile()
+    profiler.label = label
+    profiler.enable()
+    _local.profiler = profiler
+    return profiler
+
+
+def hotspots(profiler: cProfile.Profile, top_n: int = TOP_N) -> list:
+    """Top-N функций по накопленному времени."""
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, func), (cc, nc, tt, ct, _callers) in stats.stats.items():
+        rows.append({
+            "Функция": f"{func} ({os.path.basename(filename)}:{line})",
+            "Вызовы": nc,
+            "Собств., с": round(tt, 4),
+            "Накопл., с": round(ct, 4),
+        })
+    rows.sort(key=lambda r: r["Накопл., с"], reverse=True)
+    return rows[:top_n]
+
+
+def finish(profiler: Optional[cProfile.Profile], out_dir: str = PROFILE_DIR, publish: bool = True):
+    """
+    Останавливает профайлер и сохраняет .prof и текстовую таблицу hotspots.
+    publish=False — не показывать в панели сразу (фоновый поток: показывает страница).
+    """
+    if profiler is None:
+        return None
+    profiler.disable()
+    if current() is profiler:
+        _local.profiler = None
+    os.makedirs(out_dir, exist_ok=True)
+    slug = re.sub(r"[^\w.-]+", "_", getattr(profiler, "label", "") or "run").strip("_")
+    stamp = time.strftime("%Y%m%d_%H%M%S") + f"{time.time() % 1:.3f}"[1:]
+    base = os.path.join(out_dir, f"{stamp}_{slug}")
+    profiler.dump_stats(base + ".prof")
+
+    text = io.StringIO()
+    pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(TOP_N)
+    with open(base + "_top.txt", "w", encoding="utf-8") as f:
+        f.write(text.getvalue())
+
+    capture = {"prof_path": base + ".prof", "top_path": base + "_top.txt", "hotspots": hotspots(profiler)}
+    if publish:
+        st.session_state["last_profile"] = capture
+    return capture
+
+
+def render_panel():
+    """Кнопка взвода и результаты последнего профилирования в сайдбаре."""
+    with st.sidebar.expander("🔬 Профилирование", expanded=False):
+        if st.button("Профилировать следующий запуск", key="profile_arm_btn"):
+            st.session_state["profile_armed"] = True
+        if st.session_state.get("profile_armed"):
+            st.caption("Следующий запуск будет записан cProfile")
+        capture = st.session_state.get("last_profile")
+        if not capture:
+            st.caption("Профилей пока нет. Также можно открыть страницу с ?profile=1")
+            return
+        st.caption(f"Последний профиль: {os.path.basename(capture['prof_path'])}")
+        if capture.get("note"):
+            st.caption(capture["note"])
+        st.dataframe(capture["hotspots"], use_container_width=True, hide_index=True)
+        for path, label, mime in (
+            (capture["prof_path"], "📥 Скачать .prof", "application/octet-stream"),
+            (capture["top_path"], "📥 Скачать top-N (txt)", "text/plain"),
+        ):
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    st.download_button(label, f.read(), os.path.basename(path), mime=mime,
+                                       key=f"dl_{os.path.basename(path)}")
@@ -0,0 +1,321 @@
+"""
+История расчётов РРЦ в Parquet и сравнение прогонов.
+
+Каждый завершённый расчёт (pricing_jobs) сохраняется в PRICING_HISTORY_DIR
+(pricing_history/) файлом {маркетплейс}_{время}.parquet со сжатием zstd;
+категория, зона и тип размера хранятся словарём. Метаданные прогона —
+маркетплейс, параметры, версии комиссий и каталога, число строк — лежат в
+схеме файла (ключ pricing_run), поэтому список прогонов читает только
+футеры. Таблицы открываются через memory map и нужные колонки.
+
+diff_runs сравнивает два прогона по SKU хеш-соединением Arrow: изменение РРЦ
+и маржи, смена категории, добавленные и пропавшие товары — без DataFrame на
+обе таблицы; миллион строк — секунды.
+
+    python run_history.py list --marketplace mvideo
+    python run_history.py diff mvideo_20261019_101500 mvideo_20261019_120000 --out diff.csv
+    python run_history.py save mvideo_rrc.csv --marketplace mvideo --db products_storage.db
+
+Нужен pyarrow (есть в requirements.txt); без него история выключена (is_enabled() == False).
+"""
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+import perf
+
+HISTORY_DIR = os.environ.get("PRICING_HISTORY_DIR", "pricing_history")
+KEEP = int(os.environ.get("PRICING_HISTORY_KEEP", 50))  # прогонов на маркетплейс
+BLOCK_SIZE = 16 << 20  # байт CSV на пачку записи
+META_KEY = b"pricing_run"
+RRC = "РРЦ, руб"
+MARGIN = "Маржа после налога, %"
+CATEGORY = "Категория"
+TEXT_COLUMNS = ("SKU", "Название")
+DICT_COLUMNS = (CATEGORY, "Зона", "Тип", "Версия комиссий")  # повторяющиеся строки — словарём в Parquet
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.csv as pacsv
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Для истории расчётов нужен pyarrow: pip install pyarrow") from None
+    return pa, pc, pacsv, pq
+
+
+def is_enabled() -> bool:
+    try:
+        _pyarrow()
+    except RuntimeError:
+        return False
+    return True
+
+
+def catalog_version(conn: sqlite3.Connection) -> str:
+    """Отпечаток каталога: число товаров и суммы полей расчёта — меняется с любой правкой цены."""
+    row = conn.execute("""
+        SELECT COUNT(*), MAX(id), TOTAL(length_cm), TOTAL(width_cm), TOTAL(height_cm),
+               TOTAL(weight_kg), TOTAL(cost), TOTAL(LENGTH(name))
+        FROM products
+    """).fetchone()
+    return hashlib.blake2b(repr(row).encode(), digest_size=6).hexdigest()
+
+
+def _path(run_id: str) -> str:
+    return os.path.join(HISTORY_DIR, f"{run_id}.parquet")
+
+
+# ── Запись ──────────────────────────────────────────────────────────
+def save_csv(csv_path: str, marketplace: str, meta: Dict) -> Optional[str]:
+    """
+    Переписывает CSV результата расчёта в Parquet истории потоково (пачками по
+    блокам CSV). meta — params, commissions_version, catalog_version и прочее.
+    Возвращает run_id или None для пустого результата.
+    """
+    pa, pc, pacsv, pq = _pyarrow()
+    if not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0:
+        return None
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    run_id = f"{marketplace}_{time.strftime('%Y%m%d_%H%M%S')}"
+    path, n = _path(run_id), 1
+    while os.path.exists(path):
+        n += 1
+        path = _path(f"{run_id}_{n}")
+    run_id = os.path.splitext(os.path.basename(path))[0]
+
+    t0 = time.perf_counter()
+    # Словарные колонки читаются строками и кодируются по пачкам: auto_dict_encode
+    # ограничен числом значений и падает на блоке, где категорий больше, чем в первом
+    reader = pacsv.open_csv(
+        csv_path,
+        read_options=pacsv.ReadOptions(block_size=BLOCK_SIZE),
+        convert_options=pacsv.ConvertOptions(
+            column_types={**{c: pa.string() for c in TEXT_COLUMNS + DICT_COLUMNS},
+                          RRC: pa.float64(), MARGIN: pa.float64()}),
+    )
+    dict_type = pa.dictionary(pa.int32(), pa.string())
+    schema = pa.schema([f.with_type(dict_type) if f.name in DICT_COLUMNS else f for f in reader.schema])
+    meta = {**meta, "run_id": run_id, "marketplace": marketplace,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    schema = schema.with_metadata({META_KEY: json.dumps(meta, ensure_ascii=False)})
+    rows = 0
+    tmp = path + ".tmp"
+    with perf.span("history_save") as sp:
+        with pq.ParquetWriter(tmp, schema, compression="zstd") as writer:
+            for batch in reader:
+                columns = [pc.dictionary_encode(col).cast(dict_type) if name in DICT_COLUMNS else col
+                           for name, col in zip(batch.schema.names, batch.columns)]
+                writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=schema))
+                rows += batch.num_rows
+        os.replace(tmp, path)  # незаконченный файл не попадает в список прогонов
+        sp["rows"] = rows
+    metrics.observe_throughput("history_save", rows, time.perf_counter() - t0, marketplace=marketplace)
+    _prune(marketplace)
+    return run_id
+
+
+def _prune(marketplace: str):
+    runs = sorted(glob.glob(os.path.join(HISTORY_DIR, f"{marketplace}_*.parquet")), key=os.path.getmtime)
+    for path in runs[:-KEEP] if KEEP > 0 else []:
+        os.remove(path)
+
+
+# ── Чтение ──────────────────────────────────────────────────────────
+def read_meta(run_id: str) -> Dict:
+    """Метаданные прогона и число строк — из футера файла, без чтения данных."""
+    _pa, _pc, _pacsv, pq = _pyarrow()
+    footer = pq.read_metadata(_path(run_id), memory_map=True)
+    meta = json.loads((footer.metadata or {}).get(META_KEY, b"{}"))
+    meta["rows"] = footer.num_rows
+    return meta
+
+
+def list_runs(marketplace: Optional[str] = None) -> List[Dict]:
+    """Метаданные прогонов (новые первыми) — читаются только футеры файлов."""
+    if not os.path.isdir(HISTORY_DIR):
+        return []
+    pattern = f"{marketplace}_*.parquet" if marketplace else "*.parquet"
+    runs = []
+    for path in glob.glob(os.path.join(HISTORY_DIR, pattern)):
+        run_id = os.path.splitext(os.path.basename(path))[0]
+        meta = read_meta(run_id)
+        if meta.get("marketplace") and (marketplace is None or meta["marketplace"] == marketplace):
+            runs.append(meta)
+    return sorted(runs, key=lambda m: m.get("created_at", ""), reverse=True)
+
+
+def open_run(run_id: str, columns: Optional[List[str]] = None):
+    """pyarrow.Table прогона через memory map; columns — только нужные колонки."""
+    _pa, _pc, _pacsv, pq = _pyarrow()
+    return pq.read_table(_path(run_id), columns=columns, memory_map=True)
+
+
+# ── Сравнение ───────────────────────────────────────────────────────
+def _side(run_id: str, suffix: str):
+    pa, _pc, _pacsv, pq = _pyarrow()
+    names = pq.read_schema(_path(run_id), memory_map=True).names
+    wanted = [c for c in ("SKU", "Название", RRC, MARGIN, CATEGORY) if c in names]
+    table = open_run(run_id, wanted)
+    arrays, fields = [], []
+    for name in wanted:
+        col = table.column(name)
+        if pa.types.is_dictionary(col.type):
+            col = col.cast(pa.string())  # словарные колонки в соединении Arrow не поддерживаются
+        arrays.append(col)
+        fields.append(name if name == "SKU" else f"{name} {suffix}")
+    return pa.Table.from_arrays(arrays, names=fields)
+
+
+def diff_runs(run_a: str, run_b: str, only_changed: bool = True) -> Tuple[Dict, object]:
+    """
+    Сравнение прогона B с прогоном A по SKU. Возвращает (сводка, pyarrow.Table):
+    РРЦ и маржа обоих прогонов, Δ РРЦ (руб и %), Δ маржи (п.п.), категории и тип
+    изменения — «новый», «удалён», «категория», «цена». Таблица отсортирована по |Δ РРЦ|.
+    """
+    pa, pc, _pacsv, _pq = _pyarrow()
+    t0 = time.perf_counter()
+    with perf.span("history_diff") as sp:
+        a, b = _side(run_a, "A"), _side(run_b, "B")
+        # Один кусок на колонку: case_when и StructArray работают с Array, а не ChunkedArray
+        joined = a.join(b, keys="SKU", join_type="full outer", coalesce_keys=True).combine_chunks()
+        col = {name: joined[name].combine_chunks() for name in joined.column_names}
+
+        rrc_a, rrc_b = col[f"{RRC} A"], col[f"{RRC} B"]
+        mrg_a, mrg_b = col[f"{MARGIN} A"], col[f"{MARGIN} B"]
+        cat_a, cat_b = col[f"{CATEGORY} A"], col[f"{CATEGORY} B"]
+        added, removed = pc.is_null(rrc_a), pc.is_null(rrc_b)
+        both = pc.invert(pc.or_(added, removed))
+        d_rrc = pc.subtract(rrc_b, rrc_a)
+        d_rrc_pct = pc.if_else(pc.greater(rrc_a, 0), pc.multiply(pc.divide(d_rrc, rrc_a), 100.0), None)
+        d_margin = pc.subtract(mrg_b, mrg_a)
+        cat_changed = pc.and_(both, pc.fill_null(pc.not_equal(cat_a, cat_b), False))
+        price_changed = pc.and_(both, pc.or_(pc.fill_null(pc.not_equal(d_rrc, 0), False),
+                                             pc.fill_null(pc.not_equal(d_margin, 0), False)))
+        kind = pc.case_when(
+            pa.StructArray.from_arrays([pc.fill_null(added, False), pc.fill_null(removed, False),
+                                        cat_changed, price_changed], names=["a", "r", "c", "p"]),
+            "новый", "удалён", "категория", "цена")  # без изменений — null
+        name = pc.coalesce(col["Название B"], col["Название A"]) if "Название A" in col \
+            else pa.nulls(joined.num_rows, pa.string())
+
+        result = pa.table({
+            "SKU": col["SKU"], "Название": name, "Изменение": kind,
+            f"{RRC} A": rrc_a, f"{RRC} B": rrc_b, "Δ РРЦ, руб": d_rrc,
+            "Δ РРЦ, %": pc.round(d_rrc_pct, 1),
+            f"{MARGIN} A": mrg_a, f"{MARGIN} B": mrg_b, "Δ маржи, п.п.": pc.round(d_margin, 1),
+            f"{CATEGORY} A": cat_a, f"{CATEGORY} B": cat_b,
+        })
+        summary = {
+            "run_a": run_a, "run_b": run_b,
+            "rows_a": a.num_rows, "rows_b": b.num_rows,
+            "added": pc.sum(added).as_py() or 0,
+            "removed": pc.sum(removed).as_py() or 0,
+            "category_changed": pc.sum(cat_changed).as_py() or 0,
+            "price_changed": pc.sum(price_changed).as_py() or 0,
+            "rrc_delta_total": pc.sum(d_rrc).as_py() or 0.0,
+            "margin_delta_mean": pc.mean(pc.filter(d_margin, both)).as_py() if a.num_rows and b.num_rows else None,
+        }
+        if only_changed:
+            result = result.filter(pc.is_valid(kind))
+        # Новые и удалённые (Δ нет) — первыми, дальше по убыванию |Δ РРЦ|
+        magnitude = pc.fill_null(pc.abs(result["Δ РРЦ, руб"]), float("inf"))
+        result = result.take(pc.sort_indices(magnitude, sort_keys=[("", "descending")]))
+        sp["rows"] = joined.num_rows
+    summary["seconds"] = round(time.perf_counter() - t0, 3)
+    return summary, result
+
+
+# ── Страница ────────────────────────────────────────────────────────
+def _label(meta: Dict) -> str:
+    params = meta.get("params") or {}
+    return (f"{meta.get('created_at', '?').replace('T', ' ')} · {meta.get('rows', 0)} SKU · "
+            f"маржа {params.get('target_margin', '?')}% · комиссии {meta.get('commissions_version', '—')} · "
+            f"каталог {meta.get('catalog_version', '—')}")
+
+
+def render(marketplace: str, top: int = 2_000):
+    """Список прогонов маркетплейса и сравнение двух из них."""
+    import streamlit as st
+
+    if not is_enabled():
+        return
+    runs = list_runs(marketplace)
+    if not runs:
+        return
+    with st.expander(f"🗂 История расчётов ({len(runs)})", expanded=False):
+        labels = {m["run_id"]: _label(m) for m in runs}
+        ids = list(labels)
+        if len(ids) < 2:
+            st.caption(f"Сохранён один расчёт: {labels[ids[0]]}. Сравнение — после следующего.")
+            return
+        col_a, col_b = st.columns(2)
+        run_a = col_a.selectbox("Прогон A (база)", ids, index=1, format_func=labels.get, key=f"{marketplace}_hist_a")
+        run_b = col_b.selectbox("Прогон B", ids, index=0, format_func=labels.get, key=f"{marketplace}_hist_b")
+        if run_a == run_b or not st.button("Сравнить прогоны", key=f"{marketplace}_hist_diff"):
+            return
+        summary, changes = diff_runs(run_a, run_b)
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("Цена / маржа", summary["price_changed"])
+        c2.metric("Категория", summary["category_changed"])
+        c3.metric("Новые", summary["added"])
+        c4.metric("Удалены", summary["removed"])
+        st.caption(f"Сравнение {summary['rows_a']} и {summary['rows_b']} строк за {summary['seconds']:.2f} с")
+        if changes.num_rows:
+            if changes.num_rows > top:
+                st.caption(f"Показаны {top} изменений с наибольшим |Δ РРЦ| из {changes.num_rows}")
+            st.dataframe(changes.slice(0, top).to_pandas(), use_container_width=True)
+            _pa, _pc, pacsv, _pq = _pyarrow()
+            import io
+
+            buf = io.BytesIO()
+            pacsv.write_csv(changes, buf)
+            st.download_button("Скачать сравнение (CSV)", buf.getvalue(), f"{run_a}__{run_b}.csv",
+                               mime="text/csv", key=f"{marketplace}_hist_download")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="История расчётов РРЦ (Parquet)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_list = sub.add_parser("list", help="Сохранённые прогоны")
+    p_list.add_argument("--marketplace", default=None)
+    p_diff = sub.add_parser("diff", help="Сравнить два прогона по SKU")
+    p_diff.add_argument("run_a")
+    p_diff.add_argument("run_b")
+    p_diff.add_argument("--out", default=None, help="CSV или .parquet со всеми изменениями")
+    p_diff.add_argument("--top", type=int, default=20)
+    p_save = sub.add_parser("save", help="Сохранить CSV результата (например, pricing_pool.py) в историю")
+    p_save.add_argument("csv")
+    p_save.add_argument("--marketplace", required=True)
+    p_save.add_argument("--db", default=None, help="База каталога — для версии каталога")
+    args = parser.parse_args()
+
+    if args.cmd == "list":
+        for m in list_runs(args.marketplace):
+            print(f"{m['run_id']:<40} {_label(m)}")
+    elif args.cmd == "save":
+        meta = {}
+        if args.db:
+            with sqlite3.connect(args.db) as c:
+                meta["catalog_version"] = catalog_version(c)
+        print(save_csv(args.csv, args.marketplace, meta))
+    else:
+        summary, changes = diff_runs(args.run_a, args.run_b)
+        print(json.dumps(summary, ensure_ascii=False, indent=1))
+        if args.out:
+            _pa, _pc, pacsv, pq = _pyarrow()
+            if args.out.endswith(".parquet"):
+                pq.write_table(changes, args.out, compression="zstd")
+            else:
+                pacsv.write_csv(changes, args.out)
+        for row in changes.slice(0, args.top).to_pylist():
+            print(row)
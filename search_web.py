@@ -0,0 +1,270 @@
+"""
+Веб-поиск для обогащения: сменные провайдеры, параллельные запросы, кэш сниппетов.
+
+Провайдер задаётся переменными окружения:
+    SEARCH_PROVIDER=searxng  — JSON API SearXNG (SEARCH_URL=http://host:8888/search)
+    SEARCH_PROVIDER=local    — офлайн-индекс документов (SEARCH_INDEX=docs.jsonl или .csv
+                               с полями title, url, text) — тесты и закрытый контур
+    пусто                    — поиск выключен
+
+Свой провайдер — объект с методом search(query, limit) -> [{title, url, snippet}],
+регистрируется через register_provider(name, factory).
+
+search_web(queries, conn) отправляет варианты запроса (название, артикул, EAN — см.
+product_queries) параллельно (SEARCH_WORKERS), убирает повторы сниппетов и кэширует
+ответы в таблице search_cache по хешу запроса на SEARCH_CACHE_TTL_S (7 дней).
+Ошибки провайдера не кэшируются.
+"""
+import csv
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import ean_index
+import metrics
+import perf
+
+PROVIDER = os.environ.get("SEARCH_PROVIDER", "")
+WORKERS = int(os.environ.get("SEARCH_WORKERS", 4))
+LIMIT = int(os.environ.get("SEARCH_LIMIT", 5))
+TIMEOUT_S = float(os.environ.get("SEARCH_TIMEOUT_S", 10))
+CACHE_TTL_S = int(os.environ.get("SEARCH_CACHE_TTL_S", 7 * 86400))
+SNIPPET_CHARS = 300
+
+_WORD_RE = re.compile(r"[0-9a-zа-яё]+")
+
+
+def init_tables(c):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS search_cache (
+            query_hash TEXT PRIMARY KEY,
+            provider TEXT,
+            query TEXT,
+            results TEXT,
+            fetched_at INTEGER
+        ) WITHOUT ROWID
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_search_cache_fetched ON search_cache (fetched_at)")
+
+
+# ── Провайдеры ─────────────────────────────────────────────────────
+class SearxngProvider:
+    """JSON API SearXNG: GET {SEARCH_URL}?q=...&format=json."""
+
+    name = "searxng"
+
+    def __init__(self, url: Optional[str] = None):
+        self.url = url or os.environ.get("SEARCH_URL", "")
+        if not self.url:
+            raise RuntimeError("Для SEARCH_PROVIDER=searxng нужен SEARCH_URL")
+
+    def search(self, query: str, limit: int) -> List[Dict]:
+        url = f"{self.url}?{urllib.parse.urlencode({'q': query, 'format': 'json'})}"
+        with urllib.request.urlopen(url, timeout=TIMEOUT_S) as resp:
+            payload = json.loads(resp.read().decode("utf-8"))
+        return [{"title": r.get("title", ""), "url": r.get("url", ""), "snippet": r.get("content", "")}
+                for r in payload.get("results", [])[:limit]]
+
+
+def _tokens(text: str) -> List[str]:
+    return _WORD_RE.findall(str(text or "").lower().replace("ё", "е"))
+
+
+class LocalIndexProvider:
+    """Офлайн-индекс: инвертированный индекс слов документа, ранжирование по сумме IDF."""
+
+    name = "local"
+
+    def __init__(self, path: Optional[str] = None):
+        path = path or os.environ.get("SEARCH_INDEX", "")
+        if not path or not os.path.exists(path):
+            raise RuntimeError("Для SEARCH_PROVIDER=local нужен SEARCH_INDEX — файл .jsonl или .csv")
+        self.docs = list(self._read(path))
+        self.postings: Dict[str, List[int]] = {}
+        for i, doc in enumerate(self.docs):
+            for t in set(_tokens(doc["title"] + " " + doc["text"])):
+                self.postings.setdefault(t, []).append(i)
+        n = len(self.docs)
+        self.idf = {t: math.log((n + 1) / (len(p) + 1)) + 1.0 for t, p in self.postings.items()}
+
+    @staticmethod
+    def _read(path: str):
+        with open(path, encoding="utf-8") as f:
+            rows = (json.loads(line) for line in f if line.strip()) if path.endswith(".jsonl") \
+                else csv.DictReader(f)
+            for r in rows:
+                yield {"title": str(r.get("title") or ""), "url": str(r.get("url") or ""),
+                       "text": str(r.get("text") or "")}
+
+    def _snippet(self, text: str, words: set) -> str:
+        lowered = text.lower().replace("ё", "е")
+        hits = [m.start() for m in _WORD_RE.finditer(lowered) if m.group() in words]
+        start = max(0, (hits[0] if hits else 0) - SNIPPET_CHARS // 4)
+        return text[start:start + SNIPPET_CHARS].strip()
+
+    def search(self, query: str, limit: int) -> List[Dict]:
+        words = set(_tokens(query))
+        scores: Dict[int, float] = {}
+        for t in words:
+            for i in self.postings.get(t, ()):
+                scores[i] = scores.get(i, 0.0) + self.idf[t]
+        best = sorted(scores, key=lambda i: (-scores[i], i))[:limit]
+        return [{"title": self.docs[i]["title"], "url": self.docs[i]["url"],
+                 "snippet": self._snippet(self.docs[i]["text"], words)} for i in best]
+
+
+_factories: Dict[str, Callable] = {"searxng": SearxngProvider, "local": LocalIndexProvider}
+_providers: Dict[str, object] = {}
+_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def register_provider(name: str, factory: Callable):
+    """Подключает свой провайдер: factory() -> объект с search(query, limit)."""
+    with _lock:
+        _factories[name] = factory
+        _providers.pop(name, None)
+
+
+def get_provider(name: Optional[str] = None):
+    name = name if name is not None else PROVIDER
+    if not name:
+        return None
+    with _lock:
+        if name not in _providers:
+            if name not in _factories:
+                raise ValueError(f"Неизвестный SEARCH_PROVIDER: {name} (доступны: {', '.join(_factories)})")
+            _providers[name] = _factories[name]()
+        return _providers[name]
+
+
+def is_enabled(name: Optional[str] = None) -> bool:
+    try:
+        return get_provider(name) is not None
+    except (RuntimeError, ValueError):
+        return False
+
+
+# ── Запросы, кэш, fan-out ──────────────────────────────────────────
+def product_queries(product: Dict) -> List[str]:
+    """Варианты запроса для товара: бренд + название, артикул, EAN (без повторов)."""
+    brand = str(product.get("brand") or "").strip()
+    name = str(product.get("name") or "").strip()
+    sku = str(product.get("sku") or "").strip()
+    queries = [f"{brand} {name} габариты вес".strip()]
+    if sku:
+        queries.append(f"{brand} {sku} характеристики".strip())
+    ean = ean_index.normalize_ean(product.get("ean"))
+    if ean:
+        queries.append(ean)
+    seen = set()
+    return [q for q in queries if not (q.lower() in seen or seen.add(q.lower()))]
+
+
+def _query_hash(provider: str, query: str) -> str:
+    normalized = " ".join(_tokens(query))
+    return hashlib.blake2b(f"{provider}\0{normalized}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _cached(conn: sqlite3.Connection, hashes: List[str]) -> Dict[str, List[Dict]]:
+    rows = conn.execute(
+        "SELECT query_hash, results FROM search_cache "
+        "WHERE query_hash IN (SELECT value FROM json_each(?)) AND fetched_at >= ?",
+        (json.dumps(hashes), int(time.time()) - CACHE_TTL_S)
+    ).fetchall()
+    return {h: json.loads(r) for h, r in rows}
+
+
+def _store(conn: sqlite3.Connection, provider: str, fresh: Dict[str, tuple]):
+    now = int(time.time())
+    conn.executemany(
+        "INSERT OR REPLACE INTO search_cache (query_hash, provider, query, results, fetched_at) VALUES (?,?,?,?,?)",
+        [(h, provider, q, json.dumps(res, ensure_ascii=False), now) for h, (q, res) in fresh.items()]
+    )
+    conn.execute("DELETE FROM search_cache WHERE fetched_at < ?", (now - CACHE_TTL_S,))
+    conn.commit()
+
+
+def _run(provider, query: str, limit: int) -> Optional[List[Dict]]:
+    t0 = time.perf_counter()
+    try:
+        results = provider.search(query, limit)
+    except Exception as e:
+        metrics.inc("search_failures_total", 1, {"provider": provider.name, "error": type(e).__name__},
+                    "Ошибки веб-поиска")
+        return None
+    metrics.observe("search_request_duration_seconds", time.perf_counter() - t0, {"provider": provider.name},
+                    "Длительность запроса к поиску")
+    return results
+
+
+def _dedupe(batches: List[List[Dict]], limit: int) -> List[Dict]:
+    """Результаты вариантов запроса по очереди (1-й каждого, 2-й каждого, ...), без повторов."""
+    seen, merged = set(), []
+    for rank in range(max((len(b) for b in batches), default=0)):
+        for batch in batches:
+            if rank >= len(batch):
+                continue
+            r = batch[rank]
+            snippet = " ".join(str(r.get("snippet") or "").split())
+            key = (r.get("url") or "").rstrip("/").lower() or snippet.lower()
+            if not snippet or key in seen or snippet.lower() in seen:
+                continue
+            seen.update((key, snippet.lower()))
+            merged.append({**r, "snippet": snippet})
+    return merged[:limit]
+
+
+def search_web(queries: List[str], conn: Optional[sqlite3.Connection] = None, limit: int = LIMIT,
+               provider_name: Optional[str] = None) -> List[Dict]:
+    """
+    Результаты [{title, url, snippet}] по всем вариантам запроса. С conn — через
+    search_cache; без провайдера — пустой список.
+    """
+    global _executor
+    provider = get_provider(provider_name)
+    if provider is None or not queries:
+        return []
+    hashes = [_query_hash(provider.name, q) for q in queries]
+    cached = _cached(conn, hashes) if conn is not None else {}
+    if cached:
+        perf.count("search_cache_hit", len(cached))
+        metrics.inc("search_queries_total", len(cached), {"result": "cache"}, "Запросы к веб-поиску")
+
+    missing = [(h, q) for h, q in zip(hashes, queries) if h not in cached]
+    fresh = {}
+    if missing:
+        perf.count("search_cache_miss", len(missing))
+        metrics.inc("search_queries_total", len(missing), {"result": "provider"}, "Запросы к веб-поиску")
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="search")
+        with perf.span("search_web", rows=len(missing)):
+            answers = list(_executor.map(lambda hq: _run(provider, hq[1], limit), missing))
+        fresh = {h: (q, res) for (h, q), res in zip(missing, answers) if res is not None}
+        if conn is not None and fresh:
+            _store(conn, provider.name, fresh)
+
+    batches = [cached.get(h) or fresh.get(h, (None, []))[1] for h in hashes]
+    return _dedupe(batches, limit)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Проверка провайдера веб-поиска")
+    parser.add_argument("query", nargs="+")
+    parser.add_argument("--provider", default=None)
+    parser.add_argument("--limit", type=int, default=LIMIT)
+    args = parser.parse_args()
+    for r in search_web([" ".join(args.query)], limit=args.limit, provider_name=args.provider):
+        print(f"- {r['title']} ({r['url']})\n  {r['snippet']}")
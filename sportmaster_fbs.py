@@ -1,7 +1,13 @@
 # sportmaster_fbs.py
 import streamlit as st
+import numpy as np
 import pandas as pd
 
+import columnar
+import core
+import perf
+import pricing_jobs
+
 # ─────────────────────────────────────────────────────────────────────────────
 # 1. СПРАВОЧНИК КОМИССИЙ (из Базы Знаний, с 01.02.2026)
 # ─────────────────────────────────────────────────────────────────────────────
@@ -134,13 +140,34 @@ CATEGORY_COMMISSIONS = {
 # 2. ЛОГИСТИКА FBS (с 01.02.2026)
 # ─────────────────────────────────────────────────────────────────────────────
 def get_fbs_logistics(weight_kg):
-    # Округляем в большую сторону до целого
-    import math
-    w = math.ceil(weight_kg)
-    if w <= 2:
-        return 220.0
+    # Округляем в большую сторону до целого: до 2 кг — 220 руб, дальше +90 руб за кг (число или массив NumPy)
+    w = np.ceil(weight_kg)
+    return 220.0 + np.maximum(w - 2, 0) * 90.0
+
+def calculate(conn, products, get_ai_category, calc_tax, params: dict, is_promo: bool = False,
+              commissions: dict = CATEGORY_COMMISSIONS) -> pd.DataFrame:
+    """Расчёт РРЦ и маржи по каталогу (columnar.Catalog или строки sku, name, length, width, height, weight, cost)."""
+    catalog = columnar.as_catalog(products)
+    logistics_sm = get_fbs_logistics(catalog.weight)
+
+    # Комиссия
+    if is_promo:
+        category = columnar.constant("Льготный период (Все категории)", len(catalog))
+        commission = np.full(len(catalog), 5.0)
     else:
-        return 220.0 + (w - 2) * 90.0
+        category = catalog.classify(get_ai_category, list(commissions.keys()), conn, "sportmaster")
+        commission = columnar.lookup(category, commissions)
+
+    economics = columnar.unit_economics(catalog.cost, logistics_sm + params["extra_logistics"], commission,
+                                        params, calc_tax)
+    return columnar.result_frame({
+        "SKU": catalog.sku,
+        "Название": catalog.name_array(),
+        "Вес, кг": core.pyround(catalog.weight, 2),
+        "Логистика СМ, руб": logistics_sm,
+        "Категория": category,
+        "Комиссия, %": commission,
+    }, economics)
 
 def render(conn, get_ai_category, normalize_value, calc_tax, params: dict):
     st.header("Спортмастер — Юнит-экономика (FBS)")
@@ -201,91 +228,24 @@ def render(conn, get_ai_category, normalize_value, calc_tax, params: dict):
             conn.commit()
             st.success(f"Сохранено: {saved}, пропущено: {skipped}")
 
-        all_products = conn.execute(
-            "SELECT sku, name, length_cm, width_cm, height_cm, weight_kg, cost FROM products"
-        ).fetchall()
+        catalog = columnar.read_catalog(conn)
         
-        if all_products:
-            df_show = pd.DataFrame(all_products, columns=["SKU", "Название", "Длина, см", "Ширина, см", "Высота, см", "Вес, кг", "Себестоимость, руб"])
-            st.dataframe(df_show, use_container_width=True)
+        if len(catalog):
+            df_show = catalog.frame()
+            with perf.span("render_catalog_table", rows=len(df_show)):
+                st.dataframe(df_show, use_container_width=True)
         else:
             st.info("Каталог пуст. Загрузите Excel.")
 
-    all_products = conn.execute(
-        "SELECT sku, name, length_cm, width_cm, height_cm, weight_kg, cost FROM products"
-    ).fetchall()
-    
-    if not all_products:
+    if not len(catalog):
         st.warning("Загрузите каталог товаров для расчёта.")
         return
 
     # Блок 2: Расчёт
     with st.expander("Блок 2. Расчёт юнит-экономики", expanded=True):
-        cat_list = list(commissions.keys())
         if st.button("Рассчитать РРЦ для всего каталога", key="sm_calc"):
-            target_m = params["target_margin"]
-            acq = params["acquiring"]
-            ep = params["early_payout"]
-            mkt = params["marketing"]
-            extra_c = params["extra_costs"]
-            extra_l = params["extra_logistics"]
-            tax_regime = params["tax_regime"]
-            
-            results = []
-            for p in all_products:
-                sku, name, l, w, h, wt, cost = p
-                cost = cost or 0.0
-                
-                # Логистика Спортмастер FBS
-                logistics_sm = get_fbs_logistics(wt)
-                logistics_total = logistics_sm + extra_l
-                
-                # Комиссия
-                if is_promo:
-                    commission = 5.0
-                    category = "Льготный период (Все категории)"
-                else:
-                    category = get_ai_category(name, cat_list, conn, "sportmaster")
-                    commission = commissions.get(category, 0.0)
-                
-                k_percent = commission + acq + ep + mkt
-                denom = 1 - (k_percent / 100) - (target_m / 100)
-                
-                if denom > 0 and cost > 0:
-                    rrc = (cost + logistics_total + extra_c) / denom
-                else:
-                    rrc = 0.0
-                    
-                if rrc > 0:
-                    percent_costs = rrc * (k_percent / 100)
-                    profit_before = rrc - cost - logistics_total - extra_c - percent_costs
-                    margin_before = (profit_before / rrc * 100) if rrc > 0 else 0
-                    tax, profit_after, margin_after = calc_tax(rrc, cost + logistics_total + extra_c + percent_costs, tax_regime)
-                else:
-                    profit_before = margin_before = tax = profit_after = margin_after = 0.0
-                
-                results.append({
-                    "SKU": sku,
-                    "Название": name,
-                    "Вес, кг": round(wt, 2),
-                    "Логистика СМ, руб": logistics_sm,
-                    "Категория": category,
-                    "Комиссия, %": commission,
-                    "Себестоимость, руб": round(cost, 0),
-                    "РРЦ, руб": round(rrc, 0),
-                    "Прибыль до налога, руб": round(profit_before, 0),
-                    "Маржа до налога, %": round(margin_before, 1),
-                    "Налог, руб": round(tax, 0),
-                    "Прибыль после налога, руб": round(profit_after, 0),
-                    "Маржа после налога, %": round(margin_after, 1),
-                })
-            
-            res_df = pd.DataFrame(results)
-            st.subheader("Результаты расчёта")
-            st.dataframe(res_df, use_container_width=True)
-            st.download_button(
-                "Скачать результат (CSV)",
-                res_df.to_csv(index=False).encode("utf-8"),
-                "sportmaster_fbs_results.csv",
-                mime="text/csv"
-            )
+            pricing_jobs.start("sportmaster_fbs", conn, catalog,
+                               lambda c, chunk: calculate(c, chunk, get_ai_category, calc_tax, params, is_promo, commissions),
+                               pool=("sportmaster_fbs", (params, is_promo, commissions)),
+                               meta={"params": params, "is_promo": is_promo})
+        pricing_jobs.render("sportmaster_fbs", "sportmaster_fbs_results.csv")
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ai_client  # noqa: E402
+
+
+@pytest.mark.parametrize("error, outage", [
+    (ai_client.AIRateLimitError("429"), True),
+    (ai_client.AIServerError("500"), True),
+    (TimeoutError("read timed out"), True),
+    (ConnectionResetError("reset by peer"), True),
+    (TypeError("create() got an unexpected keyword argument 'foo'"), False),
+    (KeyError("choices"), False),
+    (ai_client.CassetteMissError("no cassette entry"), False),
+    (ai_client.CircuitOpenError("open"), False),
+    (ai_client.AIBudgetError("budget"), False),
+])
+def test_is_outage(error, outage):
+    assert ai_client._is_outage(error) is outage
+
+
+def test_is_outage_status_codes():
+    class APIError(Exception):
+        def __init__(self, code):
+            self.status_code = code
+
+    assert ai_client._is_outage(APIError(503))
+    assert not ai_client._is_outage(APIError(400))
+    assert not ai_client._is_outage(APIError(401))
+
+
+def test_is_outage_sdk_errors():
+    httpx = pytest.importorskip("httpx")
+    openai = pytest.importorskip("openai")
+    request = httpx.Request("POST", "http://localhost/v1/chat/completions")
+    assert ai_client._is_outage(openai.APITimeoutError(request=request))
+    assert ai_client._is_outage(openai.APIConnectionError(request=request))
+    assert ai_client._is_outage(httpx.ConnectError("refused", request=request))
@@ -0,0 +1,92 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core  # noqa: E402
+import dim_stats  # noqa: E402
+
+
+@pytest.fixture
+def conn():
+    c = core.init_db(":memory:")
+    yield c
+    c.close()
+
+
+def add(conn, sku, category="Каски", brand="Bell", weight=1.0, length=20.0, source="ai"):
+    conn.execute(
+        "INSERT INTO products (sku, name, category, brand, weight_kg, length_cm, width_cm, height_cm, enrich_source) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (sku, f"Товар {sku}", category, brand, weight, length, length, length, source))
+
+
+def stats(conn, brand=""):
+    return conn.execute("SELECT n_weight_kg, sum_weight_kg FROM dim_stats WHERE category='Каски' AND brand=?",
+                        (brand,)).fetchone()
+
+
+def test_light_goods_median_is_not_zero(conn):
+    for i in range(10):
+        add(conn, f"s{i}", weight=0.03 + i * 0.001)
+    values, level = dim_stats.lookup(conn, "Каски")
+    assert level == "category"
+    assert values["weight_kg"] == pytest.approx(0.0345, rel=0.05)
+
+
+@pytest.mark.parametrize("weight", [0.14, 1.4, 14.0, 140.0])
+def test_median_relative_precision(conn, weight):
+    for i in range(6):
+        add(conn, f"s{i}", weight=weight)
+    values, _ = dim_stats.lookup(conn, "Каски")
+    assert values["weight_kg"] == pytest.approx(weight, rel=0.03)
+
+
+def test_triggers_follow_insert_update_delete(conn):
+    for i in range(5):
+        add(conn, f"s{i}", weight=2.0)
+    assert stats(conn) == (5, pytest.approx(10.0))
+    assert stats(conn, "Bell") == (5, pytest.approx(10.0))
+
+    conn.execute("UPDATE products SET weight_kg = 4.0 WHERE sku = 's0'")
+    assert stats(conn) == (5, pytest.approx(12.0))
+    assert dim_stats.lookup(conn, "Каски")[0]["weight_kg"] == pytest.approx(2.0, rel=0.03)
+
+    conn.execute("DELETE FROM products WHERE sku IN ('s1', 's2')")
+    assert stats(conn) == (3, pytest.approx(8.0))
+    assert dim_stats.lookup(conn, "Каски")[0] == {}  # выборка меньше MIN_SAMPLES
+
+    conn.execute("DELETE FROM products")
+    assert conn.execute("SELECT COUNT(*) FROM dim_stats").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM dim_hist").fetchone()[0] == 0
+
+
+def test_fallback_values_are_not_counted(conn):
+    for i in range(5):
+        add(conn, f"s{i}", weight=2.0, source="category_default")
+    assert stats(conn) is None
+    conn.execute("UPDATE products SET enrich_source = 'ai' WHERE sku = 's0'")
+    assert stats(conn) == (1, pytest.approx(2.0))
+    conn.execute("UPDATE products SET enrich_source = 'dim_stats (category)' WHERE sku = 's0'")
+    assert stats(conn) is None
+
+
+def test_rebuild_matches_triggers(conn):
+    for i in range(7):
+        add(conn, f"s{i}", weight=0.5 + i, brand="Bell" if i % 2 else "Fox")
+    before = conn.execute("SELECT * FROM dim_hist ORDER BY 1, 2, 3, 4").fetchall()
+    dim_stats.rebuild(conn)
+    assert conn.execute("SELECT * FROM dim_hist ORDER BY 1, 2, 3, 4").fetchall() == before
+
+
+def test_lookup_prefers_brand_and_falls_back_to_category(conn):
+    for i in range(5):
+        add(conn, f"b{i}", brand="Bell", weight=1.0)
+    for i in range(5):
+        add(conn, f"f{i}", brand="Fox", weight=3.0)
+    values, level = dim_stats.lookup(conn, "Каски", "Bell")
+    assert level == "brand" and values["weight_kg"] == pytest.approx(1.0, rel=0.03)
+    values, level = dim_stats.lookup(conn, "Каски", "Giro")
+    assert level == "category" and values["weight_kg"] > 0
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import names  # noqa: E402
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("Куртка Columbia R320 синяя, размер XL", "куртка columbia r320"),
+    ("Кроссовки Nike р. 42", "кроссовки nike"),
+    ("Костюм Demix рост 164-170", "костюм demix"),
+    ("Ботинки Salomon eu 42", "ботинки salomon"),
+    ("Футболка Adidas XXL", "футболка adidas"),
+    ("Каска Bell B368 (2 шт)", "каска bell b368 (2 шт)"),
+])
+def test_variant_name_strips_sizes(name, expected):
+    assert names.variant_name(name) == expected
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("Насос Topeak ручной", "насос topeak ручной"),
+    ("Велосипед Stels Pilot рама", "велосипед stels pilot рама"),
+    ("Аккумулятор Bosch 18V ремень", "аккумулятор bosch 18v ремень"),
+    ("Кабель Xiaomi USB", "кабель xiaomi usb"),
+    ("Сумка Deuter euro", "сумка deuter euro"),
+])
+def test_variant_name_keeps_words_starting_like_size_prefixes(name, expected):
+    assert names.variant_name(name) == expected
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("«Самокат  Globber X584» синий (2 шт)", "самокат globber x584"),
+    ("Самокат Globber X584, Blue, упаковка 5 шт", "самокат globber x584"),
+    ("Бутылка для воды Camelbak D842 серый x10", "бутылка для воды camelbak d842"),
+    ("Бутылка Camelbak D842 x10 шт", "бутылка camelbak d842"),
+    ("Мяч Select Brillant 2 x 5", "мяч select brillant"),
+    ("Мяч Select Brillant упаковка x5", "мяч select brillant"),
+])
+def test_canonical_name_strips_packs(name, expected):
+    assert names.canonical_name(name) == expected
+
+
+def test_canonical_name_keeps_model_suffix():
+    assert names.canonical_name("Самокат Razor X5") == "самокат razor x5"
+    assert names.name_key("Самокат Razor X5") != names.name_key("Самокат Razor X3")
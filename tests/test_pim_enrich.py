@@ -0,0 +1,27 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core  # noqa: E402
+import pim_enrich  # noqa: E402
+
+
+def test_already_filled_keeps_fallback_source():
+    conn = core.init_db(":memory:")
+    for i in range(6):
+        conn.execute(
+            "INSERT INTO products (sku, name, category, length_cm, width_cm, height_cm, weight_kg, "
+            "enrich_source, enrich_status) VALUES (?, ?, 'Каски', 30, 20, 10, 1.0, 'category_default', 'enriched')",
+            (f"s{i}", f"Каска {i}"))
+    rows = conn.execute("SELECT id, sku, name, category, length_cm, width_cm, height_cm, weight_kg FROM products")
+    for pid, sku, name, category, *dims in rows.fetchall():
+        prod = dict(zip(("id", "sku", "name", "category", "length_cm", "width_cm", "height_cm", "weight_kg"),
+                        (pid, sku, name, category, *dims)))
+        updated, method = pim_enrich.enrich_product(prod, conn, "")
+        assert method == "already_filled"
+        pim_enrich.save_enrichment(conn, updated, method, [pid])
+
+    assert {r[0] for r in conn.execute("SELECT enrich_source FROM products")} == {"category_default"}
+    assert conn.execute("SELECT COUNT(*) FROM dim_stats").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM pim_enrichment_log WHERE method = 'already_filled'").fetchone()[0] == 6
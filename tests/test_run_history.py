@@ -0,0 +1,54 @@
+import csv
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import run_history  # noqa: E402
+
+pa = pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_history, "HISTORY_DIR", str(tmp_path / "history"))
+    monkeypatch.setattr(run_history, "BLOCK_SIZE", 64 << 10)
+    return tmp_path
+
+
+def write_csv(path, rows, categories):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["SKU", "Название", run_history.CATEGORY, "Тип", run_history.RRC, run_history.MARGIN])
+        for i in range(rows):
+            # Первые блоки — 40 категорий, дальше — сотни: больше лимита автоматического словаря
+            n = 40 if i < rows // 4 else categories
+            w.writerow([f"sku{i}", f"Товар {i}", f"Категория {i % n}", "МГТ" if i % 2 else "КГТ",
+                        1000 + i, 20.5])
+
+
+def test_save_csv_multi_block_dictionaries(history):
+    path = history / "result.csv"
+    write_csv(path, 40_000, 300)
+    assert os.path.getsize(path) > 10 * run_history.BLOCK_SIZE
+
+    run_id = run_history.save_csv(str(path), "mvideo", {"params": {}})
+    table = run_history.open_run(run_id)
+    assert table.num_rows == 40_000
+    assert pa.types.is_dictionary(table.schema.field(run_history.CATEGORY).type)
+    assert table.column(run_history.CATEGORY).cast(pa.string()).unique().to_pylist().__len__() == 300
+    assert run_history.read_meta(run_id)["rows"] == 40_000
+
+
+def test_diff_runs_by_sku(history):
+    a, b = history / "a.csv", history / "b.csv"
+    write_csv(a, 1_000, 50)
+    write_csv(b, 1_001, 60)
+    run_a = run_history.save_csv(str(a), "dns", {})
+    run_b = run_history.save_csv(str(b), "dns", {})
+    summary, table = run_history.diff_runs(run_a, run_b)
+    assert summary["added"] == 1 and summary["removed"] == 0
+    assert summary["category_changed"] > 0
+    assert table.num_rows == summary["added"] + summary["category_changed"]